@@ -4,7 +4,6 @@ from logging.config import dictConfig
 from celery import Celery
 from flask import Flask, Response
 from flask.logging import default_handler
-from flask_redis import FlaskRedis
 from flask_socketio import SocketIO
 from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect
@@ -12,6 +11,8 @@ from flask_wtf.csrf import CSRFProtect
 from config import config
 
 from .errors import register as register_errors
+from .storage import Storage
+from .utils import response_formatter
 
 dictConfig(
     {
@@ -35,7 +36,7 @@ dictConfig(
 
 csrf = CSRFProtect()
 socketio = SocketIO()
-redis_client = FlaskRedis(decode_responses=True, encoding="utf-8")
+redis_client = Storage(decode_responses=True, encoding="utf-8")
 celery = Celery(
     __name__,
     broker=os.environ.get("CELERY_BROKER_URL"),
@@ -43,13 +44,27 @@ celery = Celery(
 )
 celery.config_from_object("celeryconfig")
 
+from .roles import Replica  # noqa
+from .nearcache import NearCache  # noqa
+
+replica = Replica()
+near_cache = NearCache()
+
 # Import celery task so that it is registered with the Celery workers
-from .timers import times_up  # noqa
-from .tasks import filterer  # noqa
+from .timers import local_timers, times_up  # noqa
+from .tasks import recover_rooms, sweep_rooms, teardown_rooms  # noqa
 
 # Import Socket.IO events so that they are registered with Flask-SocketIO
 # from .events import GameNamespace
+from .api.captionthisAPI import CaptionThis
+from .api.controllerAPI import ControllerAPI
 from .events import GameNamespace
+from .roles import RedisRoles, broker_options, message_queue, pool_options
+from .readiness import Readiness
+from . import metrics
+
+redis_roles = RedisRoles()
+readiness = Readiness()
 
 
 def create_app(config_name=None, main=True) -> Flask:
@@ -60,6 +75,12 @@ def create_app(config_name=None, main=True) -> Flask:
         config_name = os.environ.get("CAPTIONTHIS_CONFIG", "development")
     app: Flask = Flask(__name__)
     app.config.from_object(config[config_name])
+    # Readiness only waits for players whose heartbeat is fresh
+    CaptionThis.presence_timeout = app.config["PRESENCE_TIMEOUT"]
+    # Every key of a room expires once the room stays idle for this long
+    ControllerAPI.room_ttl = app.config["ROOM_TTL"]
+    # Every transition is appended to its game's stream
+    CaptionThis.journal_maxlen = app.config["EVENT_STREAM_MAXLEN"]
 
     # Initialize extensions
     if main:
@@ -70,6 +91,7 @@ def create_app(config_name=None, main=True) -> Flask:
         socketio.init_app(app, 
             message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"], 
             cors_allowed_origins=[],
+            **_client_manager(app, write_only=False),
         )
     else:
         # Initialize socketio to emit events through through the message queue
@@ -79,13 +101,25 @@ def create_app(config_name=None, main=True) -> Flask:
             None,
             message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"],
             async_mode="threading",
+            **_client_manager(app, write_only=True),
         )
 
     CORS(app)
     csrf.init_app(app)
 
+    if not main and app.config["STORAGE_BACKEND"] == "memory":
+        # Celery workers would keep a state of their own
+        raise RuntimeError("The memory storage backend only runs in one process")
     if not app.testing:
-        redis_client.init_app(app)
+        redis_client.init_app(app, **pool_options(app.config, "state"))
+    redis_roles.init_app(app)
+    celery.conf.update(broker_options(app.config))
+    replica.init_app(app)
+    # Workers don't cache but publish the invalidations of what they write
+    near_cache.init_app(app, cache=main)
+    if main:
+        local_timers.init_app(app)
+        readiness.init_app(app)
 
     # Import routes
     from .views.main import main_bp
@@ -104,9 +138,34 @@ def create_app(config_name=None, main=True) -> Flask:
         return Response(status=200)
    
     # For GKE Readiness Probe
+    # Verdict of the background checks of Redis, Memegen and the load
     @app.route('/ready')
-    def readiness():
-        return Response(status=200)
+    def readiness_probe():
+        return response_formatter(readiness.status, 200 if readiness.ready() else 503)
+
+    # Latency of the Redis server behind every role
+    @app.route('/health/redis')
+    def redis_health():
+        latency = redis_roles.check()
+        code = 503 if None in latency.values() else 200
+        return response_formatter({"latency_ms": latency}, code)
+
+    # Hits, misses, invalidations and evictions of the games' near cache
+    @app.route('/metrics/near-cache')
+    def near_cache_metrics():
+        return response_formatter(dict(near_cache.stats, size=len(near_cache.entries)))
+
+    # Everything above, the rooms, sockets, events and backlogs for Prometheus
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    # Timer lateness, handlers, transitions and emits of this process
+    @app.route('/metrics/latency')
+    def latency_metrics():
+        return response_formatter(
+            {histogram.name: histogram.snapshot() for histogram in metrics.HISTOGRAMS}
+        )
 
     # Register error handlers
     register_errors(app)
@@ -126,3 +185,9 @@ def create_app(config_name=None, main=True) -> Flask:
     app.logger.info("[+] CaptionThis startup...")
 
     return app
+
+
+def _client_manager(app: Flask, write_only: bool) -> dict:
+    """Socket.IO's options to emit through the pub/sub role's own pool"""
+    queue = message_queue(app.config, write_only)
+    return {"client_manager": queue} if queue else {}
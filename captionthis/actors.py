@@ -0,0 +1,174 @@
+import json
+import logging
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from flask import current_app
+
+from . import redis_client, socketio
+from .api.captionthisAPI import CaptionThis
+from .api.controllerAPI import ControllerAPI
+from .utils import game_key
+
+# Only the owner of the lease may extend or drop it
+RENEW_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class GameActor:
+    """Run every command of a room serially on exactly one owner.
+
+    Commands are pushed into the room's mailbox (game:{1234}:mailbox). Whoever
+    holds the room's lease (game:{1234}:lease) drains the mailbox in order while
+    everybody else only enqueues. A lease that is not renewed expires, so
+    another server or worker takes over the room if its owner dies.
+
+    While the lease is held the room's instance and the state of its last
+    commit stay in memory between its commands, so they don't read the game
+    again. Every transition is still written through in its own commit, which
+    checks the version the state was kept at. A write from outside the actor
+    (join_game) makes it conflict, the retry reads the game from Redis.
+
+    A command sleeps through the waits of its transition, which can outlast
+    ACTOR_LEASE_TTL, so the lease is renewed in the background while the
+    mailbox is drained.
+    """
+
+    def __init__(self):
+        self.owner = uuid.uuid4().hex
+        self.handlers: Dict[str, Callable] = {}
+        self.games: Dict[str, CaptionThis] = {}
+
+    def handler(self, op: str) -> Callable:
+        """Register a command that can be sent to the rooms' mailboxes
+
+        Args:
+            op (str): command's name
+
+        The handler is called with the room's CaptionThis instance followed by
+        the arguments given to submit().
+        """
+
+        def decorator(f):
+            self.handlers[op] = f
+            return f
+
+        return decorator
+
+    def submit(self, gid: str, op: str, *args) -> int:
+        """Enqueue a command and run the room if nobody else owns it
+
+        Args:
+            gid (str): game's ID
+            op (str): command's name
+            args: JSON serializable arguments of the command
+
+        Returns:
+            int: amount of commands processed by this call
+        """
+        redis_client.rpush(f"{game_key(gid)}:mailbox", json.dumps([op, args]))
+        return self.run(gid)
+
+    def run(self, gid: str) -> int:
+        """Drain the room's mailbox if the lease can be acquired
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            int: amount of commands processed
+        """
+        processed = 0
+        while self._acquire(gid):
+            try:
+                with self._heartbeat(gid):
+                    processed += self._drain(gid)
+            finally:
+                self.games.pop(gid, None)
+                self._release(gid)
+            # A command may be enqueued after the last pop but before the
+            # release, its sender could not own the room so it is ours to run.
+            if not redis_client.llen(f"{game_key(gid)}:mailbox"):
+                break
+        return processed
+
+    def _drain(self, gid: str) -> int:
+        processed = 0
+        while (msg := redis_client.lpop(f"{game_key(gid)}:mailbox")) is not None:
+            op, args = json.loads(msg)
+            if (game := self._load(gid)) is None:
+                # The room is gone, nothing left to apply the commands to
+                redis_client.delete(f"{game_key(gid)}:mailbox")
+                break
+            if handler := self.handlers.get(op):
+                try:
+                    handler(game, *args)
+                except Exception as e:
+                    logging.error(f"[{gid}] {op} failed: {e}", exc_info=True)
+            else:
+                logging.warning("Unknown command %s for game %s", op, gid)
+            processed += 1
+            if not self._renew(gid, current_app.config["ACTOR_LEASE_TTL"]):
+                logging.warning("Lost the lease of game %s", gid)
+                break
+        return processed
+
+    def _load(self, gid: str) -> Optional[CaptionThis]:
+        if gid not in self.games:
+            room = ControllerAPI.game(gid)
+            if not room:
+                return None
+            game = CaptionThis(gid, room["g_status"], **room["g_info"])
+            game.keep_state = True
+            self.games[gid] = game
+        return self.games[gid]
+
+    @contextmanager
+    def _heartbeat(self, gid: str):
+        """Keep renewing the lease until the block is over or the lease is lost"""
+        ttl = current_app.config["ACTOR_LEASE_TTL"]
+        running = [True]
+
+        def beat():
+            while True:
+                socketio.sleep(ttl / 3000)
+                if not running[0] or not self._renew(gid, ttl):
+                    return
+
+        socketio.start_background_task(beat)
+        try:
+            yield
+        finally:
+            running[0] = False
+
+    def _acquire(self, gid: str) -> bool:
+        return bool(
+            redis_client.set(
+                f"{game_key(gid)}:lease",
+                self.owner,
+                nx=True,
+                px=current_app.config["ACTOR_LEASE_TTL"],
+            )
+        )
+
+    def _renew(self, gid: str, ttl: int) -> bool:
+        return bool(
+            redis_client.eval(RENEW_LEASE, 1, f"{game_key(gid)}:lease", self.owner, ttl)
+        )
+
+    def _release(self, gid: str):
+        redis_client.eval(RELEASE_LEASE, 1, f"{game_key(gid)}:lease", self.owner)
+
+
+actor = GameActor()
@@ -1 +1 @@
-from .. import redis_client
+from .. import near_cache, redis_client, replica
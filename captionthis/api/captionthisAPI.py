@@ -1,55 +1,67 @@
-import logging
-from dataclasses import dataclass
-from typing import Dict, List, Sequence, Tuple, Optional
-
-from redis import WatchError
-
-from . import redis_client
-from ..errors import ActivityError, CaptionError, VoteError
-from ..utils import Section
-from ..models import Player, Caption
-
-
-class PipelineWrapper:
-    """Wrapper for Redis Pipelining"""
-
-    def __init__(self):
-        self.pipe = redis_client.pipeline()
-
-    def __enter__(self):
-        return self.pipe
-
-    def __exit__(self, exc_type, exc_value, exc_traceback):
-        if exc_type:
-            logging.error(f"{exc_type} - {exc_value}", exc_info=True)
-        self.pipe.execute()
-        # Swallow any exception coming into this context manager
-        return True
-
-
-class RedisMonitor(PipelineWrapper):
-    """Monitor for race condition and retry"""
-
-    def __init__(self, key):
-        self.key = key
-        super().__init__()
-
-    def __enter__(self, *args, **kwargs):
-        self.error_count = 0
-        while True:
-            try:
-                self.pipe.watch(self.key)
-                return super().__enter__(*args, **kwargs)
-            except WatchError:
-                # Retry if error
-                self.error_count += 1
-                logging.warning(
-                    "WatchError #%d: %s; retrying", self.error_count, self.key
-                )
-
-    def __exit__(self, exc_type, exc_value, exc_traceback):
-        self.pipe.unwatch()
-        return super().__exit__(exc_type, exc_value, exc_traceback)
+import json
+import time
+from dataclasses import InitVar, dataclass, fields
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import near_cache, redis_client
+from .controllerAPI import RECOUNT, ControllerAPI
+from .. import journal, rules
+from ..errors import StaleState
+from ..utils import LEADERBOARD_WINDOWS, game_key, leaderboard_key, presence_key
+
+# Fields of the game's info hash written by save()
+INFO_FIELDS = (
+    "status",
+    "rounds_remain",
+    "current_section",
+    "current_memer",
+    "current_memer_idx",
+)
+
+# Apply the writes of a game computed from the given version of its state, if
+# nothing was written since, then recount its readiness, bump the version and
+# slide the room's expiry. KEYS are the room's keys, its info hash second.
+# Returns the new version and the counts, or -1 alone on a conflict.
+COMMIT = (
+    """
+local version = tonumber(redis.call('hget', KEYS[2], 'version') or '0')
+if version ~= tonumber(ARGV[1]) then
+    return {-1}
+end
+for _, command in ipairs(cjson.decode(ARGV[2])) do
+    redis.call(unpack(command))
+end
+"""
+    + RECOUNT
+    + """
+version = redis.call('hincrby', KEYS[2], 'version', 1)
+if tonumber(ARGV[3]) > 0 then
+    for i = 1, #KEYS do
+        redis.call('expire', KEYS[i], ARGV[3])
+    end
+end
+return {version, ready, required}
+"""
+)
+
+
+def unpack_captions(packed: Dict[str, str]) -> Dict[str, Tuple[str, int]]:
+    """Read the captions hash of a game
+
+    Each caption takes two fields: the memer's ID holds the meme's fingerprint
+    and "<memer's ID>:score" its score, so votes can HINCRBY it.
+
+    Args:
+        packed (Dict[str, str]): fields of game:{1234}:captions
+
+    Returns:
+        Dict[str, Tuple[str, int]]: memer's ID -> (fingerprint, score)
+    """
+    return {
+        pid: (key, int(packed.get(f"{pid}:score", 0)))
+        for pid, key in packed.items()
+        if not pid.endswith(":score")
+    }
 
 
 @dataclass(eq=False)
@@ -63,248 +75,299 @@ class CaptionThis:
     current_section: str
     current_memer: str
     current_memer_idx: str
-
-    def __post_init__(self):
+    # Bumped by every commit, see COMMIT
+    version: InitVar[str] = "0"
+    # Players who acted in the section and players it waits for, recounted
+    # by every commit. Missing from rooms that were never committed.
+    ready: InitVar[str] = "0"
+    required: InitVar[str] = "0"
+
+    # Seconds without a heartbeat before a player stops being waited for,
+    # set from PRESENCE_TIMEOUT by create_app(). 0 counts every player.
+    presence_timeout = 0
+    # Transitions kept in the stream of every game, set from
+    # EVENT_STREAM_MAXLEN by create_app(). 0 keeps none.
+    journal_maxlen = 0
+    # Keep the state of the last commit for the next event instead of reading
+    # the room again, see GameActor. A conflict in COMMIT drops it.
+    keep_state = False
+
+    def __post_init__(self, version: str, ready: str, required: str):
         """__post_init__."""
-        self.ns = f"game:{self.gid}"
+        self.ns = game_key(self.gid)
+        self.version = int(version)
         self.max_players: int = int(self.max_players)
         self.total_rounds: int = int(self.total_rounds)
         self.duration: int = int(self.duration)
         self.rounds_remain: int = int(self.rounds_remain)
         self.current_section: int = int(self.current_section)
         self.current_memer_idx: int = int(self.current_memer_idx)
+        self.ready = int(ready)
+        self.required = int(required)
+        self.kept: Optional[rules.GameState] = None
 
-    @property
-    def players(self) -> Dict[str, Player]:
-        """Get a list of connected players in this game
+    def reload(self) -> bool:
+        """Read the game's status, info and version again after a conflict
 
         Returns:
-            Dict[str, Player]: Player's ID as key and its information as value.
+            bool: False if the game is gone
         """
-        result = {}
-        for pid in redis_client.lrange(f"{self.ns}:players", 0, -1):
-            result[pid] = redis_client.hgetall(f"{self.ns}:player:{pid}")
-        return result
-
-    @property
-    def activity_list(self) -> List[str]:
-        """Get a list of activities in the current section
-
-        Returns:
-            List[str]: A list of players' ID.
-        """
-        return redis_client.lrange(f"{self.ns}:activity", 0, -1)
-
-    @property
-    def captions(self) -> Dict[str, Caption]:
-        """Get captions from Redis
-
-        Returns:
-            Dict[str, Caption]: A dictionary with player's ID as key and their caption as value.
-        """
-        results = {}
-        for pid in self.players.keys():
-            key = f"{self.ns}:player:{pid}:caption"
-            if redis_client.exists(key):
-                results[pid] = redis_client.hgetall(key)
-        return results
+        if not (room := ControllerAPI.game(self.gid)):
+            return False
+        fresh = CaptionThis(self.gid, room["g_status"], **room["g_info"])
+        for field in fields(self):
+            setattr(self, field.name, getattr(fresh, field.name))
+        self.version = fresh.version
+        self.ready = fresh.ready
+        self.required = fresh.required
+        self.kept = None
+        return True
 
-    @property
-    def caption(self) -> Optional[Caption]:
-        """Get caption of the current memer.
+    def _apply(self, pipe):
+        """Run the writes queued into a pipeline as one commit
 
-        Returns:
-            Caption:
-        """
-        return redis_client.hgetall(f"{self.ns}:player:{self.current_memer}:caption")
-
-    def commit(self):
-        """Update game's info to redis"""
-        with PipelineWrapper() as pipe:
-            pipe.set(self.ns, self.status)
-            pipe.hsetnx(f"{self.ns}:info", "total_rounds", self.total_rounds)
-            pipe.hset(f"{self.ns}:info", "rounds_remain", self.rounds_remain)
-            pipe.hset(f"{self.ns}:info", "current_section", self.current_section)
-            pipe.hset(f"{self.ns}:info", "current_memer_idx", self.current_memer_idx)
-            pipe.hset(f"{self.ns}:info", "current_memer", self.current_memer)
-
-    def start_game(self):
-        """switchs section to 'caption' and begins keeping track of rounds played"""
-        self.current_section = Section.CAPTION.value
-        self.rounds_remain -= 1
-        self.status = "1"
-        self.commit()
-
-    def set_next_memer(self) -> bool:
-        """Turn next player to a memer
+        The pipeline is never executed, its commands are sent to COMMIT which
+        applies them only if the game is still at the version this instance
+        was read at.
 
-        Returns:
-            bool: False if the current memer disconnected, True if everything is normal
-        """
-        current_memer = self._get_current_memer()
-        state = True
-        # choose next memer if current memer hasn't disconnected from the game
-        if self.current_memer == current_memer:
-            self.current_memer_idx += 1
-            # next memer is out of index then go back to first player
-            if not (self._get_current_memer()):
-                self.current_memer_idx = 0
-                state = False
-        self.current_memer = self._get_current_memer()
-        self.commit()
-        return state
-
-    def player_ready(self, pid: str):
-        """Add player to activitiy list
         Args:
-            pid (str): player's ID
-        """
-        # Only for wait and final section.
-        if self.current_section in [Section.WAIT.value, Section.RESTART.value]:
-            # The game must be playable.
-            if len(self.players) + 1 >= 3:
-                with RedisMonitor(f"{self.ns}:activity") as mon:
-                    self.activity = mon.lrange(f"{self.ns}:activity", 0, -1)
-                    players = self._get_players_id()
-                    if pid in players and pid not in self.activity:
-                        mon.lpush(f"{self.ns}:activity", pid)
-                        # Avoid extra call in all_ready()
-                        self.activity.append(pid)
-                        return
-        raise ActivityError("Invalid or duplication player's id in activity list")
-
-    def all_ready(self) -> bool:
-        """Check if every player has acted
+            pipe: pipeline the writes were queued into
 
-        Returns:
-            bool: Returns 'True' if all players are ready. 'False' otherwise.
+        Raises:
+            StaleState: the game was written since, reload() it and retry
         """
-        players = redis_client.llen(f"{self.ns}:players")
-        condition = len(self.activity)
-        if self.current_section == Section.VOTE.value:
-            # ignore memer
-            players -= 1
-        return True if condition == players else False
-
-    def add_meme(self, pid: str, key: str):
-        """Store submitted meme to Redis
-
-        i.e: game:1234:player:pid:caption: {'key': key, 'score': 0}
+        commands = [
+            [arg.decode() if isinstance(arg, bytes) else str(arg) for arg in args]
+            for args, _ in pipe.command_stack
+        ]
+        keys = ControllerAPI.room_keys(self.gid)
+        version, *tally = redis_client.eval(
+            COMMIT,
+            len(keys),
+            *keys,
+            self.version,
+            json.dumps(commands),
+            ControllerAPI.room_ttl,
+        )
+        if version < 0:
+            raise StaleState(f"Game {self.gid} changed since version {self.version}")
+        self.version = version
+        self.ready, self.required = tally
+
+    def _queue_commit(self, pipe):
+        """Queue the writes of the game's info"""
+        pipe.set(self.ns, self.status)
+        pipe.hsetnx(f"{self.ns}:info", "total_rounds", self.total_rounds)
+        pipe.hset(f"{self.ns}:info", "rounds_remain", self.rounds_remain)
+        pipe.hset(f"{self.ns}:info", "current_section", self.current_section)
+        pipe.hset(f"{self.ns}:info", "current_memer_idx", self.current_memer_idx)
+        pipe.hset(f"{self.ns}:info", "current_memer", self.current_memer)
+        near_cache.invalidate(self.gid, pipe)
+
+    def state(self, event: Optional[NamedTuple] = None) -> rules.GameState:
+        """Load what the rules need to apply an event in a single round trip
+
+        An event that can't end the section, by the readiness counted in the
+        info hash, is applied on the acting player's part of the room. Any
+        other one loads every player of the room.
 
         Args:
-            pid (str): memer's ID
-            key (str): fingerprint of the meme
-        """
-        if self.current_section == Section.CAPTION.value and key:
-            if pid == self.current_memer:
-                if not (redis_client.exists(f"{self.ns}:player:{pid}:caption")):
-                    redis_client.hset(f"{self.ns}:player:{pid}:caption", "key", key)
-                    redis_client.hset(f"{self.ns}:player:{pid}:caption", "score", 0)
-                    return
-        raise CaptionError("Invalid or duplication player's id in captions list")
+            event (Optional[NamedTuple]): event to apply, every player is
+                loaded without one
 
-    def vote(self, pid: str, score: int):
-        """Vote the meme
+        The state kept from the last commit, if any, is used as it is. Only
+        its absent players are read again.
 
-        Args:
-            pid (str): voter's ID
-            score (int): score to be add by the voter
+        Returns:
+            GameState: snapshot of the game
         """
-        if score % 5 == 0 and 0 <= score <= 10:
-            with RedisMonitor(f"{self.ns}:activity") as mon:
-                if (
-                    self.current_section == Section.VOTE.value
-                    and pid != self.current_memer
-                ):
-                    self.activity = mon.lrange(f"{self.ns}:activity", 0, -1)
-                    cap_key = f"{self.ns}:player:{self.current_memer}:caption"
-                    cap = mon.hgetall(cap_key)
-                    if pid not in self.activity and cap:
-                        new_score = int(cap["score"]) + score
-                        mon.hset(cap_key, "score", new_score)
-                        mon.lpush(f"{self.ns}:activity", pid)
-                        self.activity.append(pid)
-                        return
-            raise VoteError(
-                "[Vote] Invalid or duplication player's id in activity list"
+        if self.kept is not None:
+            if not self.presence_timeout:
+                return self.kept
+            absent = redis_client.zrangebyscore(
+                f"{self.ns}:presence", "-inf", self._cutoff()
             )
-        raise VoteError("[Vote] Invalid score")
-
-    def add_point(self, pids: List[str]):
-        """Add one point to every winner
+            return self.kept._replace(
+                absent=frozenset(absent).intersection(self.kept.players)
+            )
+        if event is not None and not rules.ends_section(
+            event, self.current_section, self.ready, self.required
+        ):
+            if (state := self._acting_state(event)) is not None:
+                return state
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(f"{self.ns}:players", 0, -1)
+            pipe.smembers(f"{self.ns}:activity")
+            pipe.hgetall(f"{self.ns}:roster")
+            pipe.zrange(f"{self.ns}:scores", 0, -1, withscores=True)
+            pipe.hgetall(f"{self.ns}:captions")
+            if self.presence_timeout:
+                pipe.zrangebyscore(f"{self.ns}:presence", "-inf", self._cutoff())
+            players, activity, roster, scores, packed, *absent = pipe.execute()
+        names = {pid: roster.get(pid, "") for pid in players}
+        points = dict.fromkeys(players, 0)
+        points.update((pid, int(score)) for pid, score in scores if pid in points)
+        return rules.GameState(
+            *self._info(),
+            tuple(players),
+            names,
+            points,
+            frozenset(activity),
+            unpack_captions(packed),
+            frozenset(absent[0]).intersection(players) if absent else frozenset(),
+        )
+
+    def _acting_state(self, event: NamedTuple) -> Optional[rules.GameState]:
+        """The acting player's part of the room, with the room's tally
 
         Args:
-            pids (List[str]): winners' ID
-        """
-        for pid in pids:
-            redis_client.hincrby(f"{self.ns}:player:{pid}", "points", 1)
-
-    def reset(self, new_game: bool = False):
-        """Clear game's state
-
-        Args:
-            new_game (bool): Flag to start a fresh game
-        """
-        pids = self._get_players_id()
-        with PipelineWrapper() as pipe:
-            for pid in pids:
-                if new_game:
-                    pipe.hset(f"{self.ns}:player:{pid}", "points", 0)
-                pipe.delete(f"{self.ns}:player:{pid}:caption")
-            pipe.delete(f"{self.ns}:activity")
-        if new_game:
-            self.current_section = Section.reset()
-            self.current_memer = ""
-            self.current_memer_idx = 0
-            self.rounds_remain = self.total_rounds
-        self.commit()
-
-    def get_winner(self) -> List[Sequence[Tuple[str, str, str]]]:
-        """Get winners who have the highest score in this round.
-
-        Returns:
-            List[Tuple[str, str, str]]: A list of tuples containing player's ID,
-            caption's fingerprint and score
-        """
-        captions = self.captions
-        highest_score = 0
-        winners = []
-        for pid, caption in captions.items():
-            if (score := int(caption["score"])) > 0:
-                if score > highest_score:
-                    highest_score = score
-                    winners = [(pid, *caption.values())]
-                elif score == highest_score:
-                    winners.append((pid, *caption.values()))
-        return winners
-
-    def is_playable(self) -> bool:
-        """Game is playable if there are more than 3 connected players.
+            event (NamedTuple): PlayerReady or VoteCast
 
         Returns:
-            bool: 'True' if there more than 3 connected players. 'False' otherwise.
+            Optional[GameState]: None if absent players may be what the
+            section waits for, the whole room must be loaded then
         """
-        if self.current_section != Section.WAIT.value:
-            return True if redis_client.llen(f"{self.ns}:players") > 2 else False
-        else:
-            return True if redis_client.llen(f"{self.ns}:players") != 0 else False
-
-    def clear_activity(self):
-        """clear_activity."""
-        redis_client.delete(f"{self.ns}:activity")
-
-    def _get_players_id(self) -> List[str]:
-        """Private function to get a list of connected players.
+        memer = self.current_memer
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hexists(f"{self.ns}:roster", event.pid)
+            pipe.sismember(f"{self.ns}:activity", event.pid)
+            pipe.hmget(f"{self.ns}:captions", memer, f"{memer}:score")
+            if self.presence_timeout:
+                pipe.zcount(f"{self.ns}:presence", "-inf", self._cutoff())
+            joined, acted, (key, score), *absent = pipe.execute()
+        # Absent players are not waited for, at most all of them are waived
+        if absent and rules.ends_section(
+            event, self.current_section, self.ready, self.required - absent[0]
+        ):
+            return None
+        return rules.GameState(
+            *self._info(),
+            players=(event.pid,) if joined else (),
+            activity=frozenset((event.pid,)) if acted else frozenset(),
+            captions={memer: (key, int(score or 0))} if key else {},
+            tally=(self.ready, self.required),
+        )
+
+    def _info(self) -> tuple:
+        """Fields of the game's info hash in the order of GameState"""
+        return (
+            self.gid,
+            self.status,
+            self.max_players,
+            self.total_rounds,
+            self.duration,
+            self.rounds_remain,
+            self.current_section,
+            self.current_memer,
+            self.current_memer_idx,
+        )
+
+    def save(
+        self,
+        old: rules.GameState,
+        new: rules.GameState,
+        event: Optional[NamedTuple] = None,
+        effects: List[NamedTuple] = (),
+    ):
+        """Write what changed between two states of this game
+
+        Scores and points are written as increments so that concurrent votes
+        add up instead of overwriting each other. The room's keys, its info
+        and the transition's entry in its stream are written in one commit,
+        the global indexes live in other hash slots and are updated right
+        after it. A transition that cancels the timer drops it in that commit
+        too, so the timer can't go off on the new state.
 
-        Returns:
-            List[str]: a list of connected players' ID
+        Args:
+            old (GameState): state the rules were applied to
+            new (GameState): resulting state
+            event (Optional[NamedTuple]): event the rules applied, it is
+                appended to the game's stream along with the effects
+            effects (List[NamedTuple]): effects to carry out
+
+        Raises:
+            StaleState: the game was written since old was read, nothing was
+                written
         """
-        return redis_client.lrange(f"{self.ns}:players", 0, -1)
-
-    def _get_current_memer(self) -> str:
-        """Private function to get current memer.
+        left = set(old.players) - set(new.players)
+        won = {}
+        changed = False
+        for field in INFO_FIELDS:
+            if getattr(old, field) != getattr(new, field):
+                setattr(self, field, getattr(new, field))
+                changed = True
+        with redis_client.pipeline(transaction=False) as pipe:
+            for pid in left:
+                pipe.lrem(f"{self.ns}:players", 1, pid)
+                pipe.srem(f"{self.ns}:activity", pid)
+                pipe.hdel(f"{self.ns}:captions", pid, f"{pid}:score")
+                pipe.hdel(f"{self.ns}:roster", pid)
+                pipe.zrem(f"{self.ns}:scores", pid)
+                pipe.hdel(f"{self.ns}:sessions", pid)
+                pipe.hdel(f"{self.ns}:away", pid)
+                pipe.zrem(f"{self.ns}:presence", pid)
+            if old.activity and not new.activity:
+                pipe.delete(f"{self.ns}:activity")
+            elif added := new.activity - old.activity:
+                pipe.sadd(f"{self.ns}:activity", *added)
+            cap_key = f"{self.ns}:captions"
+            if old.captions and not new.captions:
+                pipe.delete(cap_key)
+            for pid, (key, score) in new.captions.items():
+                if (before := old.captions.get(pid)) is None:
+                    pipe.hset(cap_key, mapping={pid: key, f"{pid}:score": score})
+                elif score != before[1]:
+                    pipe.hincrby(cap_key, f"{pid}:score", score - before[1])
+            for pid, points in new.points.items():
+                if points != (before := old.points.get(pid, 0)):
+                    if points == 0:
+                        pipe.zadd(f"{self.ns}:scores", {pid: 0})
+                    else:
+                        pipe.zincrby(f"{self.ns}:scores", points - before, pid)
+                        name = new.names.get(pid)
+                        won[name] = won.get(name, 0) + points - before
+            if changed:
+                self._queue_commit(pipe)
+            if any(type(effect) is rules.CancelTimer for effect in effects):
+                # The running timer is void from this commit on, not once the
+                # rules' waits before its CancelTimer are over
+                pipe.delete(f"{self.ns}:timer")
+            if self.journal_maxlen and event is not None:
+                pipe.xadd(
+                    journal.events_key(self.gid),
+                    journal.entry(event, new, effects),
+                    maxlen=self.journal_maxlen,
+                    approximate=True,
+                )
+            self._apply(pipe)
+        # COMMIT checks the version it was kept at before it is written on
+        self.kept = new if self.keep_state and new.tally is None else None
+        tracked = self.journal_maxlen and event is not None
+        if left or won or tracked:
+            with redis_client.pipeline(transaction=False) as pipe:
+                if left:
+                    members = (f"{self.gid}:{pid}" for pid in left)
+                    pipe.zrem(presence_key(self.gid), *members)
+                self._rank(pipe, won)
+                if tracked:
+                    journal.track(pipe, self.gid, event, effects, time.time())
+                pipe.execute()
+
+    @staticmethod
+    def _rank(pipe, won: Dict[Optional[str], int]):
+        """Queue the points won by players into the global leaderboards
 
-        Returns:
-            str: memer's ID
+        Args:
+            pipe: non-transactional pipeline, the shards span hash slots
+            won (Dict[Optional[str], int]): player's name -> points won
         """
-        return redis_client.lindex(f"{self.ns}:players", self.current_memer_idx)
+        for name, points in won.items():
+            if name and points > 0:
+                for window, (_, ttl) in LEADERBOARD_WINDOWS.items():
+                    key = leaderboard_key(window, name)
+                    pipe.zincrby(key, points, name)
+                    pipe.expire(key, ttl)
+
+    def _cutoff(self) -> float:
+        """Heartbeats older than this timestamp are stale"""
+        return time.time() - self.presence_timeout
@@ -1,18 +1,144 @@
 # Main handler between Redis and backend
 import random
+import secrets
+import time
+import zlib
 from datetime import timedelta
 from collections import namedtuple
-from typing import Optional, List, Union
-
-from . import redis_client
-from ..utils import generate_game_id, validate_game
-from ..timers import remove_timer
-from ..models import JoinRoomResult, RoomInformation, Client
+from typing import Dict, Optional, List, Tuple, Union
+
+from . import near_cache, redis_client, replica
+from ..utils import (
+    Section,
+    deadlines_key,
+    game_key,
+    games_key,
+    generate_game_id,
+    leaderboard_index,
+    presence_key,
+    shard_keys,
+    validate_game,
+)
+from ..models import JoinRoomResult, Player, RoomInformation, Client
+
+# The audience's votes are spread over this many hashes per room
+AUDIENCE_SHARDS = 8
+
+# Ranks of the global leaderboard past this one are not served, every shard
+# is read up to it
+LEADERBOARD_DEPTH = 1000
+
+# Keys of a game under its namespace, besides the audience's shards
+GAME_KEYS = (
+    "info",
+    "activity",
+    "players",
+    "mailbox",
+    "sessions",
+    "away",
+    "sockets",
+    "leaving",
+    "leaving:due",
+    "presence",
+    "scores",
+    "roster",
+    "captions",
+    "audience",
+    "timer",
+    "events",
+)
+
+# Mark a player away, unless another socket took its slot over since
+MARK_AWAY = """
+if redis.call("HGET", KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call("HSET", KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+# Delete what is left of a room, unless it was created again in the meantime
+DELETE_DEAD_ROOM = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return -1
+end
+return redis.call('unlink', unpack(KEYS))
+"""
+
+# Count the players who acted in the room's section and the players it waits
+# for into its info hash, readiness is checked on them without the room's sets.
+# KEYS are the room's keys, see room_keys().
+RECOUNT = f"""
+local ready = redis.call('scard', KEYS[3])
+local required = redis.call('llen', KEYS[4])
+if redis.call('hget', KEYS[2], 'current_section') == '{Section.VOTE.value}' then
+    required = required - 1
+end
+redis.call('hset', KEYS[2], 'ready', ready, 'required', required)
+"""
+
+# Remove every key of a room, they are freed in the background. Its players
+# are returned to take them off the presence index.
+REMOVE_ROOM = """
+local players = redis.call('lrange', KEYS[tonumber(ARGV[1])], 0, -1)
+redis.call('unlink', unpack(KEYS))
+return players
+"""
+
+# Rooms without an expiry are looked at again after this long, in seconds
+SWEEP_RECHECK = 3600
+
+# Seconds a room waits for its first player
+LOBBY_TIMEOUT = 300
+
+# Slide the expiry of every key of a room, missing keys are skipped
+REFRESH_TTL = """
+if ARGV[2] and redis.call('ttl', KEYS[2]) > tonumber(ARGV[2]) then
+    return 0
+end
+for i = 1, #KEYS do
+    redis.call('expire', KEYS[i], ARGV[1])
+end
+return #KEYS
+"""
+
+# Count a spectator's vote once per turn, only while the players are voting.
+# The info hash and the audience's shard share the game's hash tag.
+AUDIENCE_VOTE = """
+local info = redis.call(
+    'hmget', KEYS[1], 'current_section', 'current_memer', 'rounds_remain'
+)
+if info[1] ~= '2' then
+    return false
+end
+local turn = info[2] .. ':' .. info[3]
+if turn == ARGV[2] then
+    return false
+end
+redis.call('hincrby', KEYS[2], turn .. ':score', ARGV[1])
+redis.call('hincrby', KEYS[2], turn .. ':votes', 1)
+return turn
+"""
+
+# Pop a batch of members whose heartbeat is older than the cutoff
+POP_STALE = """
+local stale = redis.call(
+    'zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2]
+)
+if #stale > 0 then
+    redis.call('zrem', KEYS[1], unpack(stale))
+end
+return stale
+"""
 
 
 class ControllerAPI:
     """Manages all transactions for game creations"""
 
+    # Seconds a room's keys outlive its last activity, set from ROOM_TTL by
+    # create_app(). 0 keeps them until the room is removed.
+    room_ttl = 0
+
     @staticmethod
     def create_game(
         plrs: str, rounds: str, duration: str, overrideGID: str = None
@@ -31,13 +157,15 @@ class ControllerAPI:
         validate_game(int(plrs), int(rounds), int(duration))
 
         gid = overrideGID if overrideGID else generate_game_id()
-        while redis_client.get(f"game:{gid}") is not None:
+        while redis_client.get(game_key(gid)) is not None:
             gid = generate_game_id()
 
-        game_ns = f"game:{gid}"
+        game_ns = game_key(gid)
+        # Every key of the room shares its hash slot, the index lives elsewhere.
+        # It is ordered by when the room is expected to expire.
+        redis_client.zadd(games_key(gid), {gid: time.time() + LOBBY_TIMEOUT})
         with redis_client.pipeline() as pipe:
             pipe.multi()
-            pipe.lpush("games", gid)
             # Set a 5 minutes timeout if the room is inactive.
             pipe.setex(game_ns, timedelta(minutes=5), value="0")
             pipe.hset(f"{game_ns}:info", "max_players", plrs)
@@ -47,6 +175,8 @@ class ControllerAPI:
             pipe.hset(f"{game_ns}:info", "current_section", 0)
             pipe.hset(f"{game_ns}:info", "current_memer", "")
             pipe.hset(f"{game_ns}:info", "current_memer_idx", "0")
+            if ControllerAPI.room_ttl:
+                pipe.expire(f"{game_ns}:info", timedelta(minutes=5))
             pipe.execute()
 
         return gid
@@ -58,23 +188,50 @@ class ControllerAPI:
         Args:
           gid (str): game's id
         """
-        game_ns = f"game:{gid}"
-        players = redis_client.lrange(f"{game_ns}:players", 0, -1)
-
-        with redis_client.pipeline() as pipe:
-            pipe.multi()
-            pipe.lrem("games", 0, gid)
-            pipe.delete(game_ns)
-            pipe.delete(f"{game_ns}:info")
-            pipe.delete(f"{game_ns}:activity")
-            pipe.delete(f"{game_ns}:players")
+        # The room's timer goes with its keys, its task finds no timer to fire
+        keys = ControllerAPI.room_keys(gid)
+        players_idx = keys.index(f"{game_key(gid)}:players") + 1
+        players = redis_client.eval(REMOVE_ROOM, len(keys), *keys, players_idx)
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zrem(games_key(gid), gid)
+            pipe.zrem(deadlines_key(gid), gid)
             if players:
-                for plr in players:
-                    pipe.delete(f"{game_ns}:player:{plr}")
-                    pipe.delete(f"{game_ns}:player:{plr}:caption")
+                pipe.zrem(presence_key(gid), *(f"{gid}:{plr}" for plr in players))
+            near_cache.invalidate(gid, pipe)
             pipe.execute()
 
-        remove_timer(gid)
+    @staticmethod
+    def room_keys(gid: str) -> List[str]:
+        """Every key a room may have, they all share the room's hash slot
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            List[str]: keys of the room
+        """
+        game_ns = game_key(gid)
+        keys = [game_ns]
+        keys += [f"{game_ns}:{name}" for name in GAME_KEYS]
+        keys += [f"{game_ns}:audience:{shard}" for shard in range(AUDIENCE_SHARDS)]
+        return keys
+
+    @staticmethod
+    def refresh(gid: str, pipe, lazy: bool = False):
+        """Queue the sliding expiry of every key of a room into a pipeline
+
+        Args:
+            gid (str): game's ID
+            pipe: pipeline of the write that keeps the room alive
+            lazy (bool): only slide it once half of the TTL has run out, the
+                keys all slide together so the info hash stands for them
+        """
+        if ControllerAPI.room_ttl:
+            keys = ControllerAPI.room_keys(gid)
+            args = [ControllerAPI.room_ttl]
+            if lazy:
+                args.append(ControllerAPI.room_ttl // 2)
+            pipe.eval(REFRESH_TTL, len(keys), *keys, *args)
 
     @staticmethod
     def join_game(gid: str, name: str) -> JoinRoomResult:
@@ -87,7 +244,7 @@ class ControllerAPI:
         Returns:
             JoinRoomResult:
         """
-        game_ns = f"game:{gid}"
+        game_ns = game_key(gid)
         game = ControllerAPI.game(gid)
 
         result = {
@@ -100,30 +257,66 @@ class ControllerAPI:
             # remove the expiration
             redis_client.persist(game_ns)
 
-            # Add player
+            # Add player, HSETNX claims the ID so concurrent joins can't share it
             p_id = str(random.getrandbits(32))
-            if (players := redis_client.lrange(f"{game_ns}:players", 0, -1)) != []:
-                while p_id in players:
-                    p_id = str(random.getrandbits(32))
-
-            redis_client.rpush(f"{game_ns}:players", p_id)
-            redis_client.hset(f"{game_ns}:player:{p_id}", "name", name)
-            redis_client.hset(f"{game_ns}:player:{p_id}", "points", 0)
-
-            # Save one call to get game:####:players
-            players.append(p_id)
-
-            if len(players) == int(result["g_info"]["max_players"]):
-                redis_client.set(game_ns, 2)
+            while not redis_client.hsetnx(f"{game_ns}:roster", p_id, name):
+                p_id = str(random.getrandbits(32))
+
+            with redis_client.pipeline() as pipe:
+                pipe.multi()
+                pipe.rpush(f"{game_ns}:players", p_id)
+                pipe.zadd(f"{game_ns}:scores", {p_id: 0})
+                # Transitions computed without this player are applied again
+                pipe.hincrby(f"{game_ns}:info", "version", 1)
+                keys = ControllerAPI.room_keys(gid)
+                pipe.eval(RECOUNT, len(keys), *keys)
+                ControllerAPI.refresh(gid, pipe)
+                total_players = pipe.execute()[0]
+
+            max_players = int(result["g_info"]["max_players"])
+            if total_players > max_players:
+                # Another player took the last slot in the meantime
+                ControllerAPI.kick(gid, p_id)
+                return result
+            if total_players == max_players:
+                with redis_client.pipeline() as pipe:
+                    pipe.set(game_ns, 2, keepttl=True)
+                    pipe.hincrby(f"{game_ns}:info", "version", 1)
+                    near_cache.invalidate(gid, pipe)
+                    pipe.execute()
 
             result["p_id"] = p_id
             result["g_status"] = redis_client.get(game_ns)
-            result["g_players"] = {}
-            for id in players:
-                result["g_players"][id] = redis_client.hgetall(f"{game_ns}:player:{id}")
+            result["g_players"] = ControllerAPI.roster(gid)
 
         return result
 
+    @staticmethod
+    def roster(gid: str) -> Dict[str, Player]:
+        """Retrieve every player of the game in a single round trip
+
+        Names are read from the room's roster (game:{1234}:roster), kept up to
+        date as players join and leave, instead of every player's hash.
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            Dict[str, Player]: Player's ID as key and its information as value,
+            in the order they joined.
+        """
+        game_ns = game_key(gid)
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(f"{game_ns}:players", 0, -1)
+            pipe.hgetall(f"{game_ns}:roster")
+            pipe.zrange(f"{game_ns}:scores", 0, -1, withscores=True)
+            players, names, scores = pipe.execute()
+        points = dict(scores)
+        return {
+            pid: {"name": names.get(pid, ""), "points": str(int(points.get(pid, 0)))}
+            for pid in players
+        }
+
     @staticmethod
     def kick(gid: str, pid: str):
         """Remove a connected player from the game
@@ -132,56 +325,574 @@ class ControllerAPI:
             gid (str): game's ID
             pid (str): player's ID
         """
-        game_ns = f"game:{gid}"
+        game_ns = game_key(gid)
         redis_client.lrem(f"{game_ns}:players", 1, pid)
-        redis_client.lrem(f"{game_ns}:activity", 1, pid)
-        redis_client.delete(f"{game_ns}:player:{pid}")
-        redis_client.delete(f"{game_ns}:player:{pid}:caption")
+        redis_client.srem(f"{game_ns}:activity", pid)
+        redis_client.hdel(f"{game_ns}:captions", pid, f"{pid}:score")
+        redis_client.hdel(f"{game_ns}:roster", pid)
+        redis_client.zrem(f"{game_ns}:scores", pid)
+        redis_client.hdel(f"{game_ns}:sessions", pid)
+        redis_client.hdel(f"{game_ns}:away", pid)
+        redis_client.hdel(f"{game_ns}:sockets", pid)
+        redis_client.zrem(f"{game_ns}:presence", pid)
+        redis_client.zrem(presence_key(gid), f"{gid}:{pid}")
+        keys = ControllerAPI.room_keys(gid)
+        with redis_client.pipeline() as pipe:
+            pipe.eval(RECOUNT, len(keys), *keys)
+            pipe.hincrby(f"{game_ns}:info", "version", 1)
+            pipe.execute()
+
+    @staticmethod
+    def touch(gid: str, pid: str):
+        """Record that the player is still connected
+
+        The room's index (game:{1234}:presence) is what readiness is counted
+        on, the global one (presence:{<shard>}) is what the sweeper walks.
+
+        Args:
+            gid (str): game's ID
+            pid (str): player's ID
+        """
+        now = time.time()
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(f"{game_key(gid)}:presence", {pid: now})
+            pipe.zadd(presence_key(gid), {f"{gid}:{pid}": now})
+            ControllerAPI.refresh(gid, pipe, lazy=True)
+            pipe.execute()
+
+    @staticmethod
+    def pop_stale(cutoff: float, count: int) -> List[Tuple[str, str]]:
+        """Take players whose last heartbeat is older than the cutoff
+
+        Every shard of the presence index is popped in turn until the batch is
+        full.
+
+        Args:
+            cutoff (float): UNIX timestamp
+            count (int): maximum amount of players to take
+
+        Returns:
+            List[Tuple[str, str]]: game's ID and player's ID of each player
+        """
+        stale = []
+        for key in shard_keys("presence"):
+            if len(stale) >= count:
+                break
+            stale += redis_client.eval(POP_STALE, 1, key, cutoff, count - len(stale))
+        return [tuple(member.rsplit(":", 1)) for member in stale]
+
+    @staticmethod
+    def open_session(gid: str, pid: str) -> str:
+        """Issue a token the player can resume its slot with after a disconnect
+
+        Args:
+            gid (str): game's ID
+            pid (str): player's ID
+
+        Returns:
+            str: session's token
+        """
+        secret = secrets.token_urlsafe(16)
+        with redis_client.pipeline() as pipe:
+            pipe.hset(f"{game_key(gid)}:sessions", pid, secret)
+            ControllerAPI.refresh(gid, pipe)
+            pipe.execute()
+        return f"{pid}.{secret}"
+
+    @staticmethod
+    def away(gid: str, pid: str, sid: str) -> bool:
+        """Mark a disconnected player as away until it resumes or gets kicked
+
+        Args:
+            gid (str): game's ID
+            pid (str): player's ID
+            sid (str): Socket.IO request's UUID the player disconnected from
+
+        Returns:
+            bool: False if the player's slot was taken over by another socket,
+            the disconnect is then not the player's anymore
+        """
+        game_ns = game_key(gid)
+        with redis_client.pipeline() as pipe:
+            pipe.eval(MARK_AWAY, 2, f"{game_ns}:sockets", f"{game_ns}:away", pid, sid)
+            ControllerAPI.refresh(gid, pipe)
+            return bool(pipe.execute()[0])
+
+    @staticmethod
+    def resume(gid: str, token: str, sid: str) -> Optional[str]:
+        """Reattach a player to its slot from a new socket
+
+        A valid token takes the slot over whether the player is marked away
+        yet or not, the disconnect of the previous socket is then ignored.
+
+        Args:
+            gid (str): game's ID
+            token (str): session's token given by open_session
+            sid (str): Socket.IO request's UUID the player resumes from
+
+        Returns:
+            Optional[str]: player's ID, None if the token is invalid
+        """
+        game_ns = game_key(gid)
+        pid, _, secret = token.partition(".")
+        if not secret or redis_client.hget(f"{game_ns}:sessions", pid) != secret:
+            return None
+        with redis_client.pipeline() as pipe:
+            pipe.hset(f"{game_ns}:sockets", pid, sid)
+            pipe.hdel(f"{game_ns}:away", pid)
+            ControllerAPI.refresh(gid, pipe)
+            pipe.execute()
+        return pid
+
+    @staticmethod
+    def gone(gid: str, pid: str, sid: str) -> bool:
+        """Check whether a player is still away since the given disconnect
+
+        Args:
+            gid (str): game's ID
+            pid (str): player's ID
+            sid (str): Socket.IO request's UUID the player disconnected from
+
+        Returns:
+            bool: True if the player did not come back
+        """
+        return redis_client.hget(f"{game_key(gid)}:away", pid) == sid
+
+    @staticmethod
+    def buffer_leave(gid: str, pid: str, window: float) -> bool:
+        """Buffer a leaving player so the room's departures are applied at once
+
+        Args:
+            gid (str): game's ID
+            pid (str): player's ID
+            window (float): seconds the departures are buffered for
+
+        Returns:
+            bool: True if this is the first departure of the window, the caller
+            has to schedule the flush.
+        """
+        game_ns = game_key(gid)
+        with redis_client.pipeline() as pipe:
+            pipe.multi()
+            pipe.sadd(f"{game_ns}:leaving", pid)
+            # Expires in case the flush got lost
+            pipe.set(f"{game_ns}:leaving:due", 1, nx=True, px=int(window * 2000))
+            return bool(pipe.execute()[1])
 
     @staticmethod
-    def game(gid: str) -> Union[RoomInformation, dict]:
+    def take_leaving(gid: str) -> List[str]:
+        """Pop every buffered departure of the room
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            List[str]: players' ID
+        """
+        game_ns = game_key(gid)
+        with redis_client.pipeline() as pipe:
+            pipe.multi()
+            pipe.smembers(f"{game_ns}:leaving")
+            pipe.delete(f"{game_ns}:leaving")
+            pipe.delete(f"{game_ns}:leaving:due")
+            return sorted(pipe.execute()[0])
+
+    @staticmethod
+    def game(
+        gid: str, max_staleness: float = 0, cached: bool = False
+    ) -> Union[RoomInformation, dict]:
         """Retrieve game in Redis
 
         Args:
             gid (str): game's id
+            max_staleness (float): seconds the game may lag behind, a replica
+                is read from if it keeps up. 0 reads from the primary.
+            cached (bool): go through the near cache, if it is enabled
 
         Returns:
             Union[RoomInformation, dict]:
         """
-        game_ns = f"game:{gid}"
-        if redis_client.get(game_ns) is not None:
+        if cached and near_cache.enabled:
+            if game := near_cache.get(gid):
+                return game
+            if game := ControllerAPI.game(gid, max_staleness):
+                near_cache.put(gid, game)
+            return game
+        db = replica.reader(max_staleness) or redis_client
+        game_ns = game_key(gid)
+        if db.get(game_ns) is not None:
             result = {
-                "g_info": redis_client.hgetall(f"{game_ns}:info"),
-                "g_status": redis_client.get(game_ns),
+                "g_info": db.hgetall(f"{game_ns}:info"),
+                "g_status": db.get(game_ns),
             }
             return result
+        if ControllerAPI.migrate_game(gid):
+            return ControllerAPI.game(gid)
         return {}
 
     @staticmethod
-    def games() -> List[str]:
+    def migrate_game(gid: str) -> bool:
+        """Move a game from its untagged keys (game:1234:*) to game:{1234}:*
+
+        Rooms created before their keys were tagged with the game's ID are
+        re-homed under the tag. Every player's hash (game:1234:player:<pid>)
+        and caption (game:1234:player:<pid>:caption) of the per-player layout
+        is folded into the roster, the scoreboard and the captions hash on the
+        way. The old keys are watched so it is safe to run while the game is
+        played, and the room is added to the sharded indexes.
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            bool: True if the game was migrated, False if there was nothing to do
+        """
+        legacy = f"game:{gid}"
+        game_ns = game_key(gid)
+        if not redis_client.exists(legacy):
+            return False
+        # Keys moved as they are, the players' ones are merged
+        merged_names = ("roster", "scores", "captions")
+        moved = [name for name in GAME_KEYS if name not in merged_names]
+        moved += [f"audience:{shard}" for shard in range(AUDIENCE_SHARDS)]
+        merged = [f"{legacy}:{name}" for name in merged_names]
+        watched = [legacy] + [f"{legacy}:{name}" for name in moved] + merged
+        presence = {}
+
+        def migrate(pipe) -> bool:
+            if not pipe.exists(legacy):
+                return False
+            players = pipe.lrange(f"{legacy}:players", 0, -1)
+            player_keys = []
+            for pid in players:
+                player_keys += [
+                    f"{legacy}:player:{pid}",
+                    f"{legacy}:player:{pid}:caption",
+                ]
+            if player_keys:
+                pipe.watch(*player_keys)
+            names = pipe.hgetall(f"{legacy}:roster")
+            scores = dict(pipe.zrange(f"{legacy}:scores", 0, -1, withscores=True))
+            captions = pipe.hgetall(f"{legacy}:captions")
+            for pid in players:
+                if player := pipe.hgetall(f"{legacy}:player:{pid}"):
+                    names[pid] = player.get("name", "")
+                    scores[pid] = int(player.get("points", 0))
+                if caption := pipe.hgetall(f"{legacy}:player:{pid}:caption"):
+                    captions[pid] = caption["key"]
+                    captions[f"{pid}:score"] = caption["score"]
+            presence.clear()
+            presence.update(pipe.zrange(f"{legacy}:presence", 0, -1, withscores=True))
+            present = [name for name in moved if pipe.exists(f"{legacy}:{name}")]
+            pipe.multi()
+            pipe.rename(legacy, game_ns)
+            for name in present:
+                pipe.rename(f"{legacy}:{name}", f"{game_ns}:{name}")
+            pipe.delete(*merged, *player_keys)
+            if names:
+                pipe.hset(f"{game_ns}:roster", mapping=names)
+            if scores:
+                pipe.zadd(f"{game_ns}:scores", scores)
+            if captions:
+                pipe.hset(f"{game_ns}:captions", mapping=captions)
+            # Marker of the per-player layout's migration, not a field of a game
+            pipe.hdel(f"{game_ns}:info", "layout")
+            pipe.lrem("games", 0, gid)
+            if players:
+                pipe.zrem("presence", *(f"{gid}:{pid}" for pid in players))
+            return True
+
+        if not redis_client.transaction(migrate, *watched, value_from_callable=True):
+            return False
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(games_key(gid), {gid: time.time() + LOBBY_TIMEOUT})
+            if presence:
+                pipe.zadd(
+                    presence_key(gid),
+                    {f"{gid}:{pid}": seen for pid, seen in presence.items()},
+                )
+            ControllerAPI.refresh(gid, pipe)
+            pipe.execute()
+        return True
+
+    @staticmethod
+    def migrate_games(batch: int = 500) -> int:
+        """Move every game listed in the untagged index 'games' under its tag
+
+        Games are also migrated the first time they are read, this catches up
+        with the idle ones. Every game read is taken off the old index.
+
+        Args:
+            batch (int): amount of games' ID read at once
+
+        Returns:
+            int: amount of games migrated
+        """
+        migrated = 0
+        while gids := redis_client.lrange("games", 0, batch - 1):
+            migrated += sum(ControllerAPI.migrate_game(gid) for gid in gids)
+            # Rooms that expired under the old prefix have nothing to move
+            with redis_client.pipeline(transaction=False) as pipe:
+                for gid in gids:
+                    pipe.lrem("games", 0, gid)
+                pipe.execute()
+        return migrated
+
+    @staticmethod
+    def games(max_staleness: float = 0) -> List[str]:
         """Retrieve open games
 
+        Args:
+            max_staleness (float): seconds the listing may lag behind, a
+                replica is read from if it keeps up. 0 reads from the primary.
+
         Returns:
             List: List of open game's ID.
         """
-        games = redis_client.lrange("games", 0, -1)
+        db = replica.reader(max_staleness) or redis_client
+        games = ControllerAPI.all_games(db)
         open_games = []
         for gid in games:
-            if redis_client.get(f"game:{gid}") == "0":
+            if db.get(game_key(gid)) == "0":
                 open_games.append(gid)
         return open_games
 
     @staticmethod
-    def get_client(sid: str) -> Optional[Client]:
+    def all_games(db=None) -> List[str]:
+        """Retrieve the ID of every game from all shards of the games index
+
+        Args:
+            db: Redis client to read from, defaults to the primary
+
+        Returns:
+            List[str]: games' ID
+        """
+        with (db or redis_client).pipeline(transaction=False) as pipe:
+            for key in shard_keys("games"):
+                pipe.zrange(key, 0, -1)
+            return [gid for gids in pipe.execute() for gid in gids]
+
+    @staticmethod
+    def sweep_rooms(batch: int = 500) -> Dict[str, int]:
+        """Remove every key of the rooms that expired
+
+        The games index is ordered by when each room is expected to expire, so
+        only the rooms past their deadline are looked at, at most a batch per
+        shard. A room still alive had its expiry slid, it is put back at its
+        new deadline.
+
+        Args:
+            batch (int): maximum amount of rooms looked at per shard
+
+        Returns:
+            Dict[str, int]: rooms examined, still alive and removed, and keys
+            deleted
+        """
+        cost = dict.fromkeys(("examined", "alive", "removed", "keys"), 0)
+        now = time.time()
+        for key in shard_keys("games"):
+            gids = redis_client.zrangebyscore(key, "-inf", now, start=0, num=batch)
+            if not gids:
+                continue
+            with redis_client.pipeline(transaction=False) as pipe:
+                for gid in gids:
+                    pipe.pttl(game_key(gid))
+                ttls = pipe.execute()
+            alive = {
+                gid: now + (ttl / 1000 if ttl > 0 else SWEEP_RECHECK)
+                for gid, ttl in zip(gids, ttls)
+                if ttl != -2
+            }
+            if alive:
+                redis_client.zadd(key, alive, xx=True)
+            removed = ControllerAPI.remove_expired(
+                [gid for gid in gids if gid not in alive]
+            )
+            cost["examined"] += len(gids)
+            cost["alive"] += len(alive)
+            cost["removed"] += len(removed)
+            cost["keys"] += sum(removed.values())
+        return cost
+
+    @staticmethod
+    def remove_expired(gids: List[str]) -> Dict[str, int]:
+        """Remove what is left of rooms whose status key expired
+
+        A room created again under the same ID in the meantime is left alone.
+
+        Args:
+            gids (List[str]): games' IDs
+
+        Returns:
+            Dict[str, int]: ID of every room removed -> keys deleted
+        """
+        if not gids:
+            return {}
+        with redis_client.pipeline(transaction=False) as pipe:
+            for gid in gids:
+                keys = ControllerAPI.room_keys(gid)
+                pipe.eval(DELETE_DEAD_ROOM, len(keys), *keys)
+            deleted = pipe.execute()
+        removed = {gid: n for gid, n in zip(gids, deleted) if n >= 0}
+        with redis_client.pipeline(transaction=False) as pipe:
+            for gid in removed:
+                pipe.zrem(games_key(gid), gid)
+                pipe.zrem(deadlines_key(gid), gid)
+                near_cache.invalidate(gid, pipe)
+            pipe.execute()
+        return removed
+
+    @staticmethod
+    def watch(gid: str) -> Optional[dict]:
+        """Add a spectator to the room's audience
+
+        Spectators don't take a slot in the roster, they only get a snapshot
+        of the game to catch up with the events broadcast to the room.
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            Optional[dict]: game's status, info, players ranked by points and
+            the size of the audience. None if the game doesn't exist.
+        """
+        game_ns = game_key(gid)
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(game_ns)
+            pipe.hgetall(f"{game_ns}:info")
+            pipe.zrevrange(f"{game_ns}:scores", 0, -1, withscores=True)
+            status, info, scores = pipe.execute()
+        if status is None:
+            return None
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.incr(f"{game_ns}:audience")
+            pipe.hgetall(f"{game_ns}:roster")
+            audience, names = pipe.execute()
+        return {
+            "g_status": status,
+            "g_info": info,
+            "g_players": {
+                pid: {"name": names.get(pid, ""), "points": str(int(points))}
+                for pid, points in scores
+            },
+            "audience": audience,
+        }
+
+    @staticmethod
+    def unwatch(gid: str):
+        """Remove a spectator from the room's audience
+
+        Args:
+            gid (str): game's ID
+        """
+        # The room may have been removed while the spectator was watching
+        key = f"{game_key(gid)}:audience"
+        if redis_client.decr(key) < 0:
+            redis_client.delete(key)
+
+    @staticmethod
+    def audience_vote(
+        gid: str, sid: str, score: int, last_turn: Optional[str] = None
+    ) -> Optional[str]:
+        """Count a spectator's vote on the caption being voted on
+
+        Args:
+            gid (str): game's ID
+            sid (str): spectator's Socket.IO request's UUID, picks the shard
+            score (int): score given by the spectator
+            last_turn (str): turn the spectator last voted on
+
+        Returns:
+            Optional[str]: turn voted on, None if the players aren't voting or
+            the spectator already voted on this turn
+        """
+        shard = zlib.crc32(sid.encode()) % AUDIENCE_SHARDS
+        return redis_client.eval(
+            AUDIENCE_VOTE,
+            2,
+            f"{game_key(gid)}:info",
+            f"{game_key(gid)}:audience:{shard}",
+            score,
+            last_turn or "",
+        )
+
+    @staticmethod
+    def tally_audience(gid: str, memer: str, rounds_remain: int) -> Tuple[int, int]:
+        """Sum up then clear the audience's votes
+
+        Args:
+            gid (str): game's ID
+            memer (str): memer's ID of the turn
+            rounds_remain (int): rounds remaining during the turn
+
+        Returns:
+            Tuple[int, int]: amount of votes and total score
+        """
+        turn = f"{memer}:{rounds_remain}"
+        with redis_client.pipeline() as pipe:
+            for shard in range(AUDIENCE_SHARDS):
+                key = f"{game_key(gid)}:audience:{shard}"
+                pipe.hmget(key, f"{turn}:votes", f"{turn}:score")
+                pipe.delete(key)
+            results = pipe.execute()[::2]
+        votes = sum(int(v or 0) for v, _ in results)
+        score = sum(int(s or 0) for _, s in results)
+        return votes, score
+
+    @staticmethod
+    def leaderboard(
+        window: str, start: int = 0, count: int = 10
+    ) -> List[Tuple[str, int]]:
+        """Retrieve a range of the global leaderboard
+
+        Players are spread over the shards of the leaderboard by nickname, the
+        top of every shard is read and merged. Ranks past LEADERBOARD_DEPTH are
+        not served so a shard is never read deeper than that.
+
+        Args:
+            window (str): "daily" or "weekly"
+            start (int): rank to start from, 0 is the best player
+            count (int): amount of players
+
+        Raises:
+            KeyError: unknown window
+
+        Returns:
+            List[Tuple[str, int]]: player's name and points, highest first
+        """
+        index = leaderboard_index(window)
+        end = min(start + count, LEADERBOARD_DEPTH)
+        if start >= end:
+            return []
+        with redis_client.pipeline(transaction=False) as pipe:
+            for key in shard_keys(index):
+                pipe.zrevrange(key, 0, end - 1, withscores=True)
+            scores = [score for shard in pipe.execute() for score in shard]
+        # Same order as ZREVRANGE: highest points first, then by name
+        scores.sort(key=lambda score: (score[1], score[0]), reverse=True)
+        return [(name, int(points)) for name, points in scores[start:end]]
+
+    @staticmethod
+    def get_client(sid: str, refresh: bool = False) -> Optional[Client]:
         """Retrieve connected client in Redis
 
         Args:
             sid (str): Socket.IO request's UUID
+            refresh (bool): the client is alive, slide its expiry once half
+                of it has run out
 
         Returns:
             Client
         """
-        client = redis_client.hgetall(sid)
+        if not (refresh and ControllerAPI.room_ttl):
+            client = redis_client.hgetall(sid)
+        else:
+            with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hgetall(sid)
+                pipe.ttl(sid)
+                client, ttl = pipe.execute()
+            if client and ttl < ControllerAPI.room_ttl // 2:
+                redis_client.expire(sid, ControllerAPI.room_ttl)
         return Client(**client) if client else None
 
     @staticmethod
@@ -193,10 +904,13 @@ class ControllerAPI:
             pid (str): Connected player's ID
             gid (str): Game's ID
         """
-        with redis_client.pipeline() as pipe:
-            pipe.multi()
-            pipe.hset(sid, "id", pid)
-            pipe.hset(sid, "gid", gid)
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(sid, mapping={"id": pid, "gid": gid})
+            if ControllerAPI.room_ttl:
+                pipe.expire(sid, ControllerAPI.room_ttl)
+            # The socket the player is bound to, a disconnect from any other
+            # one is not the player's
+            pipe.hset(f"{game_key(gid)}:sockets", pid, sid)
             pipe.execute()
 
     @staticmethod
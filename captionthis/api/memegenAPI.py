@@ -3,6 +3,7 @@ import random
 from collections import namedtuple
 from typing import List
 
+from ..metrics import memegen_call
 from ..utils import encode
 
 Template = namedtuple(
@@ -16,10 +17,11 @@ def get_meme() -> Template:
     Returns:
         str: template's object
     """
-    template_ids = requests.get("http://memegen:5000/templates")
-    tid = random.choice(template_ids.json())
-    res = requests.get(f"http://memegen:5000/templates/{tid}").json()
-    return Template(**res)
+    with memegen_call("get_meme"):
+        template_ids = requests.get("http://memegen:5000/templates")
+        tid = random.choice(template_ids.json())
+        res = requests.get(f"http://memegen:5000/templates/{tid}").json()
+        return Template(**res)
 
 
 def create_meme(key: str, lines: List[str], gameID: str) -> str:
@@ -38,10 +40,27 @@ def create_meme(key: str, lines: List[str], gameID: str) -> str:
     """
     slug = encode(lines)
     url = f"http://memegen:5000/images/{key}/{slug}.jpg?gameID={gameID}"
-    res = requests.get(url)
-    if res.status_code == 200:
-        return res.json()
-    raise Exception("Request cannot be consume by Memegen service.")
+    with memegen_call("create_meme"):
+        res = requests.get(url)
+        if res.status_code == 200:
+            return res.json()
+        raise Exception("Request cannot be consume by Memegen service.")
+
+
+def available(timeout: float) -> bool:
+    """Whether Memegen answers, for the readiness checks
+
+    Args:
+        timeout (float): seconds to wait for it
+
+    Returns:
+        bool: it listed its templates
+    """
+    try:
+        res = requests.get("http://memegen:5000/templates", timeout=timeout)
+    except requests.RequestException:
+        return False
+    return res.status_code == 200
 
 
 def delete_game_assets(gameID: str):
@@ -50,4 +69,5 @@ def delete_game_assets(gameID: str):
     Args:
         gameID (str)
     """
-    return requests.delete(f"http://memegen:5000/images/{gameID}")
+    with memegen_call("delete_game_assets"):
+        return requests.delete(f"http://memegen:5000/images/{gameID}")
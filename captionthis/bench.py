@@ -0,0 +1,289 @@
+# Benchmarks run through manage.py
+import time
+from typing import Dict
+
+from .rules import (
+    CaptionSubmitted,
+    GameState,
+    PlayerReady,
+    VoteCast,
+    transition,
+)
+from .utils import Section, game_key
+
+
+def rules(transitions: int = 1_000_000, players: int = 5) -> float:
+    """Play whole games against the rules engine only
+
+    Args:
+        transitions (int): amount of events to apply
+        players (int): players in the game
+
+    Returns:
+        float: transitions per second
+    """
+    pids = tuple(str(i) for i in range(players))
+    state = GameState(
+        gid="1234",
+        status="0",
+        max_players=players,
+        total_rounds=3,
+        duration=10,
+        rounds_remain=3,
+        current_section=Section.WAIT.value,
+        current_memer="",
+        current_memer_idx=0,
+        players=pids,
+        names=dict.fromkeys(pids, "bench"),
+        points=dict.fromkeys(pids, 0),
+    )
+    applied = 0
+    start = time.perf_counter()
+    while applied < transitions:
+        if state.current_section in (Section.WAIT.value, Section.RESTART.value):
+            events = [PlayerReady(pid) for pid in pids]
+        else:
+            memer = state.current_memer
+            events = [CaptionSubmitted(memer, "fingerprint")]
+            events += [VoteCast(pid, 5) for pid in pids if pid != memer]
+        for event in events:
+            state, _ = transition(state, event)
+        applied += len(events)
+    return applied / (time.perf_counter() - start)
+
+
+def audience(watchers: int = 1000) -> Dict[str, float]:
+    """Load a room with spectators and measure its fan-out and audience votes
+
+    Runs against the Redis server of the app's configuration (REDIS_URL).
+
+    Args:
+        watchers (int): amount of spectators in the room
+
+    Returns:
+        Dict[str, float]: joins, deliveries and votes per second, and Redis
+        commands issued per spectator while broadcasting
+    """
+    from . import create_app, redis_client, socketio
+    from .api.controllerAPI import ControllerAPI
+
+    app = create_app("testing")
+    app.config["AUDIENCE_VOTING"] = True
+    redis_client.init_app(app)
+
+    def commands() -> int:
+        return redis_client.info("stats")["total_commands_processed"]
+
+    gid = ControllerAPI.create_game("3", "1", "10")
+    result = {}
+    clients = []
+    try:
+        start = time.perf_counter()
+        for _ in range(watchers):
+            clients.append(
+                socketio.test_client(
+                    app,
+                    namespace="/game",
+                    query_string=f"id={gid}&watch=1",
+                    flask_test_client=app.test_client(),
+                )
+            )
+        result["joins/s"] = watchers / (time.perf_counter() - start)
+
+        info = f"{game_key(gid)}:info"
+        redis_client.hset(info, "current_section", Section.VOTE.value)
+        before = commands()
+        start = time.perf_counter()
+        socketio.emit("gameTimeUp", room=gid, namespace="/game")
+        delivered = sum(len(c.get_received(namespace="/game")) for c in clients)
+        result["deliveries/s"] = delivered / (time.perf_counter() - start)
+        # INFO itself counts as one command
+        result["commands/watcher"] = (commands() - before - 1) / watchers
+
+        start = time.perf_counter()
+        for client in clients:
+            client.emit("audienceVote", 5, namespace="/game")
+        votes, _ = ControllerAPI.tally_audience(gid, "", 1)
+        result["votes/s"] = votes / (time.perf_counter() - start)
+    finally:
+        for client in clients:
+            client.disconnect(namespace="/game")
+        ControllerAPI.remove_game(gid)
+    return result
+
+
+def memory(sample: int = 1000) -> Dict[str, float]:
+    """Account for the memory used by the rooms
+
+    Sums MEMORY USAGE of every key of a sample of the rooms in the games index,
+    on the Redis server of the app's configuration (REDIS_URL).
+
+    Args:
+        sample (int): amount of rooms measured
+
+    Returns:
+        Dict[str, float]: rooms, bytes per room, keys left without an expiry
+        and the estimated bytes of all rooms
+    """
+    from . import create_app, redis_client
+    from .api.controllerAPI import ControllerAPI
+
+    app = create_app("testing")
+    redis_client.init_app(app)
+
+    gids = ControllerAPI.all_games()
+    sizes = []
+    persistent = 0
+    for gid in gids[:sample]:
+        keys = [k for k in ControllerAPI.room_keys(gid) if redis_client.exists(k)]
+        if not keys:
+            continue
+        with redis_client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+                pipe.ttl(key)
+            replies = pipe.execute()
+        sizes.append(sum(replies[::2]))
+        persistent += replies[1::2].count(-1)
+    mean = sum(sizes) / len(sizes) if sizes else 0
+    return {
+        "rooms": len(gids),
+        "sampled rooms": len(sizes),
+        "bytes/room": mean,
+        "max bytes/room": max(sizes, default=0),
+        "keys without ttl": persistent,
+        "estimated room bytes": mean * len(gids),
+        "used_memory": redis_client.info("memory")["used_memory"],
+    }
+
+
+def churn(
+    rate: int = 100, seconds: int = 60, ttl: int = 10, players: int = 5
+) -> Dict[str, float]:
+    """Create rooms at a steady rate and abandon them, memory must plateau
+
+    The rooms' keys slide on a short ROOM_TTL, so the rooms alive at once are
+    bounded by rate * ttl whatever the duration of the run.
+
+    Args:
+        rate (int): rooms created per second
+        seconds (int): duration of the run
+        ttl (int): ROOM_TTL used for the run
+        players (int): players joining each room
+
+    Returns:
+        Dict[str, float]: used memory at the start, its peak once the first
+        rooms expired, at the end, and the room keys left after a last ttl
+    """
+    from . import create_app, redis_client
+    from .api.controllerAPI import ControllerAPI
+
+    app = create_app("testing")
+    redis_client.init_app(app)
+    room_ttl, ControllerAPI.room_ttl = ControllerAPI.room_ttl, ttl
+
+    def used() -> int:
+        return redis_client.info("memory")["used_memory"]
+
+    result = {"start used_memory": used()}
+    gids = []
+    peak = 0
+    try:
+        start = time.perf_counter()
+        for second in range(seconds):
+            for _ in range(rate):
+                gid = ControllerAPI.create_game(str(players), "3", "60")
+                gids.append(gid)
+                for i in range(players):
+                    ControllerAPI.join_game(gid, f"bench{i}")
+            if second >= ttl:
+                peak = max(peak, used())
+            time.sleep(max(0.0, second + 1 - (time.perf_counter() - start)))
+        result["peak used_memory"] = peak
+        result["bound (rooms)"] = rate * ttl
+        result["end used_memory"] = used()
+        time.sleep(ttl + 1)
+        result["room keys left"] = sum(
+            redis_client.exists(*ControllerAPI.room_keys(gid)) for gid in gids
+        )
+    finally:
+        ControllerAPI.room_ttl = room_ttl
+        for gid in gids:
+            ControllerAPI.remove_game(gid)
+    return result
+
+
+def layout(rooms: int = 10_000, players: int = 5) -> Dict[str, float]:
+    """Memory used per game by the per-player keys and by the compact layout
+
+    Fills the Redis server of the app's configuration (REDIS_URL) with games in
+    the untagged per-player layout, migrates them, then removes them.
+
+    Args:
+        rooms (int): amount of games
+        players (int): players in each game
+
+    Returns:
+        Dict[str, float]: bytes and keys per game of both layouts, and
+        migrations per second
+    """
+    from . import create_app, redis_client
+    from .api.controllerAPI import ControllerAPI
+
+    app = create_app("testing")
+    redis_client.init_app(app)
+
+    def used() -> int:
+        return redis_client.info("memory")["used_memory"]
+
+    gids = [f"bench{i}" for i in range(rooms)]
+    pids = [str(1000000 + i) for i in range(players)]
+    result = {}
+    before, keys = used(), redis_client.dbsize()
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for gid in gids:
+                ns = f"game:{gid}"
+                pipe.set(ns, "1")
+                pipe.hset(
+                    f"{ns}:info",
+                    mapping={
+                        "max_players": players,
+                        "total_rounds": 3,
+                        "duration": 60,
+                        "rounds_remain": 2,
+                        "current_section": Section.VOTE.value,
+                        "current_memer": pids[0],
+                        "current_memer_idx": 0,
+                    },
+                )
+                pipe.rpush(f"{ns}:players", *pids)
+                pipe.sadd(f"{ns}:activity", *pids[1:])
+                for pid in pids:
+                    player = {"name": "bench", "points": 1}
+                    pipe.hset(f"{ns}:player:{pid}", mapping=player)
+                pipe.hset(
+                    f"{ns}:player:{pids[0]}:caption",
+                    mapping={"key": "aag/fingerprint.jpg", "score": 15},
+                )
+            pipe.execute()
+        result["per-player bytes/game"] = (used() - before) / rooms
+        result["per-player keys/game"] = (redis_client.dbsize() - keys) / rooms
+
+        start = time.perf_counter()
+        for gid in gids:
+            ControllerAPI.migrate_game(gid)
+        result["migrations/s"] = rooms / (time.perf_counter() - start)
+        result["compact bytes/game"] = (used() - before) / rooms
+        result["compact keys/game"] = (redis_client.dbsize() - keys) / rooms
+    finally:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for gid in gids:
+                ns = f"game:{gid}"
+                pipe.delete(ns, f"{ns}:info", f"{ns}:players", f"{ns}:activity")
+                pipe.delete(*(f"{ns}:player:{pid}" for pid in pids))
+                pipe.delete(f"{ns}:player:{pids[0]}:caption")
+            pipe.execute()
+        for gid in gids:
+            ControllerAPI.remove_game(gid)
+    return result
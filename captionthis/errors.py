@@ -31,6 +31,12 @@ class VoteError(CaptionThisError):
     pass
 
 
+class StaleState(CaptionThisError):
+    """The game was written since it was read, read it again and retry"""
+
+    pass
+
+
 def register(app):
     @app.errorhandler(400)
     @app.errorhandler(403)
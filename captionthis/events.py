@@ -1,20 +1,38 @@
-from flask import request, current_app
-from flask_socketio import Namespace, close_room, emit, join_room
+from flask import request, current_app, session
+from flask_socketio import Namespace, emit, join_room
 
 from .api.captionthisAPI import CaptionThis
 from .api.controllerAPI import Client, ControllerAPI
 
-from .api.memegenAPI import create_meme, delete_game_assets
+from .api.memegenAPI import create_meme
 
-from . import socketio
-from .utils import Section
-from .helpers import ingame_only, next_player_turn, switch_to, wait_for_transition
+from . import metrics
+from .helpers import dispatch, ingame_only, player_left
+from .rules import CaptionSubmitted, PlayerReady, VoteCast
+from .tasks import grace_expired, kick_if_gone
+from .timers import local_timers
 
 
 class GameNamespace(Namespace):
+    def trigger_event(self, event, *args):
+        # Every handled event is counted, whether the player is in a game or not
+        handler = f"on_{event}"
+        if hasattr(self, handler):
+            metrics.events.inc(handler)
+        return super().trigger_event(event, *args)
+
     def on_connect(self):
         game_id = request.args.get("id")
         nickname = request.args.get("name")
+        token = request.args.get("token")
+        if game_id and request.args.get("watch"):
+            return self._watch(game_id)
+        if (
+            game_id
+            and token
+            and (player_id := ControllerAPI.resume(game_id, token, request.sid))
+        ):
+            return self._resume(game_id, player_id)
         if not all([game_id, nickname]):
             return False
         data = ControllerAPI.join_game(game_id, nickname)
@@ -22,6 +40,10 @@ class GameNamespace(Namespace):
             return False
         join_room(game_id)
         ControllerAPI.add_client(request.sid, data["p_id"], game_id)
+        if current_app.config["PRESENCE_TIMEOUT"]:
+            ControllerAPI.touch(game_id, data["p_id"])
+        if current_app.config["RECONNECT_GRACE_PERIOD"]:
+            emit("gameSession", ControllerAPI.open_session(game_id, data["p_id"]))
         emit(
             "gameConnected",
             [
@@ -34,6 +56,7 @@ class GameNamespace(Namespace):
             "gamePlayerConnected",
             {data["p_id"]: data["g_players"].get(data["p_id"])},
             room=game_id,
+            include_self=False,
         )
         if len(data["g_players"]) >= 3:
             emit("gameReady", room=game_id)
@@ -42,16 +65,7 @@ class GameNamespace(Namespace):
 
     @ingame_only
     def on_playerReady(self, player: Client = None, game: CaptionThis = None):
-        game.player_ready(player.id)
-        emit("gamePlayerReady", player.id, room=player.gid)
-        if game.all_ready():
-            if game.current_section == Section.WAIT.value:
-                game.reset()
-            elif game.current_section == Section.RESTART.value:
-                game.reset(new_game=True)
-            game.start_game()
-            game.set_next_memer()
-            switch_to("caption", game)
+        dispatch(game, PlayerReady(player.id))
 
     @ingame_only
     def on_captionSubmit(
@@ -59,76 +73,83 @@ class GameNamespace(Namespace):
     ) -> None:
         if (key := data.get("key")) and (lines := data.get("lines")):
             fingerprint = create_meme(key, lines, player.gid)
-            game.add_meme(player.id, fingerprint)
-            emit("gamePlayerReady", player.id, room=player.gid)
-            switch_to("vote", game)
+            dispatch(game, CaptionSubmitted(player.id, fingerprint))
 
     @ingame_only
     def on_voteSubmit(
         self, data, player: Client = None, game: CaptionThis = None
     ) -> None:
         if data or data == 0:
-            game.vote(player.id, int(data))
-            emit("gamePlayerReady", player.id, room=player.gid)
+            dispatch(game, VoteCast(player.id, int(data)))
+
+    def on_audienceVote(self, data) -> None:
+        game_id = session.get("watching")
+        if not game_id or not current_app.config["AUDIENCE_VOTING"]:
+            return
+        try:
+            score = int(data)
+        except (TypeError, ValueError):
+            return
+        if score % 5 == 0 and 0 <= score <= 10:
+            # The turn is remembered per socket, a vote costs a single script
+            if turn := ControllerAPI.audience_vote(
+                game_id, request.sid, score, session.get("voted")
+            ):
+                session["voted"] = turn
+
+    def _watch(self, game_id: str):
+        """Join the room as a spectator, outside of the roster"""
+        if not (snapshot := ControllerAPI.watch(game_id)):
+            return False
+        join_room(game_id)
+        session["watching"] = game_id
+        emit("gameWatching", snapshot)
+
+    def _resume(self, game_id: str, player_id: str):
+        """Reattach a player who came back within the grace period"""
+        if not (room := ControllerAPI.game(game_id)):
+            return False
+        join_room(game_id)
+        ControllerAPI.add_client(request.sid, player_id, game_id)
+        if current_app.config["PRESENCE_TIMEOUT"]:
+            ControllerAPI.touch(game_id, player_id)
+        emit(
+            "gameConnected",
+            [
+                player_id,
+                ControllerAPI.roster(game_id),
+                room["g_info"]["total_rounds"],
+            ],
+        )
+        emit("gamePlayerBack", player_id, room=game_id)
 
-            if game.all_ready():
-                emit("gameGetScore", game.caption["score"], room=player.gid)
-                if next_player_turn(game):
-                    wait_for_transition(current_app.config["VOTE_WAIT_TIME"])
-                    switch_to("caption", game)
+    def on_heartbeat(self):
+        """Keep the player's session alive and the player in the room's presence
+        index"""
+        client = ControllerAPI.get_client(request.sid, refresh=True)
+        if client and current_app.config["PRESENCE_TIMEOUT"]:
+            ControllerAPI.touch(client.gid, client.id)
 
     def on_disconnect(self):
+        if game_id := session.get("watching"):
+            ControllerAPI.unwatch(game_id)
+            return
         if player := ControllerAPI.remove_client(request.sid):
             current_app.logger.info(f"Client {request.sid} disconnecting...")
-            if room := ControllerAPI.game(player.gid):
-                game = CaptionThis(player.gid, room["g_status"], **room["g_info"])
-                ControllerAPI.kick(player.gid, player.id)
-                emit("gamePlayerDisconnected", player.id, room=player.gid)
-                if game.is_playable():
-                    if (
-                        game.current_section == Section.WAIT.value
-                        or game.current_section == Section.RESTART.value
-                    ):
-                        if len(game.players) - len(game.activity_list) == 0:
-                            if game.current_section == Section.RESTART.value:
-                                game.reset(new_game=True)
-                            game.set_next_memer()
-                            game.start_game()
-                            switch_to("caption", game)
-                        elif game.status == "2":
-                            game.status = "0"
-                            game.commit()
-                            emit("gameOpen", room=player.gid)
-                    elif game.current_section == Section.CAPTION.value:
-                        if game.current_memer == player.id:
-                            # choose next memer then go to caption section
-                            if not game.set_next_memer():
-                                game.start_game()
-                            emit("gameReason", "Memer disconnected", room=player.gid)
-                            switch_to("caption", game)
-                    elif game.current_section == Section.VOTE.value:
-                        if game.current_memer == player.id:
-                            # choose next memer then go to caption section
-                            if not game.set_next_memer():
-                                game.start_game()
-                            emit("gameReason", "Memer disconnected", room=player.gid)
-                            switch_to("caption", game)
-                            return
-                        # exclude memer
-                        if len(game.players) - 1 - len(game.activity_list) == 0:
-                            game.set_next_memer()
-                            switch_to("caption", game)
+            if grace := current_app.config["RECONNECT_GRACE_PERIOD"]:
+                # Hold the slot, the player is kicked if it doesn't come back.
+                # A socket the player has since resumed from another one is
+                # ignored.
+                if not ControllerAPI.away(player.gid, player.id, request.sid):
+                    return
+                emit("gamePlayerAway", player.id, room=player.gid)
+                args = (player.gid, player.id, request.sid)
+                if local_timers.enabled:
+                    local_timers.call_later(grace, kick_if_gone, *args)
                 else:
-                    # remove if the game is not in wait with 1 or more players
-                    if (game.current_section != Section.WAIT.value) or (
-                        game.current_section == Section.WAIT.value
-                        and len(game.players) == 0
-                    ):
-                        emit("gameDisconnected", room=player.gid)
-                        close_room(player.gid)
-                        ControllerAPI.remove_game(player.gid)
-                        delete_game_assets(player.gid)
-                        current_app.logger.info(f"Close room {player.gid}")
+                    grace_expired.apply_async(args, countdown=grace)
+            else:
+                player_left(player.gid, player.id)
 
     def on_message(self, msg) -> None:
         current_app.logger.info(f"Foreign message from {request.sid}", msg)
@@ -1,15 +1,36 @@
+import time
 from functools import wraps
-from typing import Callable, Union
+from typing import Callable, Optional, Union
 
 from flask import current_app, request
 
-from . import socketio
-from .api.controllerAPI import ControllerAPI
-from .api.memegenAPI import get_meme
+from . import journal, metrics, socketio
+from .actors import actor
+from .api.controllerAPI import Client, ControllerAPI
+from .api.memegenAPI import delete_game_assets, get_meme
 from .api.captionthisAPI import CaptionThis
-from .errors import CaptionThisError
-from .timers import remove_timer, start_timer
-from .utils import Section
+from .errors import CaptionThisError, StaleState
+from .metrics import section_name
+from .rules import (
+    CancelTimer,
+    CloseRoom,
+    DeleteAssets,
+    Emit,
+    GameState,
+    PlayersLeft,
+    Settings,
+    StartRound,
+    StartTimer,
+    TallyAudience,
+    TimesUp,
+    Wait,
+    transition,
+)
+from .tasks import flush_leaving, take_leaving
+from .timers import current_timer, local_timers, remove_timer, start_timer
+
+# Times an event is applied again to a game that was written in the meantime
+STALE_RETRIES = 3
 
 
 def ingame_only(f):
@@ -19,11 +40,14 @@ def ingame_only(f):
     is registered and the player is in the game
     """
 
+    # Bound once, the handler is timed on every event
+    durations = metrics.handler_duration.by_section(f.__name__)
+
     @wraps(f)
     def wrapped(self, *args, **kwargs) -> Union[bool, Callable]:
         client = ControllerAPI.get_client(request.sid)
         if client:
-            game = ControllerAPI.game(client.gid)
+            game = ControllerAPI.game(client.gid, cached=True)
             if not game:
                 return False
         else:
@@ -31,88 +55,201 @@ def ingame_only(f):
                 "Foreign request id attempted to communicate with socket.io"
             )
             return False
+        if current_app.config["GAME_ACTORS"]:
+            # Let the owner of the room run the handler on its state
+            actor.submit(client.gid, f.__name__, request.sid, client.id, *args)
+            return
         game = CaptionThis(client.gid, game["g_status"], **game["g_info"])
         try:
-            return f(self, *args, **kwargs, player=client, game=game)
+            with durations[game.current_section].time():
+                return f(self, *args, **kwargs, player=client, game=game)
         except CaptionThisError as e:
             socketio.emit("gameException", e.msg, room=request.sid, namespace="/game")
 
+    @actor.handler(f.__name__)
+    def command(game: CaptionThis, sid: str, pid: str, *args):
+        namespace = socketio.server.namespace_handlers["/game"]
+        try:
+            with durations[game.current_section].time():
+                f(namespace, *args, player=Client(pid, game.gid), game=game)
+        except CaptionThisError as e:
+            socketio.emit("gameException", e.msg, room=sid, namespace="/game")
+
     return wrapped
 
 
-def wait_for_transition(time: 0):
-    socketio.sleep(time)
+def settings() -> Settings:
+    """Durations the rules need, from the app's configuration"""
+    return Settings(
+        current_app.config["TIME_DELAY"],
+        current_app.config["VOTE_WAIT_TIME"],
+        current_app.config["DEFAULT_VOTE_DURATION"],
+    )
 
 
-def switch_to(sect: str, game: CaptionThis):
-    game.clear_activity()
-    socketio.sleep(current_app.config["TIME_DELAY"])
-    if sect == "caption":
-        game.current_section = Section.CAPTION.value
-        template = get_meme()
+def dispatch(
+    game: CaptionThis, event, guard: Optional[Callable[[], bool]] = None
+) -> Optional[GameState]:
+    """Apply an event to the game, save the new state then carry out its effects
 
-        remove_timer(game.gid)
-        socketio.emit("gameTimeUp", room=game.gid, namespace="/game")
+    Args:
+        game (CaptionThis): game's instance
+        event: one of the events in rules
+        guard (Optional[Callable[[], bool]]): checked before every attempt,
+            the event is dropped once it doesn't hold, i.e the timer that
+            went off was replaced by the game the event is applied again to
 
-        socketio.emit(
-            "gameStart",
-            {
-                "template": template._asdict(),
-                "memer": game.current_memer,
-                "total_rounds": game.total_rounds,
-                "rounds_remain": game.rounds_remain,
-            },
-            room=game.gid,
-            namespace="/game",
-        )
+    Raises:
+        CaptionThisError: the event is not allowed in the current state
+        StaleState: the game kept changing under every attempt
 
-        start_timer(game.gid, game.duration)
-        socketio.emit("gameTimeStart", game.duration, room=game.gid, namespace="/game")
-    elif sect == "vote":
-        game.current_section = Section.VOTE.value
+    Returns:
+        Optional[GameState]: the new state of the game, None if the guard
+        dropped the event
+    """
+    start = time.perf_counter()
+    for attempt in range(STALE_RETRIES):
+        if guard is not None and not guard():
+            return None
+        state = game.state(event)
+        new_state, effects = transition(state, event, settings())
+        try:
+            game.save(state, new_state, event, effects)
+            break
+        except StaleState:
+            # The rules are applied again to what the game is now
+            if attempt == STALE_RETRIES - 1 or not game.reload():
+                raise
+    section = section_name(state.current_section)
+    for effect in effects:
+        run_effect(game.gid, effect, section)
+    # The rules' waits are on purpose, only the time spent on top counts
+    waited = sum(effect.seconds for effect in effects if type(effect) is Wait)
+    metrics.transition_latency.labels(type(event).__name__, section).observe(
+        (time.perf_counter() - start - waited) * 1000
+    )
+    return new_state
+
+
+def run_effect(gid: str, effect, section: str = ""):
+    """Carry out one of the effects returned by the rules
 
-        remove_timer(game.gid)
-        socketio.emit("gameTimeUp", room=game.gid, namespace="/game")
+    Args:
+        gid (str): game's ID
+        effect: one of the effects in rules
+        section (str): label of the section the event was applied in
+    """
+    kind = type(effect)
+    if kind is Emit:
+        with metrics.emit_fanout.labels(effect.event, section).time():
+            socketio.emit(effect.event, *effect.args, room=gid, namespace="/game")
+    elif kind is Wait:
+        socketio.sleep(effect.seconds)
+    elif kind is StartRound:
+        template = get_meme()._asdict()
+        with metrics.emit_fanout.labels("gameStart", section).time():
+            socketio.emit(
+                "gameStart",
+                {"template": template, **effect._asdict()},
+                room=gid,
+                namespace="/game",
+            )
+    elif kind is StartTimer:
+        start_timer(gid, effect.duration)
+    elif kind is CancelTimer:
+        remove_timer(gid)
+    elif kind is CloseRoom:
+        socketio.close_room(gid, namespace="/game")
+        ControllerAPI.remove_game(gid)
+        current_app.logger.info(f"Close room {gid}")
+    elif kind is DeleteAssets:
+        delete_game_assets(gid)
+    elif kind is TallyAudience:
+        if current_app.config["AUDIENCE_VOTING"]:
+            votes, score = ControllerAPI.tally_audience(gid, *effect)
+            if votes:
+                socketio.emit(
+                    "gameAudienceScore",
+                    {"votes": votes, "score": score},
+                    room=gid,
+                    namespace="/game",
+                )
+
+
+def player_left(gid: str, *pids: str):
+    """Remove players who are gone for good
+
+    Departures are buffered for DISCONNECT_COALESCE_WINDOW seconds so that
+    a whole server going down moves each of its rooms along only once.
 
-        socketio.emit("gameSwitchPage", "vote", room=game.gid, namespace="/game")
-        socketio.emit("gameGetCaption", game.caption, room=game.gid, namespace="/game")
+    Args:
+        gid (str): game's ID
+        pids (str): players' ID
+    """
+    if window := current_app.config["DISCONNECT_COALESCE_WINDOW"]:
+        if any([ControllerAPI.buffer_leave(gid, pid, window) for pid in pids]):
+            if local_timers.enabled:
+                local_timers.call_later(window, take_leaving, gid)
+            else:
+                flush_leaving.apply_async((gid,), countdown=window)
+    elif current_app.config["GAME_ACTORS"]:
+        actor.submit(gid, "leave", *pids)
+    elif room := ControllerAPI.game(gid):
+        leave_game(CaptionThis(gid, room["g_status"], **room["g_info"]), *pids)
+
+
+@actor.handler("leave")
+def leave_game(game: CaptionThis, *pids: str):
+    """Remove disconnected players and move the game along if needed
 
-        start_timer(game.gid, current_app.config["DEFAULT_VOTE_DURATION"])
-        socketio.emit(
-            "gameTimeStart",
-            current_app.config["DEFAULT_VOTE_DURATION"],
-            room=game.gid,
-            namespace="/game",
-        )
-    game.commit()
+    Args:
+        game (CaptionThis): game's instance
+        pids (str): disconnected players' ID
+    """
+    dispatch(game, PlayersLeft(pids))
 
 
-def next_player_turn(game: CaptionThis) -> bool:
-    """Choose next memer
+@actor.handler("times_up")
+def time_up(game: CaptionThis, task_id: str, due: Optional[float] = None):
+    """Move to the next turn when the room's timer went off
 
     Args:
         game (CaptionThis): game's instance
+        task_id (str): ID of the Celery task that fired
+        due (Optional[float]): timestamp the timer was set to go off at
+    """
+    fired, section = time.time(), section_name(game.current_section)
 
-    Returns:
-        bool: False if this is the end, True otherwise
+    def current() -> bool:
+        # A newer timer replaced this one while it was waiting in the mailbox,
+        # or the game written in the meantime started one
+        return current_timer(game.gid) == task_id
+
+    if dispatch(game, TimesUp(), guard=current) is not None and due is not None:
+        metrics.timer_lateness.labels(section).observe((fired - due) * 1000)
+
+
+@actor.handler("recover")
+def recover_room(game: CaptionThis):
+    """Carry out what the last transition of a room didn't get to
+
+    Its server may have gone down between saving the transition and setting
+    its timer or closing the room.
+
+    Args:
+        game (CaptionThis): game's instance
     """
-    if not game.set_next_memer():
-        winners = game.get_winner()
-        print(winners)
-        game.add_point([item[0] for item in winners])
-        socketio.emit("gameGetWinner", winners, room=game.gid, namespace="/game")
-        wait_for_transition(current_app.config["VOTE_WAIT_TIME"])
-        if game.rounds_remain == 0:
-            # this is the last round in the game
-            socketio.emit("gameEnd", game.players, room=game.gid, namespace="/game")
-            game.current_section = Section.RESTART.value
-            game.commit()
-            # to avoid duplication in the list
-            game.clear_activity()
-            # remove timer here since the game will not call switch_to in event.
-            remove_timer(game.gid)
-            socketio.emit("gameTimeUp", room=game.gid, namespace="/game")
-            return False
-        game.reset()
-        game.start_game()
-    return True
+    grace = current_app.config["RECOVERY_GRACE"]
+
+    def lost() -> bool:
+        # A transition or the timer may have come in since the room was found
+        return game.gid in journal.stalled([game.gid], grace)
+
+    if (last := journal.stalled([game.gid], grace).get(game.gid)) is None:
+        return
+    current_app.logger.warning("Recovering room %s after %s", game.gid, last.id)
+    if last.has("CloseRoom"):
+        run_effect(game.gid, CloseRoom())
+        run_effect(game.gid, DeleteAssets())
+    else:
+        dispatch(game, TimesUp(), guard=lost)
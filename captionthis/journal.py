@@ -0,0 +1,218 @@
+# Log of the transitions applied to every room.
+#
+# Each transition is appended to the room's capped stream, game:{1234}:events,
+# in the transaction that saves its state. An entry holds the event, the state
+# it led to and the effects to carry out, so a room whose effects were lost
+# with its server can be moved along and any room can be replayed.
+#
+# The deadline a room is waiting for, its timer's or its closing, is kept in
+# the sharded deadlines index ordered by when it is due. Transitions that leave
+# the timer alone leave it there, and the overdue rooms are found without
+# reading every game.
+import json
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import redis_client, rules
+from .utils import deadlines_key, game_key, shard_keys
+
+# Events the rules take, by name
+EVENTS = {
+    cls.__name__: cls
+    for cls in (
+        rules.PlayerReady,
+        rules.CaptionSubmitted,
+        rules.VoteCast,
+        rules.TimesUp,
+        rules.PlayerLeft,
+        rules.PlayersLeft,
+    )
+}
+
+
+class Entry(NamedTuple):
+    id: str
+    # When the transition was applied, from the entry's ID
+    time: float
+    event: NamedTuple
+    state: rules.GameState
+    # Effect's name and fields
+    effects: List[Tuple[str, list]]
+    # When the timer started by the transition goes off
+    deadline: Optional[float]
+
+    def has(self, effect: str) -> bool:
+        return any(name == effect for name, _ in self.effects)
+
+
+def events_key(gid: str) -> str:
+    """Stream of the transitions of a game"""
+    return f"{game_key(gid)}:events"
+
+
+def encode_state(state: rules.GameState) -> str:
+    data = state._asdict()
+    data["activity"] = sorted(state.activity)
+    data["absent"] = sorted(state.absent)
+    return json.dumps(data)
+
+
+def decode_state(data: str) -> rules.GameState:
+    fields = json.loads(data)
+    return rules.GameState(
+        **dict(
+            fields,
+            players=tuple(fields["players"]),
+            activity=frozenset(fields["activity"]),
+            captions={pid: tuple(c) for pid, c in fields["captions"].items()},
+            absent=frozenset(fields["absent"]),
+            tally=tuple(fields["tally"]) if fields.get("tally") else None,
+        )
+    )
+
+
+def deadline(effects: List[NamedTuple], now: float) -> Optional[float]:
+    """When the timer started by the effects goes off
+
+    Args:
+        effects (List[NamedTuple]): effects of a transition, in order
+        now (float): timestamp the effects are carried out from
+
+    Returns:
+        Optional[float]: timestamp, None if no timer is left running
+    """
+    waited, due = 0.0, None
+    for effect in effects:
+        kind = type(effect)
+        if kind is rules.Wait:
+            waited += effect.seconds
+        elif kind is rules.StartTimer:
+            due = now + waited + int(effect.duration)
+        elif kind is rules.CancelTimer:
+            due = None
+    return due
+
+
+def entry(
+    event: NamedTuple, state: rules.GameState, effects: List[NamedTuple]
+) -> Dict[str, str]:
+    """Fields of the stream entry of a transition
+
+    Args:
+        event (NamedTuple): event applied
+        state (GameState): state it led to
+        effects (List[NamedTuple]): effects to carry out
+
+    Returns:
+        Dict[str, str]: fields for XADD
+    """
+    due = deadline(effects, time.time())
+    return {
+        "event": type(event).__name__,
+        "args": json.dumps(list(event)),
+        "state": encode_state(state),
+        "effects": json.dumps(
+            [(type(effect).__name__, list(effect)) for effect in effects],
+            default=list,
+        ),
+        "deadline": "" if due is None else str(due),
+    }
+
+
+def decode(entry_id: str, fields: Dict[str, str]) -> Entry:
+    event = EVENTS[fields["event"]]
+    args = json.loads(fields["args"])
+    if event is rules.PlayersLeft:
+        args = [tuple(args[0])]
+    return Entry(
+        entry_id,
+        int(entry_id.split("-")[0]) / 1000,
+        event(*args),
+        decode_state(fields["state"]),
+        [tuple(effect) for effect in json.loads(fields["effects"])],
+        float(fields["deadline"]) if fields["deadline"] else None,
+    )
+
+
+def history(gid: str, count: Optional[int] = None) -> List[Entry]:
+    """Transitions of a game still in its stream, oldest first
+
+    Args:
+        gid (str): game's ID
+        count (Optional[int]): only the latest ones
+
+    Returns:
+        List[Entry]: entries of the stream
+    """
+    if count is None:
+        entries = redis_client.xrange(events_key(gid))
+    else:
+        entries = redis_client.xrevrange(events_key(gid), count=count)[::-1]
+    return [decode(entry_id, fields) for entry_id, fields in entries]
+
+
+def track(pipe, gid: str, event: NamedTuple, effects: List[NamedTuple], now: float):
+    """Queue the deadline a transition leaves the room waiting for
+
+    Args:
+        pipe: non-transactional pipeline, the shards span hash slots
+        gid (str): game's ID
+        event (NamedTuple): event applied
+        effects (List[NamedTuple]): effects to carry out
+        now (float): timestamp the effects are carried out from
+    """
+    kinds = {type(effect) for effect in effects}
+    if rules.CloseRoom in kinds:
+        pipe.zadd(deadlines_key(gid), {gid: now})
+    elif kinds & {rules.StartTimer, rules.CancelTimer} or type(event) is rules.TimesUp:
+        if (due := deadline(effects, now)) is None:
+            pipe.zrem(deadlines_key(gid), gid)
+        else:
+            pipe.zadd(deadlines_key(gid), {gid: due})
+    # Otherwise the room still waits for the timer it was waiting for
+
+
+def overdue(grace: float, batch: int) -> List[str]:
+    """Rooms whose deadline passed more than grace seconds ago
+
+    Args:
+        grace (float): seconds the effects are given to be carried out
+        batch (int): maximum amount of rooms per shard
+
+    Returns:
+        List[str]: games' ID
+    """
+    cutoff = time.time() - grace
+    with redis_client.pipeline(transaction=False) as pipe:
+        for key in shard_keys("deadlines"):
+            pipe.zrangebyscore(key, "-inf", cutoff, start=0, num=batch)
+        return [gid for gids in pipe.execute() for gid in gids]
+
+
+def stalled(gids: List[str], grace: float) -> Dict[str, Entry]:
+    """Rooms whose effects were lost
+
+    That is a timer that did not go off, whether it was never set or its task
+    was lost along with the timer's hash left behind, or a room that was never
+    closed, grace seconds after it was due. The deadline comes from the
+    deadlines index, not from the last transition, which may have left the
+    timer alone.
+
+    Args:
+        gids (List[str]): games' ID
+        grace (float): seconds the effects are given to be carried out
+
+    Returns:
+        Dict[str, Entry]: game's ID -> its last transition
+    """
+    with redis_client.pipeline(transaction=False) as pipe:
+        for gid in gids:
+            pipe.zscore(deadlines_key(gid), gid)
+            pipe.xrevrange(events_key(gid), count=1)
+        replies = pipe.execute()
+    now = time.time()
+    return {
+        gid: decode(*entries[0])
+        for gid, due, entries in zip(gids, replies[::2], replies[1::2])
+        if due is not None and entries and due + grace < now
+    }
@@ -0,0 +1,316 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+import redis
+
+from .utils import Section, shard_keys
+
+# Upper bounds of the buckets, in milliseconds
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Prometheus' text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def section_name(section: int) -> str:
+    """Label of a game's section"""
+    return Section(int(section)).name.lower()
+
+
+class Counter:
+    """Monotonic count per label, bumped without a lock
+
+    Each label's count is a one-item list allocated on its first bump, later
+    bumps add to it in place. The web server runs on green threads and
+    Celery's pool processes run one task at a time, so nothing else writes
+    concurrently.
+    """
+
+    def __init__(self, name: str, help: str, label: str = ""):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.series: Dict[str, List[int]] = {}
+
+    def inc(self, value: str = "", n: int = 1):
+        """Add to the count of a label
+
+        Args:
+            value (str): label's value, i.e a handler's name
+            n (int): amount to add
+        """
+        try:
+            self.series[value][0] += n
+        except KeyError:
+            self.series.setdefault(value, [0])[0] += n
+
+    def samples(self) -> Iterator[Tuple[Dict[str, str], int]]:
+        for value, (count,) in list(self.series.items()):
+            yield ({self.label: value} if self.label else {}), count
+
+    def clear(self):
+        self.series.clear()
+
+
+class Series:
+    """Bucket counts of one set of labels of a histogram, bumped without a lock
+
+    Like Counter, nothing else writes concurrently. Bind it once with
+    Histogram.labels() where the labels are known ahead of time.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # count per bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, ms: float):
+        """Count a duration
+
+        Args:
+            ms (float): duration in milliseconds
+        """
+        self.counts[bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.sum += ms
+
+    @contextmanager
+    def time(self):
+        """Count how long the block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - start) * 1000)
+
+
+class Histogram:
+    """Durations in milliseconds counted into buckets, per set of labels
+
+    Kept in the process's memory, every server and worker exposes its own.
+    Each set of labels' values has a Series of its own, created the first
+    time it is asked for.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = BUCKETS,
+    ):
+        self.name = name
+        self.label_names = labels
+        self.buckets = buckets
+        # labels' values -> their series
+        self.series: Dict[Tuple[str, ...], Series] = {}
+
+    def labels(self, *values: str) -> Series:
+        """Series of a set of labels
+
+        Args:
+            values (str): labels' values, in the order of the histogram's
+                labels, i.e "vote"
+
+        Returns:
+            Series: the same one for the same values
+        """
+        try:
+            return self.series[values]
+        except KeyError:
+            return self.series.setdefault(values, Series(self.buckets))
+
+    def by_section(self, *values: str) -> Dict[int, Series]:
+        """Series of every section of the game, the section being the last label
+
+        Args:
+            values (str): values of the labels before the section
+
+        Returns:
+            Dict[int, Series]: section -> its series
+        """
+        return {
+            section.value: self.labels(*values, section.name.lower())
+            for section in Section
+        }
+
+    def snapshot(self) -> list:
+        """Cumulative counts of every series
+
+        Returns:
+            list: labels, count, sum and count per bucket's upper bound
+        """
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        result = []
+        for values, series in list(self.series.items()):
+            cumulative, running = {}, 0
+            for bound, n in zip(bounds, series.counts):
+                running += n
+                cumulative[bound] = running
+            result.append(
+                {
+                    "labels": dict(zip(self.label_names, values)),
+                    "count": series.count,
+                    "sum": series.sum,
+                    "buckets": cumulative,
+                }
+            )
+        return result
+
+    def clear(self):
+        self.series.clear()
+
+
+# How late a room's timer went off after its countdown
+timer_lateness = Histogram("timer_lateness_ms", ("section",))
+# Socket.IO handlers of the players' events
+handler_duration = Histogram("handler_duration_ms", ("handler", "section"))
+# Applying an event up to its last emit, the waits of the rules left out
+transition_latency = Histogram("transition_latency_ms", ("event", "section"))
+# Emitting an event to everyone in a room
+emit_fanout = Histogram("emit_fanout_ms", ("event", "section"))
+
+# Calls to memegen, by function
+memegen_latency = Histogram("memegen_latency_ms", ("call",))
+
+HISTOGRAMS = (
+    timer_lateness,
+    handler_duration,
+    transition_latency,
+    emit_fanout,
+    memegen_latency,
+)
+
+events = Counter("events_total", "Socket.IO events received", "handler")
+redis_commands = Counter("redis_commands_total", "Commands sent to the state store")
+memegen_errors = Counter("memegen_errors_total", "Failed calls to memegen", "call")
+
+COUNTERS = (events, redis_commands, memegen_errors)
+
+
+@contextmanager
+def memegen_call(call: str):
+    """Time a call to memegen, count it as failed if it raises"""
+    series = memegen_latency.labels(call)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        memegen_errors.inc(call)
+        raise
+    finally:
+        series.observe((time.perf_counter() - start) * 1000)
+
+
+def gauges() -> List[Tuple[str, str, List[Tuple[Dict[str, str], float]]]]:
+    """Values read when the metrics are scraped
+
+    Returns:
+        List[Tuple[str, str, list]]: name, help and labeled values
+    """
+    from . import near_cache, redis_client, redis_roles, socketio
+    from .timers import local_timers
+
+    result = []
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for key in shard_keys("games"):
+                pipe.zcard(key)
+            rooms = sum(pipe.execute())
+        result.append(("rooms_active", "Rooms in the games index", [({}, rooms)]))
+    except redis.RedisError as e:
+        logging.warning("Can't count the rooms: %s", e)
+    try:
+        sockets = len(socketio.server.manager.rooms["/game"][None])
+    except (AttributeError, KeyError, TypeError):
+        sockets = 0
+    result.append(("sockets_connected", "Sockets connected here", [({}, sockets)]))
+
+    backlog = [({"queue": "local"}, len(local_timers.pending))]
+    if broker := redis_roles.clients.get("broker"):
+        try:
+            backlog.append(({"queue": "celery"}, broker.llen("celery")))
+        except redis.RedisError as e:
+            logging.warning("Can't read Celery's backlog: %s", e)
+    result.append(("timer_backlog", "Timers and tasks waiting to run", backlog))
+
+    result.append(
+        (
+            "near_cache",
+            "Near cache's counts and size",
+            [
+                *(({"stat": stat}, n) for stat, n in near_cache.stats.items()),
+                ({"stat": "size"}, len(near_cache.entries)),
+            ],
+        )
+    )
+    result.append(
+        (
+            "redis_role_latency_ms",
+            "Latency of every Redis role at its last health check",
+            [
+                ({"role": role}, latency)
+                for role, latency in redis_roles.latency.items()
+                if latency is not None
+            ],
+        )
+    )
+    return result
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    return f"{{{pairs}}}"
+
+
+def render() -> str:
+    """Every metric of this process, in Prometheus' text format"""
+    lines = []
+    for name, help, values in gauges():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_labels(labels)} {value}" for labels, value in values]
+    for counter in COUNTERS:
+        lines += [f"# HELP {counter.name} {counter.help}"]
+        lines += [f"# TYPE {counter.name} counter"]
+        for labels, count in counter.samples():
+            lines.append(f"{counter.name}{_labels(labels)} {count}")
+    for histogram in HISTOGRAMS:
+        name = histogram.name
+        lines.append(f"# TYPE {name} histogram")
+        for series in histogram.snapshot():
+            labels = series["labels"]
+            for bound, count in series["buckets"].items():
+                bucket = _labels(dict(labels, le=bound))
+                lines.append(f"{name}_bucket{bucket} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {series['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {series['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port: int):
+    """Expose the metrics over HTTP from a daemon thread, for Celery workers
+
+    Args:
+        port (int): port to listen on
+    """
+    from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+    class Quiet(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE)])
+        return [render().encode()]
+
+    server = make_server("", port, app, handler_class=Quiet)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from . import redis_client
+from .utils import game_key
+
+# Writers of a game's status or info publish on game:{1234}:invalidate
+INVALIDATE_PATTERN = "game:*:invalidate"
+
+
+def invalidate_channel(gid: str) -> str:
+    """Channel the invalidations of a game are published on"""
+    return f"{game_key(gid)}:invalidate"
+
+
+class NearCache:
+    """In-process LRU cache of the games' status and info hash
+
+    Entries are dropped when a writer publishes on the game's invalidation
+    channel, or once they are older than NEAR_CACHE_TTL in case an
+    invalidation got lost. A size of 0 (NEAR_CACHE_SIZE) disables the cache.
+
+    Processes that don't cache, like the Celery workers, still publish the
+    invalidations of what they write as long as the cache is configured.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.ttl = 0.0
+        self.publishing = False
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(("hits", "misses", "invalidations", "evictions"), 0)
+        self.listener = None
+
+    def init_app(self, app, cache: bool = True):
+        self.publishing = app.config["NEAR_CACHE_SIZE"] > 0
+        self.size = app.config["NEAR_CACHE_SIZE"] if cache else 0
+        self.ttl = app.config["NEAR_CACHE_TTL"]
+        self.clear()
+        if self.size and not app.testing:
+            self.listen()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def get(self, gid: str) -> Optional[dict]:
+        """Cached status and info of a game
+
+        Args:
+            gid (str): game's ID
+
+        Returns:
+            Optional[dict]: a copy of the cached game, None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(gid)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(gid)
+            self.stats["hits"] += 1
+        return {"g_info": dict(entry[1]["g_info"]), "g_status": entry[1]["g_status"]}
+
+    def put(self, gid: str, game: dict):
+        """Cache a game read from Redis
+
+        Args:
+            gid (str): game's ID
+            game (dict): status and info of the game
+        """
+        with self.lock:
+            self.entries[gid] = (time.monotonic(), game)
+            self.entries.move_to_end(gid)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def drop(self, gid: str):
+        """Forget a game, on an invalidation from any process"""
+        with self.lock:
+            if self.entries.pop(gid, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self, gid: str, pipe=None):
+        """Drop a game here and tell the other processes to drop it
+
+        Args:
+            gid (str): game's ID
+            pipe: pipeline to queue the publication into, it is sent right
+                away otherwise
+        """
+        if not self.publishing:
+            return
+        self.drop(gid)
+        (pipe or redis_client).publish(invalidate_channel(gid), "")
+
+    def listen(self):
+        """Subscribe to the invalidations in a background thread"""
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{INVALIDATE_PATTERN: self._on_invalidate})
+        self.listener = pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=self._on_error
+        )
+
+    def _on_invalidate(self, message: Dict):
+        # game:{1234}:invalidate
+        channel = message["channel"]
+        self.drop(channel[channel.index("{") + 1 : channel.rindex("}")])
+
+    def _on_error(self, e, pubsub, thread):
+        # Invalidations may have been missed while disconnected
+        logging.warning("Near cache lost its invalidations: %s", e)
+        self.clear()
+        time.sleep(1)
@@ -0,0 +1,101 @@
+import logging
+import time
+from typing import Optional
+
+import eventlet
+
+from .api import memegenAPI
+
+# Roles the server can't play without
+REQUIRED_ROLES = ("state", "pubsub")
+
+
+class Readiness:
+    """Whether this server should be sent players, checked in the background
+
+    A greenthread pings the state store, the pub/sub server and Memegen and
+    looks at the load of the hub every READINESS_CHECK_INTERVAL. The probe
+    only reads the last verdict, it never waits on a dependency. A verdict
+    older than a few intervals means the checker is stuck, it is not trusted.
+    """
+
+    def __init__(self):
+        self.interval = 0.0
+        self.timeout = 1.0
+        self.max_greenlets = 0
+        self.max_loop_lag = 0.0
+        self.loop_lag = 0.0
+        self.checked: Optional[float] = None
+        self.status: dict = {"ready": False, "checks": {}}
+
+    def init_app(self, app):
+        self.interval = app.config["READINESS_CHECK_INTERVAL"]
+        self.timeout = app.config["REDIS_CHECK_TIMEOUT"]
+        self.max_greenlets = app.config["READINESS_MAX_GREENLETS"]
+        self.max_loop_lag = app.config["READINESS_MAX_LOOP_LAG"]
+        self.loop_lag = 0.0
+        self.checked = None
+        self.status = {"ready": False, "checks": {}}
+        if self.interval and not app.testing:
+            eventlet.spawn(self._run)
+
+    def ready(self) -> bool:
+        """Last verdict, if the checker is still running"""
+        if not self.interval:
+            return True
+        if self.checked is None:
+            return False
+        fresh = time.monotonic() - self.checked < 3 * self.interval
+        return fresh and self.status["ready"]
+
+    def check(self) -> dict:
+        """Check the dependencies and load of this server, keep the verdict
+
+        Returns:
+            dict: verdict, the result of every check and the load
+        """
+        from . import redis_roles
+
+        latency = redis_roles.check()
+        checks = {
+            role: latency[role] is not None
+            for role in REQUIRED_ROLES
+            if role in latency
+        }
+        checks["memegen"] = memegenAPI.available(self.timeout)
+        greenlets = greenlet_count()
+        checks["greenlets"] = not self.max_greenlets or greenlets <= self.max_greenlets
+        checks["loop_lag"] = not self.max_loop_lag or self.loop_lag <= self.max_loop_lag
+        self.status = {
+            "ready": all(checks.values()),
+            "checks": checks,
+            "greenlets": greenlets,
+            "loop_lag_ms": self.loop_lag,
+        }
+        self.checked = time.monotonic()
+        return self.status
+
+    def _run(self):
+        while True:
+            try:
+                status = self.check()
+            except Exception as e:
+                logging.error(f"Readiness check failed: {e}", exc_info=True)
+            else:
+                if not status["ready"]:
+                    logging.warning("Not ready: %s", status["checks"])
+            # How late the hub wakes this greenthread up is how late it runs
+            # everything else
+            slept = time.monotonic()
+            eventlet.sleep(self.interval)
+            lag = time.monotonic() - slept - self.interval
+            self.loop_lag = max(lag, 0.0) * 1000
+
+
+def greenlet_count() -> int:
+    """Greenthreads parked on this process's hub
+
+    Each waits on a timer or a socket, so this is the hub's own count of both.
+    """
+    hub = eventlet.hubs.get_hub()
+    return hub.get_timers_count() + len(hub.get_readers()) + len(hub.get_writers())
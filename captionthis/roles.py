@@ -0,0 +1,214 @@
+import logging
+import time
+from typing import Dict, Optional
+
+import redis
+import socketio as socketio_pkg
+
+from . import redis_client
+from .storage import BlockingRedis
+
+# Every Redis server the game talks to, by what it is used for
+ROLES = ("state", "replica", "pubsub", "broker")
+
+# Written to the state store and read back from its replica to measure the lag
+HEARTBEAT_KEY = "replica:heartbeat"
+
+
+def role_urls(config) -> Dict[str, Optional[str]]:
+    """Redis endpoint of every role
+
+    Args:
+        config: Flask app's configuration
+
+    Returns:
+        Dict[str, Optional[str]]: role -> URL, None if the role is not used
+    """
+    return {
+        "state": config["REDIS_URL"],
+        "replica": config["REDIS_REPLICA_URL"],
+        "pubsub": config["SOCKETIO_MESSAGE_QUEUE"],
+        "broker": config["CELERY_BROKER_URL"],
+    }
+
+
+def pool_options(config, role: str) -> dict:
+    """Options of the connection pool of a role
+
+    Args:
+        config: Flask app's configuration
+        role (str): one of ROLES
+
+    Returns:
+        dict: keyword arguments for BlockingRedis.from_url
+    """
+    return {
+        "max_connections": config["REDIS_MAX_CONNECTIONS"][role],
+        "timeout": config["REDIS_POOL_TIMEOUT"],
+        "health_check_interval": config["REDIS_HEALTH_CHECK_INTERVAL"],
+    }
+
+
+def broker_options(config) -> dict:
+    """Celery's settings of the broker's pool, apart from the state's
+
+    Args:
+        config: Flask app's configuration
+
+    Returns:
+        dict: settings for celery.conf.update
+    """
+    return {
+        "broker_pool_limit": config["REDIS_MAX_CONNECTIONS"]["broker"],
+        "broker_transport_options": {
+            "health_check_interval": config["REDIS_HEALTH_CHECK_INTERVAL"]
+        },
+    }
+
+
+class RedisManager(socketio_pkg.RedisManager):
+    """Socket.IO's client manager connecting through a blocking pool"""
+
+    def _redis_connect(self):
+        self.redis = BlockingRedis.from_url(self.redis_url, **self.redis_options)
+        self.pubsub = self.redis.pubsub()
+
+
+def message_queue(config, write_only: bool) -> Optional[RedisManager]:
+    """Socket.IO's client manager on the pub/sub role's own pool
+
+    Args:
+        config: Flask app's configuration
+        write_only (bool): the process only emits, i.e Celery workers
+
+    Returns:
+        Optional[RedisManager]: None if the message queue is not on Redis, it
+        is then left to Flask-SocketIO
+    """
+    url = config["SOCKETIO_MESSAGE_QUEUE"]
+    if not url or not url.startswith(("redis://", "rediss://")):
+        return None
+    return RedisManager(
+        url,
+        channel="flask-socketio",
+        write_only=write_only,
+        redis_options=pool_options(config, "pubsub"),
+    )
+
+
+class RedisRoles:
+    """Health checks and latency of the Redis server behind every role
+
+    The state role is checked through the game's own pool so its latency
+    includes waiting for a connection. The pub/sub and broker pools belong to
+    Socket.IO and Celery, they are pinged over a single connection each.
+    """
+
+    def __init__(self):
+        self.clients: Dict[str, redis.Redis] = {}
+        self.latency: Dict[str, Optional[float]] = {}
+        self.failures: Dict[str, int] = {}
+
+    def init_app(self, app):
+        urls = {role: url for role, url in role_urls(app.config).items() if url}
+        timeout = app.config["REDIS_CHECK_TIMEOUT"]
+        self.clients = {}
+        for role, url in urls.items():
+            if role == "state" or not url.startswith(("redis://", "rediss://")):
+                continue
+            self.clients[role] = redis.Redis.from_url(
+                url,
+                max_connections=1,
+                socket_timeout=timeout,
+                socket_connect_timeout=timeout,
+            )
+        checked = [role for role in urls if role == "state" or role in self.clients]
+        self.latency = dict.fromkeys(checked)
+        self.failures = dict.fromkeys(checked, 0)
+
+        shared = [role for role in urls if list(urls.values()).count(urls[role]) > 1]
+        if shared and not (app.debug or app.testing):
+            app.logger.warning("Redis roles %s share one server", ", ".join(shared))
+
+    def check(self) -> Dict[str, Optional[float]]:
+        """Ping every role
+
+        Returns:
+            Dict[str, Optional[float]]: role -> latency in milliseconds, None if
+            the server did not answer
+        """
+        for role in self.latency:
+            client = redis_client if role == "state" else self.clients[role]
+            start = time.perf_counter()
+            try:
+                client.ping()
+            except redis.RedisError as e:
+                logging.warning("Redis role %s is down: %s", role, e)
+                self.latency[role] = None
+                self.failures[role] += 1
+            else:
+                self.latency[role] = (time.perf_counter() - start) * 1000
+        return dict(self.latency)
+
+
+class Replica:
+    """Read-only connection to a replica of the state store
+
+    Reads that can tolerate some staleness, such as the lobby's, ask for a
+    client with reader() and fall back to the primary when the replica lags
+    behind more than they accept.
+
+    The lag is measured by reading back from the replica a heartbeat written
+    to the primary on the previous check, it is over-estimated by up to
+    REPLICA_LAG_CHECK_INTERVAL.
+    """
+
+    def __init__(self):
+        self.client: Optional[redis.Redis] = None
+        self.check_interval = 0.0
+        self.lag: Optional[float] = None
+        self.checked = float("-inf")
+
+    def init_app(self, app):
+        url = app.config["REDIS_REPLICA_URL"]
+        self.client = None
+        if url:
+            self.client = BlockingRedis.from_url(
+                url,
+                decode_responses=True,
+                encoding="utf-8",
+                **pool_options(app.config, "replica"),
+            )
+        self.check_interval = app.config["REPLICA_LAG_CHECK_INTERVAL"]
+        self.lag = None
+        self.checked = float("-inf")
+
+    def reader(self, max_staleness: float) -> Optional[redis.Redis]:
+        """Client to read from given how stale the data may be
+
+        Args:
+            max_staleness (float): seconds the data may lag behind the primary,
+                0 always reads from the primary
+
+        Returns:
+            Optional[redis.Redis]: the replica, None to read from the primary
+        """
+        if self.client is None or max_staleness <= 0:
+            return None
+        now = time.monotonic()
+        if now - self.checked >= self.check_interval:
+            self.checked = now
+            self.lag = self._measure()
+        if self.lag is not None and self.lag <= max_staleness:
+            return self.client
+        return None
+
+    def _measure(self) -> Optional[float]:
+        now = time.time()
+        try:
+            beat = self.client.get(HEARTBEAT_KEY)
+            redis_client.set(HEARTBEAT_KEY, now)
+        except redis.RedisError as e:
+            logging.warning("Replica's lag is unknown: %s", e)
+            return None
+        return now - float(beat) if beat else None
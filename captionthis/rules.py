@@ -0,0 +1,454 @@
+# Rules of the game without any I/O.
+#
+# transition() takes the state of a room and an event, and returns the new state
+# along with the effects (emits, timers, asset deletes...) that helpers.dispatch
+# carries out against Socket.IO, Celery and memegen.
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from .errors import ActivityError, CaptionError, VoteError
+from .utils import Section
+
+WAIT = Section.WAIT.value
+CAPTION = Section.CAPTION.value
+VOTE = Section.VOTE.value
+RESTART = Section.RESTART.value
+
+
+class GameState(NamedTuple):
+    gid: str
+    status: str
+    max_players: int
+    total_rounds: int
+    duration: int
+    rounds_remain: int
+    current_section: int
+    current_memer: str
+    current_memer_idx: int
+    # Players' ID in the order they joined
+    players: Tuple[str, ...] = ()
+    names: Dict[str, str] = {}
+    points: Dict[str, int] = {}
+    # Players who have acted in the current section
+    activity: FrozenSet[str] = frozenset()
+    # Player's ID -> (meme's fingerprint, score)
+    captions: Dict[str, Tuple[str, int]] = {}
+    # Players whose heartbeat went stale, they are not waited for
+    absent: FrozenSet[str] = frozenset()
+    # Players who acted and players waited for in the section as counted by
+    # the room, on a state loaded without the room's players (see
+    # CaptionThis.state). Readiness is checked on them instead of the sets.
+    tally: Optional[Tuple[int, int]] = None
+
+
+class Settings(NamedTuple):
+    time_delay: float = 0
+    vote_wait_time: float = 0
+    vote_duration: int = 120
+
+
+# Events
+class PlayerReady(NamedTuple):
+    pid: str
+
+
+class CaptionSubmitted(NamedTuple):
+    pid: str
+    key: str
+
+
+class VoteCast(NamedTuple):
+    pid: str
+    score: int
+
+
+class TimesUp(NamedTuple):
+    pass
+
+
+class PlayerLeft(NamedTuple):
+    pid: str
+
+
+class PlayersLeft(NamedTuple):
+    """Several players left at once, the game moves along only once"""
+
+    pids: Tuple[str, ...]
+
+
+# Effects
+class Emit(NamedTuple):
+    event: str
+    args: Tuple[Any, ...] = ()
+
+
+class Wait(NamedTuple):
+    seconds: float
+
+
+class StartRound(NamedTuple):
+    """Emit gameStart with a new template"""
+
+    memer: str
+    total_rounds: int
+    rounds_remain: int
+
+
+class StartTimer(NamedTuple):
+    duration: int
+
+
+class CancelTimer(NamedTuple):
+    pass
+
+
+class CloseRoom(NamedTuple):
+    pass
+
+
+class DeleteAssets(NamedTuple):
+    pass
+
+
+class TallyAudience(NamedTuple):
+    """Sum up the audience's votes on the caption of a turn"""
+
+    memer: str
+    rounds_remain: int
+
+
+def transition(
+    state: GameState, event: NamedTuple, settings: Settings = Settings()
+) -> Tuple[GameState, List[NamedTuple]]:
+    """Apply an event to the state of a game
+
+    Args:
+        state (GameState): current state
+        event: one of PlayerReady, CaptionSubmitted, VoteCast, TimesUp,
+            PlayerLeft, PlayersLeft
+        settings (Settings): durations of the waits and of the vote section
+
+    Raises:
+        ActivityError
+        CaptionError
+        VoteError
+
+    Returns:
+        Tuple[GameState, List[NamedTuple]]: new state and effects to carry out
+    """
+    effects = []
+    state = _HANDLERS[type(event)](state, event, settings, effects)
+    return state, effects
+
+
+def next_memer(players: Tuple[str, ...], memer: str, idx: int) -> Tuple[str, int, bool]:
+    """Pick the memer after the current one
+
+    Args:
+        players (Tuple[str, ...]): players' ID in the order they joined
+        memer (str): current memer's ID
+        idx (int): current memer's index
+
+    Returns:
+        Tuple[str, int, bool]: memer's ID, its index and False if the round
+        went over every player.
+    """
+    ok = True
+    # choose next memer if current memer hasn't disconnected from the game
+    if idx < len(players) and players[idx] == memer:
+        idx += 1
+    if idx >= len(players):
+        idx, ok = 0, False
+    return (players[idx] if players else ""), idx, ok
+
+
+def winners(
+    players: Tuple[str, ...], captions: Dict[str, Tuple[str, int]]
+) -> List[Tuple[str, str, str]]:
+    """Players who have the highest (non-zero) score
+
+    Returns:
+        List[Tuple[str, str, str]]: player's ID, caption's fingerprint and score
+    """
+    highest_score = 0
+    result = []
+    for pid in players:
+        if (caption := captions.get(pid)) is None:
+            continue
+        key, score = caption
+        if score > 0:
+            if score > highest_score:
+                highest_score = score
+                result = [(pid, key, str(score))]
+            elif score == highest_score:
+                result.append((pid, key, str(score)))
+    return result
+
+
+def standings(s: GameState) -> Dict[str, Dict[str, str]]:
+    """Players' name and points keyed by their ID, ranked by points"""
+    ranked = sorted(s.players, key=lambda pid: s.points.get(pid, 0), reverse=True)
+    return {
+        pid: {"name": s.names.get(pid, ""), "points": str(s.points.get(pid, 0))}
+        for pid in ranked
+    }
+
+
+def ends_section(event: NamedTuple, section: int, ready: int, required: int) -> bool:
+    """Whether an event may end the current section
+
+    A player acting while others are still waited for doesn't, that event
+    needs the acting player's part of the room only.
+
+    Args:
+        event (NamedTuple): event to apply
+        section (int): current section
+        ready (int): players who acted in the section
+        required (int): fewest players the section may wait for
+
+    Returns:
+        bool: False if the section surely goes on after the event
+    """
+    if type(event) is PlayerReady:
+        acting = section in (WAIT, RESTART)
+    else:
+        acting = type(event) is VoteCast and section == VOTE
+    return not acting or ready + 1 >= required
+
+
+def playable(section: int, total_players: int) -> bool:
+    """Game is playable with 3 players, or with anyone still waiting in the lobby"""
+    if section != WAIT:
+        return total_players > 2
+    return total_players != 0
+
+
+def _player_ready(s: GameState, e: PlayerReady, cfg: Settings, fx: list):
+    # Only for wait and final section and the game must be playable.
+    # Every player is waited for there, the tally counts them too.
+    players = len(s.players) if s.tally is None else s.tally[1]
+    if (
+        s.current_section in (WAIT, RESTART)
+        and players + 1 >= 3
+        and e.pid in s.players
+        and e.pid not in s.activity
+    ):
+        s = _acted(s, e.pid)
+    else:
+        raise ActivityError("Invalid or duplication player's id in activity list")
+    fx.append(Emit("gamePlayerReady", (e.pid,)))
+    if _ready(s):
+        s = _reset(s, new_game=s.current_section == RESTART)
+        s = _start_game(s)
+        s, _ = _set_next_memer(s)
+        s = _switch_to(s, CAPTION, cfg, fx)
+    return s
+
+
+def _caption_submitted(s: GameState, e: CaptionSubmitted, cfg: Settings, fx: list):
+    if (
+        s.current_section == CAPTION
+        and e.key
+        and e.pid == s.current_memer
+        and e.pid not in s.captions
+    ):
+        s = s._replace(captions={**s.captions, e.pid: (e.key, 0)})
+    else:
+        raise CaptionError("Invalid or duplication player's id in captions list")
+    fx.append(Emit("gamePlayerReady", (e.pid,)))
+    return _switch_to(s, VOTE, cfg, fx)
+
+
+def _vote_cast(s: GameState, e: VoteCast, cfg: Settings, fx: list):
+    if not (e.score % 5 == 0 and 0 <= e.score <= 10):
+        raise VoteError("[Vote] Invalid score")
+    caption = s.captions.get(s.current_memer)
+    if (
+        s.current_section != VOTE
+        or e.pid == s.current_memer
+        or e.pid in s.activity
+        or caption is None
+    ):
+        raise VoteError("[Vote] Invalid or duplication player's id in activity list")
+    key, score = caption
+    s = s._replace(captions={**s.captions, s.current_memer: (key, score + e.score)})
+    s = _acted(s, e.pid)
+    fx.append(Emit("gamePlayerReady", (e.pid,)))
+    if _ready(s):
+        fx.append(TallyAudience(s.current_memer, s.rounds_remain))
+        fx.append(Emit("gameGetScore", (str(score + e.score),)))
+        s, more = _next_turn(s, cfg, fx)
+        if more:
+            fx.append(Wait(cfg.vote_wait_time))
+            s = _switch_to(s, CAPTION, cfg, fx)
+    return s
+
+
+def _times_up(s: GameState, e: TimesUp, cfg: Settings, fx: list):
+    if s.current_section == VOTE:
+        fx.append(TallyAudience(s.current_memer, s.rounds_remain))
+    s, more = _next_turn(s, cfg, fx)
+    if more:
+        s = _switch_to(s, CAPTION, cfg, fx)
+    return s
+
+
+def _player_left(s: GameState, e: PlayerLeft, cfg: Settings, fx: list):
+    return _players_left(s, PlayersLeft((e.pid,)), cfg, fx)
+
+
+def _players_left(s: GameState, e: PlayersLeft, cfg: Settings, fx: list):
+    # The sweeper and a late disconnect may both report the same player
+    leaving = tuple(pid for pid in e.pids if pid in s.players)
+    if not leaving:
+        return s
+    pids = set(leaving)
+    s = s._replace(
+        players=tuple(p for p in s.players if p not in pids),
+        names=_without(s.names, pids),
+        points=_without(s.points, pids),
+        activity=s.activity - pids,
+        captions=_without(s.captions, pids),
+        absent=s.absent - pids,
+    )
+    for pid in leaving:
+        fx.append(Emit("gamePlayerDisconnected", (pid,)))
+    section = s.current_section
+    if playable(section, len(s.players) - len(s.absent)):
+        if section in (WAIT, RESTART):
+            if _ready(s):
+                if section == RESTART:
+                    s = _reset(s, new_game=True)
+                s, _ = _set_next_memer(s)
+                s = _start_game(s)
+                s = _switch_to(s, CAPTION, cfg, fx)
+            elif s.status == "2":
+                s = s._replace(status="0")
+                fx.append(Emit("gameOpen"))
+        elif s.current_memer in pids:
+            # choose next memer then go to caption section
+            s, more = _set_next_memer(s)
+            if not more:
+                s = _start_game(s)
+            fx.append(Emit("gameReason", ("Memer disconnected",)))
+            s = _switch_to(s, CAPTION, cfg, fx)
+        elif section == VOTE and _ready(s):
+            s, _ = _set_next_memer(s)
+            s = _switch_to(s, CAPTION, cfg, fx)
+    # remove if the game is not in wait with 1 or more players
+    elif section != WAIT or not s.players:
+        fx.append(Emit("gameDisconnected"))
+        fx.append(CloseRoom())
+        fx.append(DeleteAssets())
+    return s
+
+
+_HANDLERS = {
+    PlayerReady: _player_ready,
+    CaptionSubmitted: _caption_submitted,
+    VoteCast: _vote_cast,
+    TimesUp: _times_up,
+    PlayerLeft: _player_left,
+    PlayersLeft: _players_left,
+}
+
+
+def _without(d: dict, keys: set) -> dict:
+    if keys.isdisjoint(d):
+        return d
+    return {k: v for k, v in d.items() if k not in keys}
+
+
+def _acted(s: GameState, pid: str) -> GameState:
+    s = s._replace(activity=s.activity | {pid})
+    if s.tally is not None:
+        ready, required = s.tally
+        s = s._replace(tally=(ready + 1, required))
+    return s
+
+
+def _ready(s: GameState) -> bool:
+    """Every present player (but the memer when voting) has acted
+
+    Counts the sets of the state, only the absent players are looked at one by
+    one. A state loaded without the room's players is checked on its tally.
+    """
+    if s.tally is not None:
+        ready, required = s.tally
+        return ready >= required
+    required = len(s.players) - len(s.absent)
+    if s.current_section == VOTE and s.current_memer not in s.absent:
+        required -= 1
+    return len(s.activity) - len(s.absent & s.activity) >= required
+
+
+def _caption(s: GameState) -> Dict[str, str]:
+    if (caption := s.captions.get(s.current_memer)) is None:
+        return {}
+    return {"key": caption[0], "score": str(caption[1])}
+
+
+def _reset(s: GameState, new_game: bool = False) -> GameState:
+    s = s._replace(captions={}, activity=frozenset())
+    if new_game:
+        s = s._replace(
+            points=dict.fromkeys(s.players, 0),
+            current_section=Section.reset(),
+            current_memer="",
+            current_memer_idx=0,
+            rounds_remain=s.total_rounds,
+        )
+    return s
+
+
+def _start_game(s: GameState) -> GameState:
+    return s._replace(
+        current_section=CAPTION, rounds_remain=s.rounds_remain - 1, status="1"
+    )
+
+
+def _set_next_memer(s: GameState) -> Tuple[GameState, bool]:
+    memer, idx, ok = next_memer(s.players, s.current_memer, s.current_memer_idx)
+    return s._replace(current_memer=memer, current_memer_idx=idx), ok
+
+
+def _switch_to(s: GameState, section: int, cfg: Settings, fx: list) -> GameState:
+    s = s._replace(activity=frozenset(), current_section=section)
+    fx.append(Wait(cfg.time_delay))
+    fx.append(CancelTimer())
+    fx.append(Emit("gameTimeUp"))
+    if section == CAPTION:
+        fx.append(StartRound(s.current_memer, s.total_rounds, s.rounds_remain))
+        fx.append(StartTimer(s.duration))
+        fx.append(Emit("gameTimeStart", (s.duration,)))
+    else:
+        fx.append(Emit("gameSwitchPage", ("vote",)))
+        fx.append(Emit("gameGetCaption", (_caption(s),)))
+        fx.append(StartTimer(cfg.vote_duration))
+        fx.append(Emit("gameTimeStart", (cfg.vote_duration,)))
+    return s
+
+
+def _next_turn(s: GameState, cfg: Settings, fx: list) -> Tuple[GameState, bool]:
+    """Choose next memer, wraps up the round when everyone has been the memer
+
+    Returns:
+        bool: False if this is the end, True otherwise
+    """
+    s, ok = _set_next_memer(s)
+    if ok:
+        return s, True
+    won = winners(s.players, s.captions)
+    points = dict(s.points)
+    for pid, _, _ in won:
+        points[pid] = points.get(pid, 0) + 1
+    s = s._replace(points=points)
+    fx.append(Emit("gameGetWinner", (won,)))
+    fx.append(Wait(cfg.vote_wait_time))
+    if s.rounds_remain == 0:
+        # this is the last round in the game
+        fx.append(Emit("gameEnd", (standings(s),)))
+        s = s._replace(current_section=RESTART, activity=frozenset())
+        fx.append(CancelTimer())
+        fx.append(Emit("gameTimeUp"))
+        return s, False
+    return _start_game(_reset(s)), True
@@ -1,6 +1,9 @@
 const serverURL = location.protocol + "//" + document.domain + ":" + location.port + "/game";
 let serverPayload = {
+    // Turned on once the server hands out a session to resume
     reconnection: false,
+    // Spans the server's grace period with the default backoff
+    reconnectionAttempts: 5,
     transports: ['websocket'],
     // path: '/',
 }
@@ -17,19 +20,56 @@ let templateKey = ''
 let timer
 let counter
 let socket
+let heartbeat
+// Keeps the player in the room's presence index, see PRESENCE_TIMEOUT
+const heartbeatInterval = 10000
+// Resumes the player's slot after a disconnect, see RECONNECT_GRACE_PERIOD
+let sessionToken = ''
+let resuming = false
 
 startListen = (socket) => {
 
     socket.on('connect', () => {
         console.log('Server connected')
+        heartbeat = setInterval(() => socket.emit('heartbeat'), heartbeatInterval)
     })
 
     socket.on('disconnect', () => {
         console.log('server disconnected!')
+        clearInterval(heartbeat)
+        if (sessionToken) {
+            // Come back to the same slot instead of joining as a new player
+            resuming = true
+            socket.io.opts.query = {
+                id: roomID,
+                token: sessionToken,
+            }
+        }
+    })
+
+    socket.io.on('reconnect_failed', () => {
+        console.log('Could not resume the session')
+        resuming = false
+        sessionToken = ''
+        addAlert('Lost the connection to the game.', 'danger')
+    })
+
+    socket.on('gameSession', (token) => {
+        console.log('Received gameSession msg')
+        sessionToken = token
+        socket.io.reconnection(true)
     })
 
     socket.on('gameConnected', (data) => {
         console.log('Received gameConnected msg', data)
+        if (resuming) {
+            // Still in the same section, only the players may have changed
+            resuming = false
+            document.querySelector('#playerBoard').innerHTML = ''
+            players = {}
+            updatePlayersList(data[1])
+            return
+        }
         self = data[0]
         document.querySelector('#roomID').innerText = roomID;
         updatePlayersList(data[1])
@@ -38,6 +78,16 @@ startListen = (socket) => {
         switchPage('wait')
     })
 
+    socket.on('gamePlayerAway', (pid) => {
+        console.log('Player ' + pid + ' is away')
+        setPlayerAway(pid, true)
+    })
+
+    socket.on('gamePlayerBack', (pid) => {
+        console.log('Player ' + pid + ' is back')
+        setPlayerAway(pid, false)
+    })
+
     // Await for addToPlayerBoard implementation
     socket.on('gameDisconnected', function (data) {
         console.log('Received gameDisconnected msg', data)
@@ -52,6 +102,9 @@ startListen = (socket) => {
         // reset important global variables
         self = ''
         roomID = ''
+        sessionToken = ''
+        resuming = false
+        socket.io.reconnection(false)
         played_rounds = 0
         total_rounds = 0
         memer = ''
@@ -168,6 +221,11 @@ startListen = (socket) => {
         }
     })
 
+    socket.on('gameAudienceScore', (data) => {
+        console.log('Received gameAudienceScore msg', data)
+        addAlert(`The audience gave ${data.score} from ${data.votes} votes`, 'info')
+    })
+
     socket.on('gameGetWinner', (data) => {
         console.log('Received gameGetWinner msg', data)
         victSect = document.querySelector('#victory')
@@ -548,6 +606,13 @@ addAlert = (text, lvl) => {
     document.querySelector('body').prepend(div)
 }
 
+setPlayerAway = (pid, away) => {
+    el = document.querySelector(`#playerBoard > #_${pid}`)
+    if (el) {
+        el.classList.toggle('away', away)
+    }
+}
+
 removePlayerFromBoard = (pid) => {
     playersEl = document.querySelector('#playerBoard')
     children = playersEl.querySelectorAll('div')
@@ -0,0 +1,106 @@
+import redis
+from flask_redis import FlaskRedis
+
+from . import metrics
+
+# Engines the game's state can be kept in
+BACKENDS = ("redis", "memory")
+
+
+class CountedPipeline(redis.client.Pipeline):
+    """Pipeline counting its commands once they are sent"""
+
+    def execute(self, raise_on_error=True):
+        metrics.redis_commands.inc(n=len(self.command_stack))
+        return super().execute(raise_on_error)
+
+
+class CountedCommands:
+    """Mixin of a client counting every command it sends, pipelined or not"""
+
+    def execute_command(self, *args, **options):
+        metrics.redis_commands.inc()
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class BlockingRedis(redis.StrictRedis):
+    """Client whose pool waits for a free connection once it is full
+
+    A plain pool raises "Too many connections" at max_connections, this one
+    blocks up to its timeout keyword before giving up.
+    """
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        client = cls(
+            connection_pool=redis.BlockingConnectionPool.from_url(url, **kwargs)
+        )
+        client.auto_close_connection_pool = True
+        return client
+
+
+class CountedRedis(CountedCommands, BlockingRedis):
+    pass
+
+
+def memory_engine() -> redis.Redis:
+    """Engine keeping everything in this process
+
+    It is fakeredis, which runs the scripts through lupa. Every command goes
+    through its parser, so it is slower than a local Redis server and is not
+    meant to benchmark the game.
+
+    Returns:
+        redis.Redis: client of a server of its own
+    """
+    try:
+        import fakeredis
+    except ImportError as e:
+        raise RuntimeError(
+            "STORAGE_BACKEND=memory needs the packages in requirements-memory.txt"
+        ) from e
+
+    class CountedFakeRedis(CountedCommands, fakeredis.FakeRedis):
+        pass
+
+    return CountedFakeRedis(
+        server=fakeredis.FakeServer(), decode_responses=True, encoding="utf-8"
+    )
+
+
+class Storage(FlaskRedis):
+    """Client of the game's state, whichever engine keeps it
+
+    Every module reads and writes through the redis_client instance of this
+    class. STORAGE_BACKEND picks the engine: "redis" connects to REDIS_URL,
+    "memory" keeps everything in this process, for single-node deployments
+    without a Redis server. Both speak the same commands and scripts, and
+    count the commands they send. The benchmarks need a Redis server.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        super().__init__(app, **kwargs)
+        self.provider_class = CountedRedis
+
+    def init_app(self, app, **kwargs):
+        backend = app.config["STORAGE_BACKEND"]
+        if backend == "redis":
+            super().init_app(app, **kwargs)
+        elif backend == "memory":
+            self.use(memory_engine())
+            app.extensions["redis"] = self
+        else:
+            raise ValueError(f"Unknown storage backend {backend}, not in {BACKENDS}")
+
+    def use(self, client: redis.Redis):
+        """Go through another engine, i.e one built by the tests
+
+        Args:
+            client (redis.Redis): engine's client
+        """
+        self._redis_client = client
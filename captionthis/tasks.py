@@ -1,36 +1,246 @@
-from . import celery, redis_client
+import time
+from itertools import groupby
+from typing import Dict, List
 
+from celery.signals import worker_process_init
 
-@celery.task
-def times_up(gid: str, *args):
+from . import celery, metrics
+
+
+@celery.task(bind=True)
+def times_up(self, gid: str, *args):
     """Celery task to execute when timer's went off
 
     Args:
         gid (str): game's ID
-        section (str): switch to this section when done
+        due (float): timestamp the timer was set to go off at
+    """
+    from .wsgi_aux import app
+
+    with app.app_context():
+        from .timers import went_off
+
+        went_off(gid, self.request.id, *args)
+
+
+def kick_if_gone(gid: str, pid: str, sid: str):
+    """Kick a disconnected player who did not come back in time, in an app
+    context
+
+    Args:
+        gid (str): game's ID
+        pid (str): player's ID
+        sid (str): Socket.IO request's UUID the player disconnected from
+    """
+    from .api.controllerAPI import ControllerAPI
+    from .helpers import player_left
+
+    if ControllerAPI.gone(gid, pid, sid):
+        player_left(gid, pid)
+
+
+@celery.task
+def grace_expired(gid: str, pid: str, sid: str):
+    """Celery task to kick a disconnected player who did not come back in time
+
+    Args:
+        gid (str): game's ID
+        pid (str): player's ID
+        sid (str): Socket.IO request's UUID the player disconnected from
+    """
+    from .wsgi_aux import app
+
+    with app.app_context():
+        kick_if_gone(gid, pid, sid)
+
+
+def take_leaving(gid: str):
+    """Apply the departures buffered in a room at once, in an app context
+
+    Args:
+        gid (str): game's ID
+    """
+    from flask import current_app
+
+    from .actors import actor
+    from .api.captionthisAPI import CaptionThis
+    from .api.controllerAPI import ControllerAPI
+    from .helpers import leave_game
+
+    if not (pids := ControllerAPI.take_leaving(gid)):
+        return
+    if current_app.config["GAME_ACTORS"]:
+        actor.submit(gid, "leave", *pids)
+    elif room := ControllerAPI.game(gid):
+        game = CaptionThis(gid, room["g_status"], **room["g_info"])
+        leave_game(game, *pids)
+
+
+@celery.task
+def flush_leaving(gid: str):
+    """Celery task to apply the departures buffered in a room at once
+
+    Args:
+        gid (str): game's ID
+    """
+    from .wsgi_aux import app
+
+    with app.app_context():
+        take_leaving(gid)
+
+
+def evict_stale():
+    """Evict players whose heartbeat went stale, in an app context
+
+    Players of a server that crashed never disconnect, they are taken off the
+    presence index in batches and leave their rooms like any disconnect.
+    """
+    from flask import current_app
+
+    from .api.controllerAPI import ControllerAPI
+    from .helpers import player_left
+
+    if not (timeout := current_app.config["PRESENCE_TIMEOUT"]):
+        return
+    batch = current_app.config["PRESENCE_SWEEP_BATCH"]
+    cutoff = time.time() - timeout
+    while stale := ControllerAPI.pop_stale(cutoff, batch):
+        for gid, members in groupby(sorted(stale), key=lambda m: m[0]):
+            player_left(gid, *(pid for _, pid in members))
+        if len(stale) < batch:
+            break
+
+
+@celery.task
+def sweep_presence():
+    """Celery task to evict players whose heartbeat went stale"""
+    from .wsgi_aux import app
+
+    with app.app_context():
+        evict_stale()
+
+
+def remove_leftovers() -> Dict[str, int]:
+    """Remove what is left of the rooms that expired, in an app context
+
+    Every run looks at a bounded batch of rooms per shard of the games index
+    and logs what it cost.
+
+    Returns:
+        Dict[str, int]: cost of the run, see ControllerAPI.sweep_rooms
     """
+    from flask import current_app
+
+    from .api.controllerAPI import ControllerAPI
+
+    start = time.perf_counter()
+    cost = ControllerAPI.sweep_rooms(current_app.config["ROOM_SWEEP_BATCH"])
+    current_app.logger.info(
+        "Swept %d rooms in %.1fms: %d removed (%d keys), %d still alive",
+        cost["examined"],
+        (time.perf_counter() - start) * 1000,
+        cost["removed"],
+        cost["keys"],
+        cost["alive"],
+    )
+    return cost
+
+
+@celery.task
+def sweep_rooms():
+    """Celery task to remove what is left of the rooms that expired"""
     from .wsgi_aux import app
 
     with app.app_context():
-        from .api.captionthisAPI import CaptionThis
-        from .helpers import switch_to, next_player_turn
+        return remove_leftovers()
+
 
-        game_ns = f"game:{gid}"
-        game_status = redis_client.get(game_ns)
-        game_info = redis_client.hgetall(f"{game_ns}:info")
-        game = CaptionThis(gid, game_status, **game_info)
+def tear_down(gids: List[str]):
+    """Remove the rooms whose status key just expired, in an app context
 
-        next_player_turn(game)
-        switch_to("caption", game)
-        # remove this timer from redis
-        redis_client.delete(f"game:{gid}:timer")
+    Args:
+        gids (List[str]): games' IDs, as notified by Redis
+    """
+    from flask import current_app
+
+    from .api.controllerAPI import ControllerAPI
+    from .api.memegenAPI import delete_game_assets
+
+    removed = ControllerAPI.remove_expired(gids)
+    for gid in removed:
+        delete_game_assets(gid)
+    current_app.logger.info(
+        "Tore down %d of %d expired rooms (%d keys)",
+        len(removed),
+        len(gids),
+        sum(removed.values()),
+    )
 
 
 @celery.task
-def filterer():
-    """This worker will filter unused games in Redis for every 10 minutes"""
-    games = redis_client.lrange("games", 0, -1)
-    for gid in games:
-        if not redis_client.exists(f"game:{gid}"):
-            redis_client.delete(f"game:{gid}:info")
-            redis_client.lrem("games", 0, gid)
+def teardown_rooms(gids: List[str]):
+    """Celery task to remove the rooms whose status key just expired
+
+    Args:
+        gids (List[str]): games' IDs, as notified by Redis
+    """
+    from .wsgi_aux import app
+
+    with app.app_context():
+        tear_down(gids)
+
+
+def recover_overdue():
+    """Move along the rooms whose last transition was cut short, in an app
+    context
+
+    Only the rooms past their deadline in the deadlines index are looked at,
+    at most a batch per shard. The ones whose timer was lost or that were never
+    closed are recovered by their owner.
+    """
+    from flask import current_app
+
+    from .actors import actor
+    from .api.captionthisAPI import CaptionThis
+    from .api.controllerAPI import ControllerAPI
+    from .helpers import recover_room
+    from .journal import overdue, stalled
+
+    config = current_app.config
+    if not config["EVENT_STREAM_MAXLEN"]:
+        return
+    grace = config["RECOVERY_GRACE"]
+    for gid in stalled(overdue(grace, config["RECOVERY_BATCH"]), grace):
+        if config["GAME_ACTORS"]:
+            actor.submit(gid, "recover")
+        elif room := ControllerAPI.game(gid):
+            recover_room(CaptionThis(gid, room["g_status"], **room["g_info"]))
+
+
+@celery.task
+def recover_rooms():
+    """Celery task to move along the rooms whose last transition was cut short"""
+    from .wsgi_aux import app
+
+    with app.app_context():
+        recover_overdue()
+
+
+# Function each periodic task of Celery's beat runs, LocalTimers runs them on
+# the hub instead
+PERIODIC = {
+    sweep_presence.name: evict_stale,
+    sweep_rooms.name: remove_leftovers,
+    recover_rooms.name: recover_overdue,
+}
+
+
+@worker_process_init.connect
+def serve_metrics(**kwargs):
+    """Expose the metrics of every pool process of the workers to Prometheus"""
+    from billiard.process import current_process
+
+    from .wsgi_aux import app
+
+    if port := app.config["WORKER_METRICS_PORT"]:
+        metrics.serve(port + (getattr(current_process(), "index", None) or 0))
@@ -0,0 +1,121 @@
+import logging
+import time
+from typing import List, Optional
+
+import redis
+
+from . import redis_client
+from .tasks import tear_down, teardown_rooms
+from .timers import local_timers
+
+
+def expired_room(key: str) -> Optional[str]:
+    """ID of the room whose status key expired
+
+    Args:
+        key (str): key expired by Redis
+
+    Returns:
+        Optional[str]: game's ID, None if the key isn't a room's status
+    """
+    # game:{1234}, the room's other keys expire along with it
+    if key.startswith("game:{") and key.endswith("}"):
+        return key[len("game:{") : -1]
+    return None
+
+
+class ExpiryListener:
+    """Tear rooms down as soon as Redis expires their status key
+
+    Redis publishes every key it expires on __keyevent@<db>__:expired once its
+    keyspace notifications include "Ex". The rooms are handed to the
+    teardown_rooms task in batches of ROOM_TEARDOWN_BATCH at most, or whatever
+    expired within ROOM_TEARDOWN_WINDOW. With LOCAL_TIMERS the listener tears
+    them down itself. Notifications are lost while disconnected, the sweeper
+    stays the backstop for those rooms.
+
+    Every subscriber receives every notification, run a single listener.
+    """
+
+    def __init__(self, batch: int = 100, window: float = 1.0):
+        self.batch = batch
+        self.window = window
+        self.pending: List[str] = []
+        self.first = 0.0
+
+    def init_app(self, app):
+        self.batch = app.config["ROOM_TEARDOWN_BATCH"]
+        self.window = app.config["ROOM_TEARDOWN_WINDOW"]
+
+    @property
+    def channel(self) -> str:
+        db = redis_client.connection_pool.connection_kwargs.get("db", 0)
+        return f"__keyevent@{db}__:expired"
+
+    def enable(self) -> bool:
+        """Turn on the notifications of expired keys if they are off
+
+        Returns:
+            bool: False if the server doesn't let us, they have to be turned
+            on in its configuration then
+        """
+        try:
+            config = redis_client.config_get("notify-keyspace-events")
+            flags = config.get("notify-keyspace-events", "")
+            if "E" not in flags or not ("x" in flags or "A" in flags):
+                redis_client.config_set("notify-keyspace-events", flags + "Ex")
+        except redis.ResponseError as e:
+            logging.warning("Can't turn on the expired keys notifications: %s", e)
+            return False
+        return True
+
+    def on_message(self, message: dict):
+        if gid := expired_room(message["data"]):
+            if not self.pending:
+                self.first = time.monotonic()
+            self.pending.append(gid)
+
+    def flush(self, force: bool = False) -> List[str]:
+        """Tear the pending rooms down once a batch is due
+
+        Args:
+            force (bool): don't wait for the batch to fill up or the window
+                to pass
+
+        Returns:
+            List[str]: IDs of the rooms handed over
+        """
+        if not self.pending:
+            return []
+        due = len(self.pending) >= self.batch
+        if not (force or due or time.monotonic() - self.first >= self.window):
+            return []
+        gids, self.pending = self.pending[: self.batch], self.pending[self.batch :]
+        self.first = time.monotonic()
+        if local_timers.enabled:
+            tear_down(gids)
+        else:
+            teardown_rooms.delay(gids)
+        return gids
+
+    def run(self):
+        """Listen to the expired keys until interrupted"""
+        self.enable()
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        try:
+            while True:
+                try:
+                    message = pubsub.get_message(timeout=self.window)
+                except redis.ConnectionError as e:
+                    # Resubscribed on the next call, the sweeper catches up
+                    logging.warning("Lost the expired keys notifications: %s", e)
+                    time.sleep(1)
+                    continue
+                if message:
+                    self.on_message(message)
+                self.flush()
+        finally:
+            while self.flush(force=True):
+                pass
+            pubsub.close()
@@ -1,11 +1,19 @@
+import os
+
 import fakeredis
 import pytest
+import redis
 from pytest_mock.plugin import MockerFixture
 
-from .. import create_app
+from .. import create_app, redis_client
 
 
-fr_client = fakeredis.FakeStrictRedis(decode_responses=True, encoding="utf-8")
+# The suite runs on the in-memory engine, or against the Redis server at
+# TEST_REDIS_URL. Its database is emptied after every test.
+if url := os.environ.get("TEST_REDIS_URL"):
+    fr_client = redis.Redis.from_url(url, decode_responses=True, encoding="utf-8")
+else:
+    fr_client = fakeredis.FakeStrictRedis(decode_responses=True, encoding="utf-8")
 PLAYER_NS = "ra4d{}m"
 
 
@@ -44,9 +52,7 @@ def mocked_requests_get(*args, **kwargs):
 def patch_redis(mocker: MockerFixture):
     mocker.patch("captionthis.helpers.remove_timer")
     mocker.patch("captionthis.helpers.start_timer")
-    mocker.patch("captionthis.timers.redis_client", fr_client)
-    mocker.patch("captionthis.api.controllerAPI.redis_client", fr_client)
-    mocker.patch("captionthis.api.captionthisAPI.redis_client", fr_client)
+    mocker.patch.object(redis_client, "_redis_client", fr_client)
     mocker.patch(
         "captionthis.api.memegenAPI.requests.get",
         side_effect=mocked_requests_get,
@@ -7,7 +7,7 @@ import pprint
 # for typing purposes
 from flask_socketio.test_client import SocketIOTestClient
 
-from .. import socketio
+from .. import rules, socketio
 from ..api.controllerAPI import ControllerAPI
 from ..api.captionthisAPI import CaptionThis
 from ..models import Player
@@ -40,9 +40,6 @@ class NewGame:
         self.gid = ControllerAPI.create_game(
             str(self.total_players), str(self.total_rounds), str(self.duration), "1234"
         )
-        info = ControllerAPI.game(self.gid)
-        self.game = CaptionThis(self.gid, info["g_status"], **info["g_info"])
-
         if self.filled:
             self.clients = []
             for i in range(self.total_players):
@@ -51,30 +48,29 @@ class NewGame:
                     return_value=player(i),
                 ):
                     self.clients.append(init_client(self.gid, f"kevin{i}"))
+        info = ControllerAPI.game(self.gid)
+        self.game = CaptionThis(self.gid, info["g_status"], **info["g_info"])
 
         # get player's unique id in the game
-        self.clients_id = sorted(fr_client.lrange("game:1234:players", 0, -1))
+        self.clients_id = sorted(fr_client.lrange("game:{1234}:players", 0, -1))
 
         if self.section == "restart":
-            fr_client.hset("game:1234:info", "current_section", "3")
+            fr_client.hset("game:{1234}:info", "current_section", "3")
             self.game.current_section = Section.RESTART.value
             return self
 
         if self.section == "wait":
             return self
 
-        self.game.start_game()
-        self.game.set_next_memer()
+        start(self.game)
 
         if self.section == "caption":
             return self
 
         # Add a caption for the first player (memer)
-        fr_client.hset(
-            f'game:1234:player:{player("0")}:caption', "key", "test_fingerprint"
-        )
-        fr_client.hset(f'game:1234:player:{player("0")}:caption', "score", "0")
-        fr_client.hset("game:1234:info", "current_section", "2")
+        fr_client.hset("game:{1234}:captions", player("0"), "test_fingerprint")
+        fr_client.hset("game:{1234}:captions", f'{player("0")}:score', "0")
+        fr_client.hset("game:{1234}:info", "current_section", "2")
         self.game.current_section = Section.VOTE.value
 
         if self.section == "vote":
@@ -86,6 +82,25 @@ class NewGame:
         ControllerAPI.remove_game(self.gid)
 
 
+def start(game: CaptionThis):
+    """Move a game from the lobby to its first caption section"""
+    state = game.state()
+    new_state, _ = rules._set_next_memer(rules._start_game(state))
+    game.save(state, new_state)
+
+
+def next_memer(game: CaptionThis) -> bool:
+    """Pass the turn to the next player
+
+    Returns:
+        bool: False once the round went over every player
+    """
+    state = game.state()
+    new_state, more = rules._set_next_memer(state)
+    game.save(state, new_state)
+    return more
+
+
 class MessageBuilder:
     @staticmethod
     def gameConnected(
@@ -0,0 +1,182 @@
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from .. import socketio
+from ..actors import GameActor, actor
+from ..api.captionthisAPI import CaptionThis
+from ..api.controllerAPI import ControllerAPI
+from ..helpers import dispatch
+from ..rules import CaptionSubmitted, PlayerReady
+from .base import app, fr_client, patch_redis
+from .helpers import NewGame, start, validate_socketio_msg, player
+from .helpers import MessageBuilder as M
+
+
+@pytest.fixture
+def game_actor():
+    with app.app_context():
+        yield GameActor()
+
+
+@pytest.fixture
+def actor_mode():
+    app.config["GAME_ACTORS"] = True
+    yield
+    app.config["GAME_ACTORS"] = False
+
+
+def test_submit_runs_commands_in_order(game_actor: GameActor):
+    calls = []
+
+    @game_actor.handler("echo")
+    def echo(game, value):
+        calls.append((game.gid, value))
+
+    with NewGame():
+        assert game_actor.submit("1234", "echo", 1) == 1
+        assert game_actor.submit("1234", "echo", 2) == 1
+    assert calls == [("1234", 1), ("1234", 2)]
+    assert not fr_client.exists("game:{1234}:lease")
+    assert not fr_client.exists("game:{1234}:mailbox")
+
+
+def test_submit_only_enqueues_when_room_is_owned(game_actor: GameActor):
+    calls = []
+
+    @game_actor.handler("echo")
+    def echo(game, value):
+        calls.append(value)
+
+    with NewGame():
+        fr_client.set("game:{1234}:lease", "other_owner", px=5000)
+        assert game_actor.submit("1234", "echo", 1) == 0
+        assert game_actor.submit("1234", "echo", 2) == 0
+        assert calls == []
+        assert fr_client.llen("game:{1234}:mailbox") == 2
+
+        # the other owner died, its lease expires and the room fails over
+        fr_client.delete("game:{1234}:lease")
+        assert game_actor.run("1234") == 2
+    assert calls == [1, 2]
+
+
+def test_state_is_kept_between_commands(game_actor: GameActor):
+    @game_actor.handler("next_round")
+    def next_round(game):
+        start(game)
+        # written through, the lobby reads the status from Redis
+        assert fr_client.get("game:{1234}") == "1"
+        assert fr_client.hget("game:{1234}:info", "rounds_remain") == "1"
+
+    @game_actor.handler("check")
+    def check(game):
+        # the following command reuses the in-memory state
+        assert game.rounds_remain == 1
+
+    with NewGame():
+        fr_client.set("game:{1234}:lease", "other_owner", px=5000)
+        game_actor.submit("1234", "next_round")
+        game_actor.submit("1234", "check")
+        fr_client.delete("game:{1234}:lease")
+        assert game_actor.run("1234") == 2
+        assert fr_client.get("game:{1234}") == "1"
+
+
+def test_game_state_is_kept_by_version(game_actor: GameActor, mocker: MockerFixture):
+    kept = []
+
+    @game_actor.handler("event")
+    def event(game, name, *args):
+        events = {"ready": PlayerReady, "caption": CaptionSubmitted}
+        dispatch(game, events[name](*args))
+        kept.append(game.kept)
+
+    @game_actor.handler("kick")
+    def kick(game, pid):
+        ControllerAPI.kick(game.gid, pid)
+
+    m_reload = mocker.spy(CaptionThis, "reload")
+    with NewGame(filled=True) as g:
+        fr_client.set("game:{1234}:lease", "other_owner", px=5000)
+        for pid in g.clients_id:
+            game_actor.submit("1234", "event", "ready", pid)
+        # written from outside the actor
+        game_actor.submit("1234", "kick", g.clients_id[-1])
+        game_actor.submit("1234", "event", "caption", player("0"), "finger0")
+        fr_client.delete("game:{1234}:lease")
+        assert game_actor.run("1234") == 7
+
+        # the game started on the whole room, its state was kept from then on
+        assert kept[3] is None
+        assert kept[4].current_section == 1
+        # the kick made the caption's commit conflict, the room was read again
+        m_reload.assert_called_once()
+        assert kept[5].players == tuple(g.clients_id[:-1])
+        assert kept[5].current_section == 2
+        assert fr_client.hget("game:{1234}:info", "current_section") == "2"
+
+
+def test_lease_outlives_a_long_command(game_actor: GameActor):
+    held = []
+
+    @game_actor.handler("wait")
+    def wait(game):
+        # longer than the lease's TTL, i.e the waits of a transition
+        socketio.sleep(0.5)
+        held.append(fr_client.get("game:{1234}:lease"))
+
+    app.config["ACTOR_LEASE_TTL"] = 200
+    try:
+        with NewGame():
+            game_actor.submit("1234", "wait")
+    finally:
+        app.config["ACTOR_LEASE_TTL"] = 5000
+    assert held == [game_actor.owner]
+
+
+def test_lease_is_released_on_failure(game_actor: GameActor, mocker: MockerFixture):
+    mocker.patch.object(game_actor, "_drain", side_effect=RuntimeError)
+    with NewGame():
+        with pytest.raises(RuntimeError):
+            game_actor.submit("1234", "anything")
+        assert not fr_client.exists("game:{1234}:lease")
+
+
+def test_commands_of_removed_room_are_dropped(game_actor: GameActor):
+    @game_actor.handler("close")
+    def close(game):
+        ControllerAPI.remove_game(game.gid)
+
+    with NewGame():
+        game_actor.submit("1234", "close")
+        assert not fr_client.exists("game:{1234}")
+        assert game_actor.submit("1234", "close") == 0
+        assert not fr_client.exists("game:{1234}:mailbox")
+
+
+def test_vote_through_actor(actor_mode):
+    with NewGame(section="vote", filled=True) as g:
+        validators = []
+        for i, client in enumerate(g.clients[1:]):
+            client.emit("voteSubmit", 5, namespace="/game")
+            validators.append(M.default_msg("gamePlayerReady", g.clients_id[i + 1]))
+
+        validators += [
+            M.gameGetScore(score=5 * (len(g.clients) - 1)),
+            M.gameStart(memer=player("1"), rounds_remain=g.total_rounds - 1),
+        ]
+        validate_socketio_msg(g.clients, validators)
+        assert fr_client.hget("game:{1234}:info", "current_section") == "1"
+        assert fr_client.hget("game:{1234}:info", "current_memer") == player("1")
+
+
+def test_stale_timer_is_dropped(actor_mode, mocker: MockerFixture):
+    m_dispatch = mocker.patch("captionthis.helpers.dispatch")
+    mocker.patch("captionthis.timers.celery.control.revoke")
+    with NewGame(section="caption", filled=True):
+        fr_client.hset("game:{1234}:timer", "task_id", "new_task")
+        with app.app_context():
+            actor.submit("1234", "times_up", "old_task")
+            assert not m_dispatch.call_args.kwargs["guard"]()
+            actor.submit("1234", "times_up", "new_task")
+            assert m_dispatch.call_args.kwargs["guard"]()
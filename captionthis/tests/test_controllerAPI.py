@@ -5,6 +5,8 @@ import pytest
 from pytest_mock.plugin import MockerFixture
 
 from ..api.controllerAPI import ControllerAPI, Client
+from ..timers import current_timer
+from ..utils import games_key, leaderboard_key, presence_key
 from ..errors import (
     InvalidDuration,
     InvalidTotalRounds,
@@ -44,9 +46,9 @@ def test_create_game_duplicate_id(id_empty_game):
 
 def test_create_valid_game():
     ControllerAPI.create_game("5", "2", "10", "1234")
-    assert fr_client.lrange("games", 0, -1) == ["1234"]
-    assert fr_client.get("game:1234") == "0"
-    assert fr_client.ttl("game:1234") == timedelta(minutes=5).seconds
+    assert fr_client.zrange(games_key("1234"), 0, -1) == ["1234"]
+    assert fr_client.get("game:{1234}") == "0"
+    assert fr_client.ttl("game:{1234}") == timedelta(minutes=5).seconds
     g = ControllerAPI.game("1234")
     expected_g = {
         "g_status": "0",
@@ -84,11 +86,12 @@ def test_player_join_game(id_empty_game, mocker: MockerFixture):
         "g_status": "0",
     }
     assert res == expected_res
-    plrs = fr_client.lrange("game:1234:players", 0, -1)
+    plrs = fr_client.lrange("game:{1234}:players", 0, -1)
     assert plrs == ["ra4d0m"]
-    plr = fr_client.hgetall("game:1234:player:ra4d0m")
-    assert plr == {"name": "kevin0", "points": "0"}
-    assert fr_client.ttl("game:1234") == -1
+    assert fr_client.hgetall("game:{1234}:roster") == {"ra4d0m": "kevin0"}
+    assert fr_client.zscore("game:{1234}:scores", "ra4d0m") == 0
+    # the room now slides on its idle timeout instead of the lobby's
+    assert fr_client.ttl("game:{1234}") == ControllerAPI.room_ttl
 
 
 def test_duplicate_players(id_empty_game, mocker: MockerFixture):
@@ -102,6 +105,33 @@ def test_duplicate_players(id_empty_game, mocker: MockerFixture):
     assert res1["p_id"] != res2["p_id"]
 
 
+def test_join_reads_the_roster_in_bulk(id_empty_game, mocker: MockerFixture):
+    m_hgetall = mocker.spy(fr_client, "hgetall")
+    for i in range(4):
+        mocker.patch(
+            "captionthis.api.controllerAPI.random.getrandbits", return_value=f"r{i}"
+        )
+        res = ControllerAPI.join_game(id_empty_game, f"kevin{i}")
+    assert list(res["g_players"]) == ["r0", "r1", "r2", "r3"]
+    assert res["g_players"]["r3"] == {"name": "kevin3", "points": "0"}
+    # only the game's info, never a player's hash
+    assert all(c.args[0] == "game:{1234}:info" for c in m_hgetall.call_args_list)
+
+    ControllerAPI.kick(id_empty_game, "r1")
+    assert list(ControllerAPI.roster(id_empty_game)) == ["r0", "r2", "r3"]
+
+
+def test_join_over_capacity(id_empty_game):
+    for i in range(4):
+        ControllerAPI.join_game(id_empty_game, f"kevin{i}")
+    # a concurrent join took the last slot before this one was pushed
+    fr_client.rpush("game:{1234}:players", "intruder")
+    res = ControllerAPI.join_game(id_empty_game, "kevin5")
+    assert res["p_id"] is None
+    assert fr_client.llen("game:{1234}:players") == 5
+    assert fr_client.hlen("game:{1234}:roster") == 4
+
+
 @pytest.mark.slow
 def test_join_expired_game(mocker: MockerFixture):
     mocker.patch("captionthis.api.controllerAPI.timedelta", return_value=5)
@@ -116,7 +146,8 @@ def test_game_reaches_max(id_empty_game):
     """When enough players joined the game, the status should be 2"""
     for i in range(5):
         ControllerAPI.join_game("1234", f"kevin{i}")
-    assert fr_client.get("game:1234") == "2"
+    assert fr_client.get("game:{1234}") == "2"
+    assert fr_client.ttl("game:{1234}") == ControllerAPI.room_ttl
     # next player can't join this game
     res = ControllerAPI.join_game("1234", "kevin5")
     assert res["p_id"] is None
@@ -131,17 +162,33 @@ def test_kick_player(id_empty_game, mocker: MockerFixture):
         )
         ControllerAPI.join_game("1234", f"kevin{i}")
     ControllerAPI.kick("1234", "r0")
-    assert len(fr_client.lrange("game:1234:players", 0, -1)) == 4
-    assert fr_client.get("game:1234:player:r0") is None
+    assert len(fr_client.lrange("game:{1234}:players", 0, -1)) == 4
+    assert not fr_client.hexists("game:{1234}:roster", "r0")
+    assert fr_client.zscore("game:{1234}:scores", "r0") is None
     # just to make sure that the API didn't affect others as well.
-    assert fr_client.hgetall("game:1234:player:r1") is not None
+    assert fr_client.hget("game:{1234}:roster", "r1") == "kevin1"
+
+
+def test_stale_players_are_popped_in_batches(id_empty_game):
+    for pid in ("r0", "r1", "r2"):
+        ControllerAPI.touch("1234", pid)
+    fr_client.zadd(presence_key("1234"), {"1234:r0": 10, "1234:r1": 20})
+
+    assert ControllerAPI.pop_stale(time.time() - 45, 1) == [("1234", "r0")]
+    assert ControllerAPI.pop_stale(time.time() - 45, 1) == [("1234", "r1")]
+    assert ControllerAPI.pop_stale(time.time() - 45, 1) == []
+    assert fr_client.zrange(presence_key("1234"), 0, -1) == ["1234:r2"]
+
+    ControllerAPI.kick("1234", "r2")
+    assert not fr_client.exists(presence_key("1234"))
+    assert fr_client.zrange("game:{1234}:presence", 0, -1) == ["r0", "r1"]
 
 
 def test_remove_empty_game(id_empty_game):
     ControllerAPI.remove_game("1234")
-    assert fr_client.get("game:1234") is None
-    assert fr_client.get("game:1234:info") is None
-    assert fr_client.lrange("games", 0, -1) == []
+    assert fr_client.get("game:{1234}") is None
+    assert fr_client.get("game:{1234}:info") is None
+    assert ControllerAPI.all_games() == []
 
 
 def test_remove_playing_game(id_empty_game, mocker: MockerFixture):
@@ -152,12 +199,129 @@ def test_remove_playing_game(id_empty_game, mocker: MockerFixture):
         )
         ControllerAPI.join_game("1234", f"kevin{i}")
     ControllerAPI.remove_game("1234")
-    assert fr_client.lrange("games", 0, -1) == []
-    assert fr_client.get("game:1234") is None
-    assert fr_client.get("game:1234:info") is None
-    assert fr_client.get("game:1234:players") is None
-    for i in range(5):
-        assert fr_client.get(f"game:1234:player:ra4d{i}m") is None
+    assert ControllerAPI.all_games() == []
+    assert fr_client.get("game:{1234}") is None
+    assert fr_client.get("game:{1234}:info") is None
+    assert fr_client.get("game:{1234}:players") is None
+    assert not fr_client.exists("game:{1234}:roster", "game:{1234}:scores")
+
+
+def test_untagged_per_player_game_is_migrated():
+    fr_client.set("game:1234", "1")
+    fr_client.hset("game:1234:info", mapping={"max_players": 5, "layout": "2"})
+    fr_client.rpush("game:1234:players", "r0", "r1")
+    fr_client.sadd("game:1234:activity", "r1")
+    fr_client.hset("game:1234:timer", "task_id", "t1")
+    fr_client.hset("game:1234:player:r0", mapping={"name": "kevin0", "points": 2})
+    fr_client.hset("game:1234:player:r1", mapping={"name": "kevin1", "points": 0})
+    fr_client.hset("game:1234:player:r0:caption", mapping={"key": "k", "score": 5})
+    fr_client.lpush("games", "1234")
+
+    assert ControllerAPI.migrate_games() == 1
+    assert fr_client.get("game:{1234}") == "1"
+    assert fr_client.hgetall("game:{1234}:info") == {"max_players": "5"}
+    assert fr_client.smembers("game:{1234}:activity") == {"r1"}
+    assert current_timer("1234") == "t1"
+    assert ControllerAPI.roster("1234") == {
+        "r0": {"name": "kevin0", "points": "2"},
+        "r1": {"name": "kevin1", "points": "0"},
+    }
+    assert fr_client.hgetall("game:{1234}:captions") == {"r0": "k", "r0:score": "5"}
+    assert ControllerAPI.all_games() == ["1234"]
+    assert not fr_client.keys("game:1234*")
+    assert not fr_client.exists("games")
+
+
+def test_untagged_game_is_migrated_when_read():
+    fr_client.set("game:1234", "0")
+    fr_client.hset("game:1234:info", "max_players", 5)
+    fr_client.hset("game:1234:roster", "r0", "kevin0")
+    fr_client.zadd("game:1234:scores", {"r0": 1})
+    fr_client.rpush("game:1234:players", "r0")
+
+    assert ControllerAPI.game("1234") == {
+        "g_info": {"max_players": "5"},
+        "g_status": "0",
+    }
+    assert ControllerAPI.roster("1234") == {"r0": {"name": "kevin0", "points": "1"}}
+    assert ControllerAPI.game("4321") == {}
+
+
+def test_remove_game_cancels_its_timer(id_empty_game, mocker: MockerFixture):
+    m_revoke = mocker.patch("captionthis.timers.celery.control.revoke")
+    pid = ControllerAPI.join_game("1234", "kevin0")["p_id"]
+    ControllerAPI.touch("1234", pid)
+    fr_client.hset("game:{1234}:timer", mapping={"duration": 10, "task_id": "t1"})
+
+    ControllerAPI.remove_game("1234")
+    assert not fr_client.keys("game:{1234}*")
+    assert not fr_client.exists(presence_key("1234"))
+    # the task finds no timer when it fires, no revoke is broadcast
+    assert current_timer("1234") is None
+    m_revoke.assert_not_called()
+
+
+def test_room_keys_share_hash_tag(id_empty_game):
+    for i in range(3):
+        pid = ControllerAPI.join_game("1234", f"kevin{i}")["p_id"]
+        ControllerAPI.touch("1234", pid)
+        ControllerAPI.open_session("1234", pid)
+    ControllerAPI.watch("1234")
+    ControllerAPI.audience_vote("1234", "sid", 5)
+
+    room = [key for key in fr_client.keys() if "1234" in key]
+    assert len(room) == 8
+    assert all(key.startswith("game:{1234}") for key in room)
+    assert fr_client.zcard(presence_key("1234")) == 3
+
+
+def test_leaderboard_is_read_down_to_its_depth(mocker: MockerFixture):
+    mocker.patch("captionthis.api.controllerAPI.LEADERBOARD_DEPTH", 3)
+    for points, name in enumerate(["kevin0", "kevin1", "kevin2", "kevin3"]):
+        fr_client.zadd(leaderboard_key("daily", name), {name: points})
+
+    assert ControllerAPI.leaderboard("daily", 1, 10) == [("kevin2", 2), ("kevin1", 1)]
+    assert ControllerAPI.leaderboard("daily", 3, 10) == []
+    assert ControllerAPI.leaderboard("daily", 10**9, 10) == []
+
+
+def test_room_keys_slide_their_expiry(id_empty_game):
+    assert fr_client.ttl("game:{1234}:info") == timedelta(minutes=5).seconds
+    pids = [ControllerAPI.join_game("1234", f"kevin{i}")["p_id"] for i in range(3)]
+    ControllerAPI.open_session("1234", pids[0])
+    ControllerAPI.add_client("sid", pids[0], "1234")
+    assert ControllerAPI.away("1234", pids[0], "sid")
+
+    keys = fr_client.keys("game:{1234}*")
+    assert len(keys) == 8
+    assert all(fr_client.ttl(key) == ControllerAPI.room_ttl for key in keys)
+
+    for key in keys:
+        fr_client.expire(key, 10)
+    ControllerAPI.touch("1234", pids[1])
+    assert all(fr_client.ttl(key) == ControllerAPI.room_ttl for key in keys)
+
+
+def test_heartbeat_leaves_a_fresh_expiry_alone(id_empty_game):
+    pid = ControllerAPI.join_game("1234", "kevin")["p_id"]
+    ControllerAPI.add_client("r1", pid, "1234")
+    ttl = ControllerAPI.room_ttl - 10
+    fr_client.expire("game:{1234}:info", ttl)
+    fr_client.expire("game:{1234}:players", ttl)
+    fr_client.expire("r1", ttl)
+
+    ControllerAPI.touch("1234", pid)
+    ControllerAPI.get_client("r1", refresh=True)
+    assert fr_client.ttl("game:{1234}:players") <= ttl
+    assert fr_client.ttl("r1") <= ttl
+
+
+def test_client_expires_without_heartbeat():
+    ControllerAPI.add_client("r1", "12ieu", "1234")
+    assert fr_client.ttl("r1") == ControllerAPI.room_ttl
+    fr_client.expire("r1", 10)
+    assert ControllerAPI.get_client("r1", refresh=True).id == "12ieu"
+    assert fr_client.ttl("r1") == ControllerAPI.room_ttl
 
 
 def test_add_client():
@@ -2,6 +2,7 @@ import pytest
 from pytest_mock.plugin import MockerFixture
 
 from ..api.controllerAPI import ControllerAPI
+from ..utils import leaderboard_key
 
 from .base import fr_client, app
 
@@ -66,3 +67,17 @@ def test_post_game(client, mocker: MockerFixture):
         "/game", data={"total_rounds": "a", "total_players": "5", "duration": "10"}
     )
     assert rv.status_code == 400
+
+
+def test_get_leaderboard(client):
+    for name, points in (("kevin", 3), ("bob", 5), ("alice", 1)):
+        fr_client.zadd(leaderboard_key("daily", name), {name: points})
+
+    rv = client.get("/leaderboard/daily?start=1&count=2")
+    assert rv.status_code == 200
+    assert rv.json["data"] == [
+        {"rank": 2, "name": "kevin", "points": 3},
+        {"rank": 3, "name": "alice", "points": 1},
+    ]
+    assert client.get("/leaderboard/weekly").json["data"] == []
+    assert client.get("/leaderboard/yearly").status_code == 404
@@ -1 +1,100 @@
-from ..helpers import switch_to
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from .. import socketio
+from ..api.captionthisAPI import CaptionThis
+from ..api.controllerAPI import ControllerAPI
+from ..errors import ActivityError
+from ..helpers import dispatch, time_up
+from ..rules import CaptionSubmitted, PlayerReady, TimesUp
+from .base import app, fr_client, patch_redis
+from .helpers import NewGame
+
+
+def copy(game: CaptionThis) -> CaptionThis:
+    room = ControllerAPI.game(game.gid)
+    return CaptionThis(game.gid, room["g_status"], **room["g_info"])
+
+
+def test_dispatch_saves_then_carries_out_effects(mocker: MockerFixture):
+    m_start_timer = mocker.patch("captionthis.helpers.start_timer")
+    with NewGame(filled=True) as g, app.app_context():
+        for pid in g.clients_id:
+            state = dispatch(g.game, PlayerReady(pid))
+        assert state.current_section == 1
+        assert fr_client.hget("game:{1234}:info", "current_section") == "1"
+        assert fr_client.get("game:{1234}") == "1"
+        m_start_timer.assert_called_once_with("1234", 10)
+        names = [m["name"] for m in g.clients[0].get_received(namespace="/game")]
+        assert names.count("gamePlayerReady") == 5
+        assert "gameStart" in names
+
+
+def test_dispatch_applies_the_event_again_to_a_newer_game():
+    with NewGame(filled=True) as g, app.app_context():
+        other = copy(g.game)
+        dispatch(other, PlayerReady(g.clients_id[0]))
+
+        # g.game was read before the other server's commit
+        dispatch(g.game, PlayerReady(g.clients_id[1]))
+        assert fr_client.smembers("game:{1234}:activity") == set(g.clients_id[:2])
+        assert g.game.version == other.version + 1
+
+
+def test_dispatch_writes_nothing_when_the_rules_refuse():
+    with NewGame(filled=True) as g, app.app_context():
+        version = fr_client.hget("game:{1234}:info", "version")
+        with pytest.raises(ActivityError):
+            dispatch(g.game, PlayerReady("stranger"))
+        assert fr_client.hget("game:{1234}:info", "version") == version
+
+
+def test_dispatch_drops_the_event_once_its_guard_fails():
+    with NewGame(filled=True) as g, app.app_context():
+        dispatch(copy(g.game), PlayerReady(g.clients_id[0]))
+
+        # holds for the first attempt, not once the newer game is read
+        checks = iter([True, False])
+        event = PlayerReady(g.clients_id[1])
+        assert dispatch(g.game, event, guard=lambda: next(checks)) is None
+        assert fr_client.smembers("game:{1234}:activity") == {g.clients_id[0]}
+
+
+def test_time_up_is_dropped_when_a_newer_game_replaced_its_timer(
+    mocker: MockerFixture,
+):
+    with NewGame(section="caption", filled=True) as g, app.app_context():
+        fr_client.hset("game:{1234}:timer", "task_id", "t1")
+        other = copy(g.game)
+        save = g.game.save
+
+        def racing(*args):
+            # another server moves the game along and sets the next timer first
+            if other.version == version:
+                dispatch(other, TimesUp())
+                fr_client.hset("game:{1234}:timer", "task_id", "t2")
+            save(*args)
+
+        version = other.version
+        mocker.patch.object(g.game, "save", side_effect=racing)
+        time_up(g.game, "t1")
+        assert fr_client.hget("game:{1234}:info", "version") == str(other.version)
+        assert (
+            fr_client.hget("game:{1234}:info", "current_memer") == other.current_memer
+        )
+
+
+def test_timer_going_off_during_the_wait_is_dropped(mocker: MockerFixture):
+    with NewGame(section="caption", filled=True) as g, app.app_context():
+        fr_client.hset("game:{1234}:timer", "task_id", "t1")
+        sleep = socketio.sleep
+
+        def wait(seconds):
+            # the caption's timer goes off before its CancelTimer is run
+            time_up(copy(g.game), "t1")
+            sleep(0)
+
+        mocker.patch.object(socketio, "sleep", side_effect=wait)
+        dispatch(g.game, CaptionSubmitted(g.game.current_memer, "aag/fingerprint.jpg"))
+        assert fr_client.hget("game:{1234}:info", "current_section") == "2"
+        assert fr_client.hget("game:{1234}:info", "version") == str(g.game.version)
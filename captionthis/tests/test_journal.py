@@ -0,0 +1,96 @@
+import time
+from types import SimpleNamespace
+
+from pytest_mock.plugin import MockerFixture
+
+from .. import journal
+from ..api.captionthisAPI import CaptionThis
+from ..api.controllerAPI import ControllerAPI
+from ..helpers import dispatch
+from ..rules import PlayerLeft, PlayerReady, TimesUp
+from ..tasks import recover_rooms
+from ..utils import Section
+
+from .base import app, fr_client, patch_redis
+
+
+def start(gid: str = "1234", players: int = 3) -> CaptionThis:
+    ControllerAPI.create_game("5", "2", "10", gid)
+    pids = [ControllerAPI.join_game(gid, f"kevin{i}")["p_id"] for i in range(players)]
+    with app.app_context():
+        for pid in pids:
+            room = ControllerAPI.game(gid)
+            game = CaptionThis(gid, room["g_status"], **room["g_info"])
+            dispatch(game, PlayerReady(pid))
+    return game
+
+
+def test_transitions_are_logged_with_the_state():
+    game = start()
+
+    entries = journal.history("1234")
+    assert [type(entry.event) for entry in entries] == [PlayerReady] * 3
+    last = entries[-1]
+    assert last.state == game.state()
+    assert last.state.current_section == Section.CAPTION.value
+    assert last.has("StartTimer")
+    assert abs(last.deadline - last.time - 10) < 1
+    # saved along with the room's info
+    assert fr_client.hget("game:{1234}:info", "current_section") == "1"
+    assert journal.history("1234", count=1) == [last]
+
+
+def test_lost_timer_is_recovered(mocker: MockerFixture):
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    game = start()
+    memer = game.current_memer
+    # the timer is only late so far
+    assert journal.stalled(["1234"], grace=10) == {}
+
+    # the server went down before setting the timer
+    later = time.time() + 60
+    mocker.patch("captionthis.journal.time.time", return_value=later)
+    assert list(journal.stalled(["1234"], grace=10)) == ["1234"]
+    recover_rooms.apply()
+
+    last = journal.history("1234", count=1)[0]
+    assert last.event == TimesUp()
+    assert last.state.current_memer != memer
+    assert ControllerAPI.game("1234")["g_info"]["current_memer"] != memer
+
+
+def test_lost_timer_task_is_recovered_with_its_hash_left(mocker: MockerFixture):
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    game = start()
+    memer = game.current_memer
+    # the timer was set but its task was lost with the worker running it
+    fr_client.hset("game:{1234}:timer", "task_id", "t1")
+    later = time.time() + 60
+    mocker.patch("captionthis.journal.time.time", return_value=later)
+    assert list(journal.stalled(["1234"], grace=10)) == ["1234"]
+    recover_rooms.apply()
+
+    assert journal.history("1234", count=1)[0].event == TimesUp()
+    assert ControllerAPI.game("1234")["g_info"]["current_memer"] != memer
+    assert journal.stalled(["1234"], grace=10) == {}
+
+
+def test_lost_timer_is_not_hidden_by_a_later_transition(mocker: MockerFixture):
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    game = start(players=4)
+    memer = game.current_memer
+    # the server went down before setting the timer, a player left afterwards
+    other = next(pid for pid in game.state().players if pid != memer)
+    with app.app_context():
+        dispatch(game, PlayerLeft(other))
+    assert not journal.history("1234", count=1)[0].has("StartTimer")
+
+    later = time.time() + 60
+    mocker.patch("captionthis.journal.time.time", return_value=later)
+    m_all_games = mocker.spy(ControllerAPI, "all_games")
+    assert journal.overdue(grace=10, batch=10) == ["1234"]
+    recover_rooms.apply()
+
+    assert journal.history("1234", count=1)[0].event == TimesUp()
+    assert ControllerAPI.game("1234")["g_info"]["current_memer"] != memer
+    m_all_games.assert_not_called()
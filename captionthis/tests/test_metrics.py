@@ -0,0 +1,133 @@
+import time
+
+from pytest import fixture
+
+import pytest
+from flask import Flask
+from pytest_mock.plugin import MockerFixture
+
+from .. import metrics
+from ..api.memegenAPI import create_meme, get_meme
+from ..helpers import time_up
+from ..metrics import Counter, Histogram
+from ..storage import Storage
+
+from .base import app, fr_client, patch_redis
+from .helpers import NewGame
+
+
+@fixture()
+def histograms():
+    for series in metrics.HISTOGRAMS + metrics.COUNTERS:
+        series.clear()
+    yield
+    for series in metrics.HISTOGRAMS + metrics.COUNTERS:
+        series.clear()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_ms", ("section",), buckets=(10, 100))
+    series = histogram.labels("vote")
+    for ms in (5, 10, 50, 500):
+        series.observe(ms)
+    histogram.labels("caption").observe(1)
+    # bound once per set of labels
+    assert histogram.labels("vote") is series
+
+    vote, caption = histogram.snapshot()
+    assert vote == {
+        "labels": {"section": "vote"},
+        "count": 4,
+        "sum": 565,
+        "buckets": {"10": 2, "100": 3, "+Inf": 4},
+    }
+    assert caption["buckets"] == {"10": 1, "100": 1, "+Inf": 1}
+
+
+def test_timer_and_transition_are_measured(histograms):
+    with NewGame(section="caption", filled=True) as g, app.app_context():
+        fr_client.hset("game:{1234}:timer", "task_id", "t1")
+        time_up(g.game, "t1", time.time() - 0.2)
+
+        with app.test_client() as client:
+            data = client.get("/metrics/latency").json["data"]
+    (late,) = data["timer_lateness_ms"]
+    assert late["labels"] == {"section": "caption"}
+    assert late["sum"] >= 200
+    (transition,) = data["transition_latency_ms"]
+    assert transition["labels"] == {"section": "caption", "event": "TimesUp"}
+    emits = {s["labels"]["event"] for s in data["emit_fanout_ms"]}
+    assert {"gameTimeUp", "gameStart"} <= emits
+
+
+def test_counter_counts_per_label():
+    counter = Counter("test_total", "Tests", "handler")
+    counter.inc("on_vote")
+    counter.inc("on_vote", n=2)
+    counter.inc("on_submit")
+    assert list(counter.samples()) == [
+        ({"handler": "on_vote"}, 3),
+        ({"handler": "on_submit"}, 1),
+    ]
+
+
+def test_every_handler_is_counted(histograms):
+    with NewGame(filled=True) as g:
+        g.clients[0].emit("heartbeat", namespace="/game")
+        g.clients[0].emit("playerReady", namespace="/game")
+        g.clients[0].disconnect(namespace="/game")
+        counts = {labels["handler"]: n for labels, n in metrics.events.samples()}
+    assert counts == {
+        "on_connect": 5,
+        "on_heartbeat": 1,
+        "on_playerReady": 1,
+        "on_disconnect": 1,
+    }
+
+
+def test_storage_counts_commands(histograms):
+    app = Flask(__name__)
+    app.config["STORAGE_BACKEND"] = "memory"
+    storage = Storage(decode_responses=True)
+    storage.init_app(app)
+
+    storage.set("key", "1")
+    with storage.pipeline() as pipe:
+        pipe.get("key")
+        pipe.incr("key")
+        pipe.execute()
+    assert list(metrics.redis_commands.samples()) == [({}, 3)]
+
+
+def test_prometheus_exposition(histograms):
+    with NewGame(section="caption", filled=True), app.app_context():
+        metrics.events.inc("on_submit")
+        metrics.timer_lateness.labels("caption").observe(20)
+
+        with app.test_client() as client:
+            res = client.get("/metrics")
+    assert res.content_type.startswith("text/plain; version=0.0.4")
+    lines = res.get_data(as_text=True).splitlines()
+    assert "# TYPE rooms_active gauge" in lines
+    assert "rooms_active 1" in lines
+    assert 'timer_backlog{queue="local"} 0' in lines
+    assert 'events_total{handler="on_submit"} 1' in lines
+    assert 'timer_lateness_ms_bucket{section="caption",le="25"} 1' in lines
+    assert 'timer_lateness_ms_count{section="caption"} 1' in lines
+
+
+def test_memegen_calls_are_measured(histograms, mocker: MockerFixture):
+    get_meme()
+    mocker.patch(
+        "captionthis.api.memegenAPI.requests.get",
+        return_value=mocker.Mock(status_code=500),
+    )
+    with pytest.raises(Exception):
+        create_meme("aag", ["a", "b"], "1234")
+
+    calls = metrics.memegen_latency.snapshot()
+    assert {s["labels"]["call"]: s["count"] for s in calls} == {
+        "get_meme": 1,
+        "create_meme": 1,
+    }
+    assert list(metrics.memegen_errors.samples()) == [({"call": "create_meme"}, 1)]
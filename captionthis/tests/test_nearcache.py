@@ -0,0 +1,73 @@
+from pytest import fixture
+from pytest_mock.plugin import MockerFixture
+
+from .. import near_cache
+from ..api.captionthisAPI import CaptionThis
+from ..api.controllerAPI import ControllerAPI
+from ..nearcache import INVALIDATE_PATTERN
+
+from .base import fr_client, patch_redis
+from .helpers import start
+
+
+@fixture()
+def cache(mocker: MockerFixture):
+    mocker.patch("captionthis.nearcache.redis_client", fr_client)
+    mocker.patch.object(near_cache, "size", 2)
+    mocker.patch.object(near_cache, "publishing", True)
+    mocker.patch.object(near_cache, "ttl", 30)
+    mocker.patch.dict(near_cache.stats, dict.fromkeys(near_cache.stats, 0))
+    near_cache.clear()
+    yield near_cache
+    near_cache.clear()
+
+
+def test_lru_eviction(cache):
+    for gid in ("1234", "1235", "1236"):
+        ControllerAPI.create_game("5", "2", "10", gid)
+        ControllerAPI.game(gid, cached=True)
+    assert list(cache.entries) == ["1235", "1236"]
+    assert cache.stats["evictions"] == 1
+
+    assert ControllerAPI.game("1235", cached=True)["g_status"] == "0"
+    # uncached reads don't count
+    ControllerAPI.game("1234")
+    assert cache.stats == {"hits": 1, "misses": 3, "invalidations": 0, "evictions": 1}
+
+
+def test_writers_invalidate(cache):
+    ControllerAPI.create_game("5", "2", "10", "1234")
+    pubsub = fr_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe(INVALIDATE_PATTERN)
+    assert pubsub.get_message(timeout=1) is None
+
+    game = ControllerAPI.game("1234", cached=True)
+    game = CaptionThis("1234", game["g_status"], **game["g_info"])
+    start(game)
+    assert "1234" not in cache.entries
+    assert ControllerAPI.game("1234", cached=True)["g_status"] == "1"
+
+    # another process committed the game
+    message = pubsub.get_message(timeout=1)
+    assert message["channel"] == "game:{1234}:invalidate"
+    cache._on_invalidate(message)
+    assert "1234" not in cache.entries
+    assert cache.stats["invalidations"] == 2
+
+    ControllerAPI.game("1234", cached=True)
+    ControllerAPI.remove_game("1234")
+    assert ControllerAPI.game("1234", cached=True) == {}
+
+
+def test_processes_without_a_cache_still_invalidate(cache, mocker: MockerFixture):
+    # i.e a Celery worker
+    mocker.patch.object(near_cache, "size", 0)
+    ControllerAPI.create_game("5", "2", "10", "1234")
+    pubsub = fr_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe(INVALIDATE_PATTERN)
+    assert pubsub.get_message(timeout=1) is None
+
+    game = ControllerAPI.game("1234", cached=True)
+    start(CaptionThis("1234", game["g_status"], **game["g_info"]))
+    assert not cache.entries
+    assert pubsub.get_message(timeout=1)["channel"] == "game:{1234}:invalidate"
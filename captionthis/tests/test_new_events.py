@@ -1,12 +1,19 @@
 import random
+from types import SimpleNamespace
 
+import eventlet
+import pytest
 from pytest_mock import MockerFixture
 
 from .. import socketio
-from ..utils import Section
+from ..utils import Section, game_key, presence_key
+from ..api.captionthisAPI import CaptionThis
 from ..api.controllerAPI import ControllerAPI
+from ..tasks import flush_leaving, grace_expired, sweep_presence
+from ..timers import local_timers
 from .base import app, fr_client, mocked_requests_get, patch_redis
 from .helpers import NewGame, validate_socketio_msg, init_client, player, _pprint
+from .helpers import next_memer
 from .helpers import MessageBuilder as M
 
 
@@ -30,7 +37,6 @@ def test_connect_to_server(mocker: MockerFixture):
                 M.gameConnected(
                     "r8nd0m1D", M._player("r8nd0m1D", "kevin", "0"), g.total_rounds
                 ),
-                M.gamePlayerConnected("r8nd0m1D", "kevin", "0"),
             ],
         )
 
@@ -49,10 +55,12 @@ def test_join_game(mocker: MockerFixture):
                 return_value=preID,
             )
             clients.append(init_client(g.gid, f"kevin{i}"))
-            lst_expected_msg.append(
-                M.gamePlayerConnected(f"Rand0m{i}", f"kevin{i}", "0")
-            )
-        # the first player should receive all gamePlayerConnect
+            if i:
+                lst_expected_msg.append(
+                    M.gamePlayerConnected(f"Rand0m{i}", f"kevin{i}", "0")
+                )
+        # the first player should receive the gamePlayerConnected of the others,
+        # a player's own is already in its gameConnected
         validate_socketio_msg([clients[0]], [*lst_expected_msg, ("gameReady", [])])
 
 
@@ -139,7 +147,7 @@ def test_wait_section_scenario_3(mocker: MockerFixture):
         clients[1].emit("playerReady", namespace="/game")
         clients[2].emit("playerReady", namespace="/game")
         clients[3].disconnect(namespace="/game")
-        assert fr_client.get("game:1234") == "0"
+        assert fr_client.get("game:{1234}") == "0"
         clients[4].emit("playerReady", namespace="/game")
 
         validate_socketio_msg(
@@ -153,7 +161,7 @@ def test_wait_section_scenario_3(mocker: MockerFixture):
             ],
         )
         assert len(mocked_requests.call_args_list) == 2
-        assert fr_client.get("game:1234") == "1"
+        assert fr_client.get("game:{1234}") == "1"
 
 
 def test_wait_section_scenario_4():
@@ -309,7 +317,7 @@ def test_v_scenario_1():
             M.gameStart(memer=player("1"), rounds_remain=g.total_rounds - 1),
         ]
         validate_socketio_msg(g.clients, validators)
-        assert fr_client.hget("game:1234:info", "current_section") == "1"
+        assert fr_client.hget("game:{1234}:info", "current_section") == "1"
 
 
 def test_v_scenario_2():
@@ -320,18 +328,14 @@ def test_v_scenario_2():
             # give first player highest score
             if i == 0:
                 score = 10
-            fr_client.hset(
-                f"game:1234:player:{player(i)}:caption", "key", f"test_fingerprint{i}"
-            )
-            fr_client.hset(f"game:1234:player:{player(i)}:caption", "score", score)
-            assert g.game.set_next_memer()
+            fr_client.hset("game:{1234}:captions", player(i), f"test_fingerprint{i}")
+            fr_client.hset("game:{1234}:captions", f"{player(i)}:score", score)
+            assert next_memer(g.game)
 
         # simulate last player (memer) submits their caption
         i += 1
-        fr_client.hset(
-            f"game:1234:player:{player(i)}:caption", "key", f"test_fingerprint{i}"
-        )
-        fr_client.hset(f"game:1234:player:{player(i)}:caption", "score", "0")
+        fr_client.hset("game:{1234}:captions", player(i), f"test_fingerprint{i}")
+        fr_client.hset("game:{1234}:captions", f"{player(i)}:score", "0")
 
         # simulate voters voting the meme
         validators = []
@@ -345,33 +349,30 @@ def test_v_scenario_2():
             M.default_msg("gameGetWinner", [[player("0"), "test_fingerprint0", "10"]]),
         ]
         validate_socketio_msg(g.clients, validators)
-        assert fr_client.hget("game:1234:info", "current_section") == "1"
-        assert fr_client.hget(f'game:1234:player:{player("0")}', "points") == "1"
-        assert not fr_client.exists("game:1234:activity")
+        assert fr_client.hget("game:{1234}:info", "current_section") == "1"
+        assert fr_client.zscore("game:{1234}:scores", player("0")) == 1
+        assert not fr_client.exists("game:{1234}:activity")
         for pid in g.clients_id:
-            assert not fr_client.exists(f"game:1234:player:{pid}:caption")
+            assert not fr_client.hexists("game:{1234}:captions", pid)
 
 
 def test_v_memer_scenario_3():
     # this is the last memer in the last round in the game
     with NewGame(section="vote", filled=True) as g:
         g.game.rounds_remain = 0
+        fr_client.hset("game:{1234}:info", "rounds_remain", 0)
         for i in range(len(g.clients[:-1])):
             score = 5
             # give first player highest score
             if i == 0:
                 score = 10
-            fr_client.hset(
-                f"game:1234:player:{player(i)}:caption", "key", f"test_fingerprint{i}"
-            )
-            fr_client.hset(f"game:1234:player:{player(i)}:caption", "score", score)
-            assert g.game.set_next_memer()
+            fr_client.hset("game:{1234}:captions", player(i), f"test_fingerprint{i}")
+            fr_client.hset("game:{1234}:captions", f"{player(i)}:score", score)
+            assert next_memer(g.game)
 
         i += 1
-        fr_client.hset(
-            f"game:1234:player:{player(i)}:caption", "key", f"test_fingerprint{i}"
-        )
-        fr_client.hset(f"game:1234:player:{player(i)}:caption", "score", "0")
+        fr_client.hset("game:{1234}:captions", player(i), f"test_fingerprint{i}")
+        fr_client.hset("game:{1234}:captions", f"{player(i)}:score", "0")
 
         validators = []
         for i, client in enumerate(g.clients[:-1]):
@@ -387,9 +388,9 @@ def test_v_memer_scenario_3():
             M.default_msg("gameEnd", expected_gameEnd),
         ]
         validate_socketio_msg(g.clients, validators)
-        assert not fr_client.exists("game:1234:activity")
-        assert fr_client.hget(f'game:1234:player:{player("0")}', "points") == "1"
-        assert fr_client.hget("game:1234:info", "current_section") == str(
+        assert not fr_client.exists("game:{1234}:activity")
+        assert fr_client.zscore("game:{1234}:scores", player("0")) == 1
+        assert fr_client.hget("game:{1234}:info", "current_section") == str(
             Section.RESTART.value
         )
 
@@ -485,14 +486,12 @@ def test_r_scenario_1():
         # Add dummy captions
         for i in range(len(g.clients)):
             score = 5
-            fr_client.hset(
-                f"game:1234:player:{player(i)}:caption", "key", f"test_fingerprint{i}"
-            )
-            fr_client.hset(f"game:1234:player:{player(i)}:caption", "score", score)
+            fr_client.hset("game:{1234}:captions", player(i), f"test_fingerprint{i}")
+            fr_client.hset("game:{1234}:captions", f"{player(i)}:score", score)
 
         # Add some dummy points to the 2nd and 4rd players
-        fr_client.hset(f"game:1234:player:{player('1')}", "points", 1)
-        fr_client.hset(f"game:1234:player:{player('3')}", "points", 1)
+        fr_client.zadd("game:{1234}:scores", {player("1"): 1})
+        fr_client.zadd("game:{1234}:scores", {player("3"): 1})
 
         validators = []
         # Now simulate the event
@@ -505,15 +504,15 @@ def test_r_scenario_1():
         validators.append(M.default_msg("gameTimeStart", g.duration))
         validate_socketio_msg(g.clients, validators)
 
-        assert not fr_client.exists("game:1234:activity")
-        assert fr_client.hget("game:1234:info", "rounds_remain") == str(g.total_rounds - 1)
-        assert fr_client.hget("game:1234:info", "current_section") == "1"
-        assert fr_client.hget("game:1234:info", "current_memer") == player("0")
-        assert fr_client.hget("game:1234:info", "current_memer_idx") == "0"
-        assert fr_client.llen('game:1234:players') == 5
+        assert not fr_client.exists("game:{1234}:activity")
+        assert fr_client.hget("game:{1234}:info", "rounds_remain") == str(g.total_rounds - 1)
+        assert fr_client.hget("game:{1234}:info", "current_section") == "1"
+        assert fr_client.hget("game:{1234}:info", "current_memer") == player("0")
+        assert fr_client.hget("game:{1234}:info", "current_memer_idx") == "0"
+        assert fr_client.llen('game:{1234}:players') == 5
         for pid in g.clients_id:
-            assert not fr_client.exists(f"game:1234:player:{pid}:caption")
-            assert fr_client.hget(f"game:1234:player:{pid}", "points") == "0"
+            assert not fr_client.hexists("game:{1234}:captions", pid)
+            assert fr_client.zscore("game:{1234}:scores", pid) == 0
 
 
 def test_r_one_disconnect():
@@ -524,14 +523,12 @@ def test_r_one_disconnect():
         # Add dummy captions
         for i in range(len(g.clients)):
             score = 5
-            fr_client.hset(
-                f"game:1234:player:{player(i)}:caption", "key", f"test_fingerprint{i}"
-            )
-            fr_client.hset(f"game:1234:player:{player(i)}:caption", "score", score)
+            fr_client.hset("game:{1234}:captions", player(i), f"test_fingerprint{i}")
+            fr_client.hset("game:{1234}:captions", f"{player(i)}:score", score)
 
         # Add some dummy points to the 2nd and 4rd players
-        fr_client.hset(f"game:1234:player:{player('1')}", "points", 1)
-        fr_client.hset(f"game:1234:player:{player('3')}", "points", 1)
+        fr_client.zadd("game:{1234}:scores", {player("1"): 1})
+        fr_client.zadd("game:{1234}:scores", {player("3"): 1})
 
         validators = []
         # Now simulate the event
@@ -546,13 +543,283 @@ def test_r_one_disconnect():
         validators.append(M.default_msg("gameTimeStart", g.duration))
         validate_socketio_msg(g.clients[:-1], validators)
 
-        assert not fr_client.exists("game:1234:activity")
-        assert fr_client.hget("game:1234:info", "rounds_remain") == str(g.total_rounds - 1)
-        assert fr_client.hget("game:1234:info", "current_section") == "1"
-        assert fr_client.hget("game:1234:info", "current_memer") == player("0")
-        assert fr_client.hget("game:1234:info", "current_memer_idx") == "0"
-        assert fr_client.llen('game:1234:players') == 4
+        assert not fr_client.exists("game:{1234}:activity")
+        assert fr_client.hget("game:{1234}:info", "rounds_remain") == str(g.total_rounds - 1)
+        assert fr_client.hget("game:{1234}:info", "current_section") == "1"
+        assert fr_client.hget("game:{1234}:info", "current_memer") == player("0")
+        assert fr_client.hget("game:{1234}:info", "current_memer_idx") == "0"
+        assert fr_client.llen('game:{1234}:players') == 4
         for pid in g.clients_id[:-1]:
-            assert not fr_client.exists(f"game:1234:player:{pid}:caption")
-            assert fr_client.hget(f"game:1234:player:{pid}", "points") == "0"
+            assert not fr_client.hexists("game:{1234}:captions", pid)
+            assert fr_client.zscore("game:{1234}:scores", pid) == 0
+
+
+
+################################################################
+
+
+################################  RECONNECT ################################
+@pytest.fixture
+def grace(mocker: MockerFixture):
+    app.config["RECONNECT_GRACE_PERIOD"] = 5
+    # importing wsgi_aux would attach socketio to a message queue
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    yield mocker.patch("captionthis.events.grace_expired.apply_async")
+    app.config["RECONNECT_GRACE_PERIOD"] = 0
+
+
+def session_token(client) -> str:
+    for msg in client.get_received(namespace="/game"):
+        if msg["name"] == "gameSession":
+            return msg["args"][0]
+
+
+def resume_client(gid: str, token: str):
+    return socketio.test_client(
+        app,
+        namespace="/game",
+        query_string=f"id={gid}&token={token}",
+        flask_test_client=app.test_client(),
+    )
+
+
+def test_player_resumes_within_grace_period(grace):
+    with NewGame(section="caption", filled=True) as g:
+        token = session_token(g.clients[1])
+        assert token.startswith(player("1"))
+        g.clients[1].disconnect(namespace="/game")
+        grace.assert_called_once()
+
+        validate_socketio_msg(
+            [g.clients[0]], [M.default_msg("gamePlayerAway", player("1"))]
+        )
+        # the slot is kept
+        assert fr_client.llen("game:{1234}:players") == 5
+
+        client = resume_client(g.gid, token)
+        assert client.is_connected(namespace="/game")
+        msg = client.get_received(namespace="/game")
+        assert msg[0]["name"] == "gameConnected"
+        assert msg[0]["args"][0][0] == player("1")
+        validate_socketio_msg(
+            [g.clients[0]], [M.default_msg("gamePlayerBack", player("1"))]
+        )
+
+        # the disconnect of the previous socket is not applied anymore
+        grace_expired.apply(grace.call_args[0][0])
+        assert fr_client.llen("game:{1234}:players") == 5
+        assert fr_client.hget("game:{1234}:info", "current_memer") == player("0")
+
+
+def test_player_resumes_before_its_disconnect(grace):
+    with NewGame(section="caption", filled=True) as g:
+        token = session_token(g.clients[1])
+        client = resume_client(g.gid, token)
+        assert client.is_connected(namespace="/game")
+
+        # the previous socket goes down after the player took its slot over
+        g.clients[1].disconnect(namespace="/game")
+        grace.assert_not_called()
+        names = [m["name"] for m in g.clients[0].get_received(namespace="/game")]
+        assert "gamePlayerAway" not in names
+        assert not fr_client.hexists("game:{1234}:away", player("1"))
+        assert fr_client.llen("game:{1234}:players") == 5
+
+
+def test_player_kicked_after_grace_period(grace):
+    with NewGame(section="caption", filled=True) as g:
+        token = session_token(g.clients[0])
+        g.clients[0].disconnect(namespace="/game")
+        grace_expired.apply(grace.call_args[0][0])
+
+        validate_socketio_msg(
+            g.clients[1:],
+            [
+                M.default_msg("gamePlayerDisconnected", player("0")),
+                M.default_msg("gameReason", "Memer disconnected"),
+            ],
+        )
+        assert fr_client.llen("game:{1234}:players") == 4
+        assert not resume_client(g.gid, token).is_connected(namespace="/game")
+
+
+def test_player_kicked_on_the_hub_with_local_timers(grace, mocker: MockerFixture):
+    mocker.patch.object(local_timers, "enabled", True)
+    app.config["RECONNECT_GRACE_PERIOD"] = 0.01
+    with NewGame(section="caption", filled=True) as g:
+        g.clients[1].disconnect(namespace="/game")
+        assert fr_client.llen("game:{1234}:players") == 5
+        eventlet.sleep(0.05)
+
+        grace.assert_not_called()
+        assert fr_client.llen("game:{1234}:players") == 4
+
+
+def test_invalid_token_does_not_resume(grace):
+    with NewGame(section="caption", filled=True) as g:
+        g.clients[1].disconnect(namespace="/game")
+        client = resume_client(g.gid, f"{player('1')}.forged")
+        assert not client.is_connected(namespace="/game")
+
+
+################################################################
+
+
+################################  DISCONNECT STORM ################################
+@pytest.fixture
+def coalesce(mocker: MockerFixture):
+    app.config["DISCONNECT_COALESCE_WINDOW"] = 0.5
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    yield mocker.patch("captionthis.helpers.flush_leaving.apply_async")
+    app.config["DISCONNECT_COALESCE_WINDOW"] = 0
+
+
+def test_disconnects_are_applied_at_once(coalesce):
+    with NewGame(section="caption", filled=True) as g:
+        for client in g.clients[:2]:
+            client.disconnect(namespace="/game")
+        # one flush for the whole window
+        coalesce.assert_called_once_with((g.gid,), countdown=0.5)
+        assert fr_client.llen("game:{1234}:players") == 5
+
+        flush_leaving.apply((g.gid,))
+
+        msg = g.clients[2].get_received(namespace="/game")
+        names = [m["name"] for m in msg]
+        assert names.count("gamePlayerDisconnected") == 2
+        assert names.count("gameStart") == 1
+        assert fr_client.llen("game:{1234}:players") == 3
+        assert fr_client.hget("game:{1234}:info", "current_memer") == player("2")
+        assert not fr_client.exists("game:{1234}:leaving")
+
+        # the next departure opens a new window
+        g.clients[2].disconnect(namespace="/game")
+        assert coalesce.call_count == 2
+
+
+################################################################
+
+
+################################  PRESENCE ################################
+@pytest.fixture
+def presence(mocker: MockerFixture):
+    app.config["PRESENCE_TIMEOUT"] = 45
+    mocker.patch.object(CaptionThis, "presence_timeout", 45)
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    yield
+    app.config["PRESENCE_TIMEOUT"] = 0
+
+
+def go_stale(gid: str, pid: str):
+    fr_client.zadd(f"{game_key(gid)}:presence", {pid: 0})
+    fr_client.zadd(presence_key(gid), {f"{gid}:{pid}": 0})
+
+
+def test_heartbeat_keeps_player_present(presence):
+    with NewGame(filled=True) as g:
+        assert fr_client.zcard("game:{1234}:presence") == 5
+        go_stale(g.gid, player("1"))
+        g.clients[1].emit("heartbeat", namespace="/game")
+        assert fr_client.zscore("game:{1234}:presence", player("1")) > 0
+
+        sweep_presence.apply()
+        assert fr_client.llen("game:{1234}:players") == 5
+
+
+def test_ghost_players_are_swept(presence):
+    with NewGame(section="caption", filled=True) as g:
+        go_stale(g.gid, player("3"))
+        go_stale(g.gid, player("4"))
+        assert g.game.state().absent == {player("3"), player("4")}
+
+        sweep_presence.apply()
+
+        names = [m["name"] for m in g.clients[0].get_received(namespace="/game")]
+        assert names.count("gamePlayerDisconnected") == 2
+        assert fr_client.llen("game:{1234}:players") == 3
+        assert fr_client.zcard(presence_key("1234")) == 3
+        assert fr_client.zscore("game:{1234}:presence", player("3")) is None
+
+
+def test_vote_does_not_wait_for_ghosts(presence):
+    with NewGame(section="vote", filled=True) as g:
+        go_stale(g.gid, player("4"))
+        for client in g.clients[1:4]:
+            client.emit("voteSubmit", 5, namespace="/game")
+        validate_socketio_msg(
+            [g.clients[0]],
+            [
+                M.default_msg("gamePlayerReady", player("1")),
+                M.default_msg("gamePlayerReady", player("2")),
+                M.default_msg("gamePlayerReady", player("3")),
+                M.gameGetScore(score=15),
+                M.gameStart(memer=player("1"), rounds_remain=g.total_rounds - 1),
+            ],
+        )
+
+
+################################################################
+
+
+################################  AUDIENCE ################################
+@pytest.fixture
+def audience_voting():
+    app.config["AUDIENCE_VOTING"] = True
+    yield
+    app.config["AUDIENCE_VOTING"] = False
+
+
+def watch_client(gid: str):
+    return socketio.test_client(
+        app,
+        namespace="/game",
+        query_string=f"id={gid}&watch=1",
+        flask_test_client=app.test_client(),
+    )
+
+
+def test_spectator_joins_without_a_slot():
+    with NewGame(section="caption", filled=True) as g:
+        watcher = watch_client(g.gid)
+        assert watcher.is_connected(namespace="/game")
+        msg = watcher.get_received(namespace="/game")
+        assert msg[0]["name"] == "gameWatching"
+        snapshot = msg[0]["args"][0]
+        assert snapshot["audience"] == 1
+        assert snapshot["g_players"][player("0")] == {"name": "kevin0", "points": "0"}
+        assert fr_client.llen("game:{1234}:players") == 5
+
+        # spectators can't play
+        watcher.emit("playerReady", namespace="/game")
+        watcher.disconnect(namespace="/game")
+        assert fr_client.get("game:{1234}:audience") == "0"
+        assert fr_client.llen("game:{1234}:players") == 5
+
+        assert not watch_client("4321").is_connected(namespace="/game")
+
+
+def test_audience_votes(audience_voting):
+    with NewGame(section="vote", filled=True) as g:
+        watchers = [watch_client(g.gid) for _ in range(3)]
+        watchers[0].emit("audienceVote", 10, namespace="/game")
+        # counted once per turn
+        watchers[0].emit("audienceVote", 10, namespace="/game")
+        watchers[1].emit("audienceVote", 5, namespace="/game")
+        watchers[2].emit("audienceVote", 3, namespace="/game")
+
+        for client in g.clients[1:]:
+            client.emit("voteSubmit", 5, namespace="/game")
+
+        for watcher in watchers:
+            names = [m["name"] for m in watcher.get_received(namespace="/game")]
+            assert names.count("gamePlayerReady") == 4
+            assert "gameGetScore" in names and "gameStart" in names
+        validate_socketio_msg(
+            g.clients[:1],
+            [M.default_msg("gameAudienceScore", {"votes": 2, "score": 15})],
+        )
+        assert not fr_client.keys("game:{1234}:audience:*")
 
+        # the players moved on to the next caption
+        watchers[2].emit("audienceVote", 5, namespace="/game")
+        assert not fr_client.keys("game:{1234}:audience:*")
@@ -0,0 +1,51 @@
+from pytest_mock.plugin import MockerFixture
+
+from .. import readiness, redis_roles
+
+from .base import app, patch_redis
+
+
+def test_probe_reads_the_last_check(mocker: MockerFixture):
+    readiness.init_app(app)
+    check = mocker.patch.object(
+        redis_roles, "check", return_value={"state": 1.0, "pubsub": 2.0}
+    )
+    with app.test_client() as client:
+        # not ready until the dependencies were checked once
+        assert client.get("/ready").status_code == 503
+
+        readiness.check()
+        res = client.get("/ready")
+        assert res.status_code == 200
+        assert res.json["data"]["checks"] == {
+            "state": True,
+            "pubsub": True,
+            "memegen": True,
+            "greenlets": True,
+            "loop_lag": True,
+        }
+        # the probe itself sends nothing to the dependencies
+        assert check.call_count == 1
+
+        check.return_value = {"state": 1.0, "pubsub": None}
+        readiness.check()
+        res = client.get("/ready")
+        assert res.status_code == 503
+        assert res.json["data"]["checks"]["pubsub"] is False
+
+
+def test_stuck_checker_is_not_trusted(mocker: MockerFixture):
+    readiness.init_app(app)
+    mocker.patch.object(redis_roles, "check", return_value={"state": 1.0})
+    readiness.check()
+    assert readiness.ready()
+
+    readiness.loop_lag = 1000
+    readiness.check()
+    assert not readiness.ready()
+
+    readiness.loop_lag = 0
+    readiness.check()
+    later = readiness.checked + 3 * readiness.interval
+    mocker.patch("captionthis.readiness.time.monotonic", return_value=later)
+    assert not readiness.ready()
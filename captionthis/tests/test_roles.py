@@ -0,0 +1,103 @@
+import time
+
+import fakeredis
+import redis
+from pytest import fixture
+from pytest_mock.plugin import MockerFixture
+
+from .. import celery, redis_roles, replica
+from ..api.controllerAPI import ControllerAPI
+from ..roles import HEARTBEAT_KEY, message_queue, role_urls
+
+from .base import app, fr_client
+
+
+@fixture()
+def patch_redis(mocker: MockerFixture):
+    mocker.patch("captionthis.roles.redis_client", fr_client)
+    mocker.patch("captionthis.api.controllerAPI.redis_client", fr_client)
+    yield
+
+
+@fixture()
+def replica_db(mocker: MockerFixture):
+    db = fakeredis.FakeStrictRedis(
+        server=fakeredis.FakeServer(), decode_responses=True, encoding="utf-8"
+    )
+    mocker.patch.object(replica, "client", db)
+    mocker.patch.object(replica, "check_interval", 1)
+    mocker.patch.object(replica, "checked", float("-inf"))
+    yield db
+
+
+def test_every_role_has_its_own_endpoint():
+    config = dict(
+        app.config,
+        REDIS_URL="redis://state",
+        REDIS_REPLICA_URL=None,
+        SOCKETIO_MESSAGE_QUEUE="redis://pubsub",
+        CELERY_BROKER_URL="redis://broker",
+    )
+    assert role_urls(config) == {
+        "state": "redis://state",
+        "replica": None,
+        "pubsub": "redis://pubsub",
+        "broker": "redis://broker",
+    }
+
+    queue = message_queue(config, write_only=True)
+    pool = queue.redis.connection_pool
+    assert pool.connection_kwargs["host"] == "pubsub"
+    assert pool.max_connections == app.config["REDIS_MAX_CONNECTIONS"]["pubsub"]
+    # A full pool waits for a connection instead of raising
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.timeout == app.config["REDIS_POOL_TIMEOUT"]
+    # The queue is left to Flask-SocketIO if it is not on Redis
+    assert message_queue(dict(config, SOCKETIO_MESSAGE_QUEUE=None), True) is None
+
+
+def test_broker_pool_follows_the_config():
+    assert (
+        celery.conf.broker_pool_limit == app.config["REDIS_MAX_CONNECTIONS"]["broker"]
+    )
+    options = celery.conf.broker_transport_options
+    assert options["health_check_interval"] == app.config["REDIS_HEALTH_CHECK_INTERVAL"]
+
+
+def test_health_of_every_role(patch_redis, mocker: MockerFixture):
+    # Testing doesn't use a message queue, only the broker is pinged apart
+    assert set(redis_roles.clients) == {"broker"}
+    m_ping = mocker.patch.object(
+        redis_roles.clients["broker"], "ping", side_effect=redis.ConnectionError("down")
+    )
+
+    with app.test_client() as client:
+        rv = client.get("/health/redis")
+        assert rv.status_code == 503
+        latency = rv.json["data"]["latency_ms"]
+        assert latency["state"] >= 0
+        assert latency["broker"] is None
+        assert redis_roles.failures["broker"] == 1
+
+        m_ping.side_effect = None
+        assert client.get("/health/redis").status_code == 200
+
+
+def test_lobby_reads_from_a_replica_that_keeps_up(patch_redis, replica_db):
+    ControllerAPI.create_game("5", "2", "10", "1234")
+    # The replica's lag is unknown until the heartbeat made it there
+    assert ControllerAPI.game("1234", max_staleness=2)
+    replica_db.set(HEARTBEAT_KEY, fr_client.get(HEARTBEAT_KEY))
+    replica.checked = float("-inf")
+
+    # The game didn't reach the replica yet
+    assert ControllerAPI.game("1234", max_staleness=2) == {}
+    assert ControllerAPI.games(max_staleness=2) == []
+    # Reads that need consistency stay on the primary
+    assert ControllerAPI.game("1234")
+    assert ControllerAPI.games() == ["1234"]
+
+    # A replica lagging behind more than tolerated isn't read from
+    replica_db.set(HEARTBEAT_KEY, time.time() - 10)
+    replica.checked = float("-inf")
+    assert ControllerAPI.game("1234", max_staleness=2)
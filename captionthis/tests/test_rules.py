@@ -0,0 +1,221 @@
+import pytest
+
+from ..errors import ActivityError, CaptionError, VoteError
+from ..rules import (
+    CancelTimer,
+    CaptionSubmitted,
+    CloseRoom,
+    DeleteAssets,
+    Emit,
+    GameState,
+    PlayerLeft,
+    PlayerReady,
+    PlayersLeft,
+    Settings,
+    StartRound,
+    StartTimer,
+    TimesUp,
+    VoteCast,
+    next_memer,
+    standings,
+    transition,
+    winners,
+)
+from ..utils import Section
+from .base import player
+
+PLAYERS = tuple(player(i) for i in range(3))
+
+
+@pytest.fixture
+def waiting() -> GameState:
+    return GameState(
+        gid="1234",
+        status="0",
+        max_players=5,
+        total_rounds=2,
+        duration=10,
+        rounds_remain=2,
+        current_section=Section.WAIT.value,
+        current_memer="",
+        current_memer_idx=0,
+        players=PLAYERS,
+        names={pid: f"kevin{i}" for i, pid in enumerate(PLAYERS)},
+        points=dict.fromkeys(PLAYERS, 0),
+    )
+
+
+@pytest.fixture
+def captioning(waiting: GameState) -> GameState:
+    for pid in PLAYERS:
+        waiting, _ = transition(waiting, PlayerReady(pid))
+    return waiting
+
+
+@pytest.fixture
+def voting(captioning: GameState) -> GameState:
+    state, _ = transition(captioning, CaptionSubmitted(player(0), "finger0"))
+    return state
+
+
+def names(effects):
+    return [e.event if isinstance(e, Emit) else type(e).__name__ for e in effects]
+
+
+def test_everyone_ready_starts_the_game(waiting: GameState):
+    state, effects = transition(waiting, PlayerReady(player(0)))
+    assert state.activity == {player(0)}
+    assert effects == [Emit("gamePlayerReady", (player(0),))]
+
+    with pytest.raises(ActivityError):
+        transition(state, PlayerReady(player(0)))
+
+    state, _ = transition(state, PlayerReady(player(1)))
+    state, effects = transition(state, PlayerReady(player(2)))
+    assert state.current_section == Section.CAPTION.value
+    assert state.status == "1"
+    assert state.rounds_remain == 1
+    assert state.current_memer == player(0)
+    assert state.activity == frozenset()
+    assert StartRound(player(0), 2, 1) in effects
+    assert StartTimer(10) in effects
+    assert names(effects)[-1] == "gameTimeStart"
+
+
+def test_caption_switches_to_vote(captioning: GameState):
+    with pytest.raises(CaptionError):
+        transition(captioning, CaptionSubmitted(player(1), "finger1"))
+
+    state, effects = transition(captioning, CaptionSubmitted(player(0), "finger0"))
+    assert state.current_section == Section.VOTE.value
+    assert state.captions == {player(0): ("finger0", 0)}
+    assert Emit("gameGetCaption", ({"key": "finger0", "score": "0"},)) in effects
+    assert StartTimer(Settings().vote_duration) in effects
+
+    with pytest.raises(CaptionError):
+        transition(state, CaptionSubmitted(player(0), "finger0"))
+
+
+def test_votes(voting: GameState):
+    with pytest.raises(VoteError):
+        transition(voting, VoteCast(player(0), 5))
+    with pytest.raises(VoteError):
+        transition(voting, VoteCast(player(1), 3))
+
+    state, _ = transition(voting, VoteCast(player(1), 5))
+    with pytest.raises(VoteError):
+        transition(state, VoteCast(player(1), 5))
+
+    state, effects = transition(state, VoteCast(player(2), 10))
+    assert Emit("gameGetScore", ("15",)) in effects
+    # next memer in the same round
+    assert state.current_memer == player(1)
+    assert state.current_section == Section.CAPTION.value
+    assert state.captions == {player(0): ("finger0", 15)}
+
+
+def test_last_turn_of_the_game(voting: GameState):
+    state = voting._replace(
+        rounds_remain=0,
+        current_memer=player(2),
+        current_memer_idx=2,
+        captions={player(0): ("finger0", 10), player(2): ("finger2", 0)},
+    )
+    state, _ = transition(state, VoteCast(player(0), 0))
+    state, effects = transition(state, VoteCast(player(1), 0))
+    assert Emit("gameGetWinner", ([(player(0), "finger0", "10")],)) in effects
+    assert state.points[player(0)] == 1
+    assert state.current_section == Section.RESTART.value
+    final = effects[names(effects).index("gameEnd")].args[0]
+    assert final[player(0)] == {"name": "kevin0", "points": "1"}
+    assert effects[-2:] == [CancelTimer(), Emit("gameTimeUp")]
+
+    # everyone ready again starts a fresh game
+    for pid in PLAYERS:
+        state, _ = transition(state, PlayerReady(pid))
+    assert state.points == dict.fromkeys(PLAYERS, 0)
+    assert state.rounds_remain == 1
+    assert state.current_memer == player(0)
+
+
+def test_times_up(captioning: GameState):
+    state, effects = transition(captioning, TimesUp())
+    assert state.current_memer == player(1)
+    assert StartRound(player(1), 2, 1) in effects
+
+
+def test_memer_leaves(captioning: GameState):
+    state = captioning._replace(players=captioning.players + (player(3),))
+    state, effects = transition(state, PlayerLeft(player(0)))
+    assert state.players == (player(1), player(2), player(3))
+    assert state.current_memer == player(1)
+    assert Emit("gameReason", ("Memer disconnected",)) in effects
+
+
+def test_players_leave_at_once(captioning: GameState):
+    pids = tuple(player(i) for i in range(6))
+    state = captioning._replace(players=pids)
+    leaving = (player(0), player(3), player(4))
+    state, effects = transition(state, PlayersLeft(leaving))
+    assert state.players == (player(1), player(2), player(5))
+    assert names(effects).count("gamePlayerDisconnected") == 3
+    # a single transition for the whole batch
+    assert names(effects).count("StartRound") == 1
+    assert state.current_memer == player(1)
+
+
+def test_game_closes_when_not_playable(captioning: GameState):
+    state, effects = transition(captioning, PlayerLeft(player(2)))
+    assert effects[-3:] == [Emit("gameDisconnected"), CloseRoom(), DeleteAssets()]
+
+
+def test_full_lobby_reopens(waiting: GameState):
+    state, effects = transition(waiting._replace(status="2"), PlayerLeft(player(2)))
+    assert state.status == "0"
+    assert effects == [
+        Emit("gamePlayerDisconnected", (player(2),)),
+        Emit("gameOpen"),
+    ]
+
+
+def test_absent_players_are_not_waited_for(waiting: GameState, voting: GameState):
+    state = waiting._replace(absent=frozenset({player(2)}))
+    state, _ = transition(state, PlayerReady(player(0)))
+    state, effects = transition(state, PlayerReady(player(1)))
+    assert state.current_section == Section.CAPTION.value
+
+    state, effects = transition(
+        voting._replace(absent=frozenset({player(2)})), VoteCast(player(1), 5)
+    )
+    assert Emit("gameGetScore", ("5",)) in effects
+
+    # the absent player gets swept, 2 live players can't go on
+    state, effects = transition(state, PlayerLeft(player(2)))
+    assert CloseRoom() in effects
+
+    # a late disconnect of a player already swept changes nothing
+    state, effects = transition(waiting, PlayerLeft("ghost"))
+    assert state == waiting and effects == []
+
+
+def test_next_memer():
+    assert next_memer(PLAYERS, "", 0) == (player(0), 0, True)
+    assert next_memer(PLAYERS, player(0), 0) == (player(1), 1, True)
+    assert next_memer(PLAYERS, player(2), 2) == (player(0), 0, False)
+    # memer at the end of the list disconnected
+    assert next_memer(PLAYERS[:2], player(2), 2) == (player(0), 0, False)
+
+
+def test_winners():
+    captions = {player(0): ("a", 5), player(1): ("b", 10), player(2): ("c", 10)}
+    assert winners(PLAYERS, captions) == [
+        (player(1), "b", "10"),
+        (player(2), "c", "10"),
+    ]
+    assert winners(PLAYERS, {player(0): ("a", 0)}) == []
+
+
+def test_standings_are_ranked(waiting: GameState):
+    state = waiting._replace(points={player(0): 1, player(1): 3, player(2): 2})
+    assert list(standings(state)) == [player(1), player(2), player(0)]
+    assert standings(state)[player(1)] == {"name": "kevin1", "points": "3"}
@@ -0,0 +1,40 @@
+import pytest
+from flask import Flask
+from pytest_mock.plugin import MockerFixture
+
+from .. import redis_client
+from ..api.controllerAPI import ControllerAPI
+from ..storage import Storage
+
+
+def memory_app() -> Flask:
+    app = Flask(__name__)
+    app.config["STORAGE_BACKEND"] = "memory"
+    return app
+
+
+def test_memory_backend_runs_the_game(mocker: MockerFixture):
+    storage = Storage(decode_responses=True, encoding="utf-8")
+    storage.init_app(memory_app())
+    mocker.patch.object(redis_client, "_redis_client", storage._redis_client)
+
+    ControllerAPI.create_game("5", "2", "10", "1234")
+    pid = ControllerAPI.join_game("1234", "kevin0")["p_id"]
+    # scripts run on the memory engine too
+    ControllerAPI.touch("1234", pid)
+    assert ControllerAPI.roster("1234") == {pid: {"name": "kevin0", "points": "0"}}
+    ControllerAPI.remove_game("1234")
+    assert ControllerAPI.all_games() == []
+
+    # every engine is a server of its own
+    other = Storage(decode_responses=True)
+    other.init_app(memory_app())
+    storage.set("key", "1")
+    assert other.get("key") is None
+
+
+def test_unknown_backend():
+    app = memory_app()
+    app.config["STORAGE_BACKEND"] = "cassandra"
+    with pytest.raises(ValueError):
+        Storage().init_app(app)
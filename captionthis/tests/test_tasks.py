@@ -1,27 +1,34 @@
+import time
+from types import SimpleNamespace
+
 from pytest import fixture
 from pytest_mock.plugin import MockerFixture
 
-from ..tasks import times_up, filterer
+from ..api.controllerAPI import ControllerAPI
+from ..rules import TimesUp
+from ..utils import games_key
+from ..tasks import times_up, sweep_rooms
 from .base import app, fr_client
 
 
 @fixture()
 def patch_redis(mocker: MockerFixture):
-    mocker.patch("captionthis.tasks.redis_client", fr_client)
+    mocker.patch("captionthis.api.controllerAPI.redis_client", fr_client)
     yield
 
 
 def test_times_up(patch_redis, mocker: MockerFixture):
     # mock functions that are outside of the task
     mocker.patch("captionthis.wsgi_aux.app", app)
+    mocker.patch("captionthis.timers.redis_client", fr_client)
     m_captionthis = mocker.patch("captionthis.api.captionthisAPI.CaptionThis")
-    m_captionthis.return_value = "game's instance"
-    m_next_player_turn = mocker.patch("captionthis.helpers.next_player_turn")
-    m_switch_to = mocker.patch("captionthis.helpers.switch_to")
+    game = m_captionthis.return_value
+    game.gid = "1234"
+    m_dispatch = mocker.patch("captionthis.helpers.dispatch")
 
     # add related dummy data
-    fr_client.set("game:1234", "1")
-    fr_client.set("game:1234:timer", "data")
+    fr_client.set("game:{1234}", "1")
+    fr_client.hset("game:{1234}:timer", "task_id", "dummy_task_id")
     mocked_game_info = {
         "max_players": "5",
         "total_rounds": "2",
@@ -31,29 +38,38 @@ def test_times_up(patch_redis, mocker: MockerFixture):
         "current_memer": "memer0",
         "current_memer_idx": "0",
     }
-    fr_client.hmset("game:1234:info", mocked_game_info)
+    fr_client.hmset("game:{1234}:info", mocked_game_info)
 
-    times_up("1234")
+    times_up.apply(("1234",), task_id="dummy_task_id")
 
     m_captionthis.assert_called_with("1234", "1", **mocked_game_info)
-    m_next_player_turn.assert_called_with("game's instance")
-    m_switch_to.assert_called_with("caption", "game's instance")
-    assert not fr_client.exists("game:1234:timer")
-
-
-def test_filterer(patch_redis):
-    # dummy data
-    fr_client.set("game:1234", "0")
-    fr_client.set("game:1234:info", 'game"s info')
-    fr_client.lpush("games", "1234")
-    fr_client.set("game:1235:info", 'game"s info')
-    fr_client.lpush("games", "1235")
-
-    filterer()
-
-    assert fr_client.exists("game:1234")
-    assert fr_client.exists("game:1234:info")
-    assert not fr_client.exists("game:1235:info")
-    games = fr_client.lrange("games", 0, -1)
-    assert "1234" in games
-    assert not "1235" in games
+    m_dispatch.assert_called_once_with(game, TimesUp(), guard=mocker.ANY)
+    assert m_dispatch.call_args.kwargs["guard"]()
+
+    # the timer was replaced while this task was waiting
+    fr_client.hset("game:{1234}:timer", "task_id", "new_task_id")
+    assert not m_dispatch.call_args.kwargs["guard"]()
+
+
+def test_sweep_rooms(patch_redis, mocker: MockerFixture):
+    mocker.patch.dict("sys.modules", {"captionthis.wsgi_aux": SimpleNamespace(app=app)})
+    now = time.time()
+    # alive, its expiry slid since it was indexed
+    fr_client.set("game:{1234}", "1", ex=100)
+    fr_client.zadd(games_key("1234"), {"1234": now - 1})
+    # expired, some keys were left behind
+    fr_client.set("game:{1235}:info", 'game"s info')
+    fr_client.rpush("game:{1235}:players", "r0")
+    fr_client.hset("game:{1235}:timer", "task_id", "dummy")
+    fr_client.zadd(games_key("1235"), {"1235": now - 1})
+    # not due yet
+    fr_client.set("game:{1236}:info", 'game"s info')
+    fr_client.zadd(games_key("1236"), {"1236": now + 60})
+
+    cost = sweep_rooms.apply().get()
+
+    assert cost == {"examined": 2, "alive": 1, "removed": 1, "keys": 3}
+    assert not fr_client.keys("game:{1235}*")
+    assert fr_client.exists("game:{1236}:info")
+    assert sorted(ControllerAPI.all_games()) == ["1234", "1236"]
+    assert fr_client.zscore(games_key("1234"), "1234") >= now + 99
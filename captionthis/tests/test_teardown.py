@@ -0,0 +1,52 @@
+from pytest import fixture
+from pytest_mock.plugin import MockerFixture
+
+from ..api.controllerAPI import ControllerAPI
+from ..tasks import teardown_rooms
+from ..teardown import ExpiryListener
+
+from .base import app, fr_client, patch_redis
+
+
+@fixture()
+def listener(mocker: MockerFixture):
+    mocker.patch("captionthis.teardown.redis_client", fr_client)
+    mocker.patch("captionthis.wsgi_aux.app", app)
+    listener = ExpiryListener()
+    listener.init_app(app)
+    listener.batch = 2
+    yield listener
+
+
+def expired(key: str) -> dict:
+    return {"type": "message", "channel": "__keyevent@0__:expired", "data": key}
+
+
+def test_rooms_are_torn_down_in_batches(listener, mocker: MockerFixture):
+    m_delay = mocker.patch("captionthis.teardown.teardown_rooms.delay")
+    for key in ("game:{1234}", "game:{1234}:timer", "r1", "game:{1235}"):
+        listener.on_message(expired(key))
+    listener.on_message(expired("game:{1236}"))
+
+    assert listener.flush() == ["1234", "1235"]
+    m_delay.assert_called_once_with(["1234", "1235"])
+    # the last one waits for the window to pass
+    assert listener.flush() == []
+    listener.first -= listener.window
+    assert listener.flush() == ["1236"]
+
+
+def test_expired_room_teardown(listener, mocker: MockerFixture):
+    m_delete = mocker.patch("captionthis.api.memegenAPI.requests.delete")
+    for gid in ("1234", "1235"):
+        ControllerAPI.create_game("5", "2", "10", gid)
+        ControllerAPI.join_game(gid, "kevin0")
+    fr_client.delete("game:{1234}")
+
+    # 1235 was created again since its status key expired
+    teardown_rooms.apply(args=[["1234", "1235"]])
+
+    assert not fr_client.keys("game:{1234}*")
+    assert ControllerAPI.all_games() == ["1235"]
+    assert ControllerAPI.game("1235")
+    m_delete.assert_called_once_with("http://memegen:5000/images/1234")
@@ -1,7 +1,15 @@
+import eventlet
+from flask import Flask
 from pytest import fixture
 from pytest_mock.plugin import MockerFixture
 
-from ..timers import remove_timer, start_timer
+from ..timers import (
+    LocalTimers,
+    current_timer,
+    local_timers,
+    remove_timer,
+    start_timer,
+)
 
 from .base import fr_client
 
@@ -20,12 +28,15 @@ class Mocked_Task_Result:
 def test_timer(patch_redis, mocker: MockerFixture):
     m_times_up = mocker.patch("captionthis.tasks.times_up.apply_async")
     m_times_up.return_value = Mocked_Task_Result()
+    mocker.patch("captionthis.timers.time.time", return_value=1000.0)
 
     start_timer("1234", "120")
 
-    m_times_up.assert_called_once_with(("1234",), countdown="120", ignore_result=True)
+    m_times_up.assert_called_once_with(
+        ("1234", 1120.0), countdown="120", ignore_result=True
+    )
 
-    assert fr_client.hgetall("game:1234:timer") == {
+    assert fr_client.hgetall("game:{1234}:timer") == {
         "duration": "120",
         "task_id": "dummy_task_id",
     }
@@ -33,5 +44,54 @@ def test_timer(patch_redis, mocker: MockerFixture):
     m_celery = mocker.patch("captionthis.timers.celery.control.revoke")
     remove_timer("1234")
 
-    assert not fr_client.exists("game:1234:timer")
+    assert not fr_client.exists("game:{1234}:timer")
     m_celery.assert_called_once_with("dummy_task_id")
+
+
+def test_local_timer(patch_redis, mocker: MockerFixture):
+    mocker.patch.object(local_timers, "enabled", True)
+    m_apply_async = mocker.patch("captionthis.tasks.times_up.apply_async")
+    m_went_off = mocker.patch("captionthis.timers.went_off")
+
+    start_timer("1234", "0.01")
+    timer_id = current_timer("1234")
+    eventlet.sleep(0.05)
+    m_went_off.assert_called_once_with("1234", timer_id, mocker.ANY)
+    assert not local_timers.pending
+
+    start_timer("1234", "0.01")
+    remove_timer("1234")
+    eventlet.sleep(0.05)
+    assert m_went_off.call_count == 1
+    assert not local_timers.pending
+    m_apply_async.assert_not_called()
+
+
+def test_memory_backend_fires_timers_locally():
+    app = Flask(__name__)
+    app.config.update(LOCAL_TIMERS=False, STORAGE_BACKEND="memory")
+    timers = LocalTimers()
+    timers.init_app(app)
+    assert timers.enabled
+
+
+def test_sweeps_run_on_the_hub(mocker: MockerFixture):
+    app = Flask(__name__)
+    app.config.update(LOCAL_TIMERS=True, STORAGE_BACKEND="redis")
+    timers = LocalTimers()
+    m_every = mocker.patch.object(timers, "every")
+    timers.init_app(app)
+    scheduled = {c.args[1].__name__: c.args[0] for c in m_every.call_args_list}
+    assert scheduled == {
+        "remove_leftovers": 60.0,
+        "evict_stale": 30.0,
+        "recover_overdue": 30.0,
+    }
+
+    calls = []
+    timers = LocalTimers()
+    timers.app = app
+    sweeper = timers.every(0.01, lambda: calls.append(1))
+    eventlet.sleep(0.05)
+    sweeper.kill()
+    assert len(calls) >= 2
@@ -1,5 +1,114 @@
+import logging
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+import eventlet
+
 from . import celery, redis_client
-from .tasks import times_up
+from .tasks import PERIODIC, times_up
+from .utils import game_key
+
+
+class LocalTimers:
+    """Timers of the rooms fired by this process's eventlet hub
+
+    A single-node deployment (LOCAL_TIMERS) doesn't need Celery to move its
+    rooms along: a timer is a greenthread scheduled on the hub's heap, it goes
+    off within milliseconds without a round trip to the broker. A timer that
+    went off after it was replaced is dropped by time_up like a Celery one.
+    The memory storage backend always fires its timers here.
+
+    The grace period of a disconnected player, the buffered departures and
+    the teardown of expired rooms are run here too, and so are the periodic
+    sweeps of Celery's beat schedule (sweep_rooms, sweep_presence,
+    recover_rooms) at the same intervals.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.pending: Dict[str, eventlet.greenthread.GreenThread] = {}
+
+    def init_app(self, app):
+        self.app = app
+        # Celery workers can't see the state kept in this process's memory
+        self.enabled = app.config["LOCAL_TIMERS"] or (
+            app.config["STORAGE_BACKEND"] == "memory"
+        )
+        if self.enabled and not app.testing:
+            for entry in celery.conf.beat_schedule.values():
+                self.every(entry["schedule"], PERIODIC[entry["task"]])
+
+    def start(self, gid: str, duration: float) -> str:
+        """Schedule a room's timer
+
+        Args:
+            gid (str): game's ID
+            duration (float): seconds until it goes off
+
+        Returns:
+            str: timer's ID
+        """
+        timer_id = uuid.uuid4().hex
+        self.pending[timer_id] = eventlet.spawn_after(
+            float(duration), self._fire, gid, timer_id, time.time() + float(duration)
+        )
+        return timer_id
+
+    def cancel(self, timer_id: str):
+        if (timer := self.pending.pop(timer_id, None)) is not None:
+            timer.cancel()
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        """Call a function in an app context once a delay is over
+
+        The Celery tasks of the game that are run after a countdown, such as
+        grace_expired, are called this way through their function. It can't
+        be cancelled, the function checks whether it still has to run.
+
+        Args:
+            delay (float): seconds to wait
+            fn (Callable): function to call
+            args: its arguments
+        """
+        eventlet.spawn_after(float(delay), self._call, fn, *args)
+
+    def every(self, interval: float, fn: Callable) -> eventlet.greenthread.GreenThread:
+        """Call a function in an app context every interval seconds
+
+        Args:
+            interval (float): seconds between two calls
+            fn (Callable): function to call
+
+        Returns:
+            GreenThread: the loop, for good unless it is killed
+        """
+
+        def repeat():
+            while True:
+                eventlet.sleep(float(interval))
+                self._call(fn)
+
+        return eventlet.spawn(repeat)
+
+    def _call(self, fn: Callable, *args):
+        with self.app.app_context():
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"{fn.__name__}{args} failed: {e}", exc_info=True)
+
+    def _fire(self, gid: str, timer_id: str, due: float):
+        self.pending.pop(timer_id, None)
+        with self.app.app_context():
+            try:
+                went_off(gid, timer_id, due)
+            except Exception as e:
+                logging.error(f"[{gid}] timer failed: {e}", exc_info=True)
+
+
+local_timers = LocalTimers()
 
 
 def start_timer(gid: str, duration: str):
@@ -13,12 +122,17 @@ def start_timer(gid: str, duration: str):
       duration (str): timer's TTL
       section (str): Which section calls this function
     """
-    task = times_up.apply_async((gid,), countdown=duration, ignore_result=True)
+    if local_timers.enabled:
+        task_id = local_timers.start(gid, duration)
+    else:
+        due = time.time() + float(duration)
+        task = times_up.apply_async((gid, due), countdown=duration, ignore_result=True)
+        task_id = task.id
     # store timer's info to redis
     with redis_client.pipeline() as pipe:
         pipe.multi()
-        pipe.hset(f"game:{gid}:timer", "duration", duration)
-        pipe.hset(f"game:{gid}:timer", "task_id", task.id)
+        pipe.hset(f"{game_key(gid)}:timer", "duration", duration)
+        pipe.hset(f"{game_key(gid)}:timer", "task_id", task_id)
         pipe.execute()
 
 
@@ -28,7 +142,47 @@ def remove_timer(gid: str):
     Args:
         gid (str): game's ID
     """
-    timer = redis_client.hgetall(f"game:{gid}:timer")
+    timer = redis_client.hgetall(f"{game_key(gid)}:timer")
     if timer:
-        celery.control.revoke(timer["task_id"])
-        redis_client.delete(f"game:{gid}:timer")
+        if local_timers.enabled:
+            local_timers.cancel(timer["task_id"])
+        else:
+            celery.control.revoke(timer["task_id"])
+        redis_client.delete(f"{game_key(gid)}:timer")
+
+
+def current_timer(gid: str) -> Optional[str]:
+    """Get the task's ID of the running timer
+
+    Args:
+        gid (str): game's ID
+
+    Returns:
+        Optional[str]: Celery task's ID, None if there is no timer
+    """
+    return redis_client.hget(f"{game_key(gid)}:timer", "task_id")
+
+
+def went_off(gid: str, task_id: str, due: Optional[float] = None):
+    """Move the room along now that its timer went off, in an app context
+
+    Args:
+        gid (str): game's ID
+        task_id (str): ID of the timer, its Celery task's unless LOCAL_TIMERS
+        due (Optional[float]): timestamp the timer was set to go off at
+    """
+    from flask import current_app
+
+    from .actors import actor
+    from .api.captionthisAPI import CaptionThis
+    from .api.controllerAPI import ControllerAPI
+    from .helpers import time_up
+
+    if current_app.config["GAME_ACTORS"]:
+        # The room's owner drops this command if the timer was replaced
+        actor.submit(gid, "times_up", task_id, due)
+        return
+
+    if room := ControllerAPI.game(gid):
+        game = CaptionThis(gid, room["g_status"], **room["g_info"])
+        time_up(game, task_id, due)
@@ -1,6 +1,8 @@
 import enum
 import random
-from typing import Dict, List, Tuple
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
 from .errors import (
     InvalidDuration,
@@ -60,6 +62,94 @@ def error_formatter(data, code=200) -> Tuple[Dict, str]:
     }, code
 
 
+# Global indexes are split over this many keys, each in its own hash slot
+INDEX_SHARDS = 16
+
+
+def game_key(gid: str) -> str:
+    """Key of a game's status, which prefixes every other key of the game
+
+    The game's ID is the hash tag of its keys, so a room lives in a single
+    Redis Cluster slot and its transactions and scripts stay on one node.
+
+    Args:
+        gid (str): game's ID
+
+    Returns:
+        str: i.e game:{1234}
+    """
+    return f"game:{{{gid}}}"
+
+
+def index_shard(member: str) -> int:
+    """Shard of a global index a member belongs to"""
+    return zlib.crc32(member.encode()) % INDEX_SHARDS
+
+
+def games_key(gid: str) -> str:
+    """Shard of the games index holding a game, i.e games:{3}"""
+    return f"games:{{{index_shard(gid)}}}"
+
+
+def presence_key(gid: str) -> str:
+    """Shard of the presence index holding a game's players, i.e presence:{3}"""
+    return f"presence:{{{index_shard(gid)}}}"
+
+
+def deadlines_key(gid: str) -> str:
+    """Shard of the deadlines index holding a game, i.e deadlines:{3}"""
+    return f"deadlines:{{{index_shard(gid)}}}"
+
+
+def shard_keys(index: str) -> List[str]:
+    """Every shard of a global index
+
+    Args:
+        index (str): i.e games
+
+    Returns:
+        List[str]: i.e ["games:{0}", "games:{1}", ...]
+    """
+    return [f"{index}:{{{shard}}}" for shard in range(INDEX_SHARDS)]
+
+
+# Window of the global leaderboard -> (key's date format, time to live)
+LEADERBOARD_WINDOWS = {
+    "daily": ("%Y%m%d", timedelta(days=2)),
+    "weekly": ("%G-W%V", timedelta(days=8)),
+}
+
+
+def leaderboard_key(window: str, name: str, when: Optional[datetime] = None) -> str:
+    """Shard of the global leaderboard holding a player for the day or the week
+    of a date
+
+    Args:
+        window (str): one of LEADERBOARD_WINDOWS
+        name (str): player's nickname, picks the shard
+        when (datetime): defaults to now, in UTC
+
+    Returns:
+        str: i.e leaderboard:daily:20210104:{3}
+    """
+    return f"{leaderboard_index(window, when)}:{{{index_shard(name)}}}"
+
+
+def leaderboard_index(window: str, when: Optional[datetime] = None) -> str:
+    """Name of the global leaderboard for the day or the week of a date
+
+    Args:
+        window (str): one of LEADERBOARD_WINDOWS
+        when (datetime): defaults to now, in UTC
+
+    Returns:
+        str: i.e leaderboard:daily:20210104, see shard_keys()
+    """
+    fmt, _ = LEADERBOARD_WINDOWS[window]
+    when = when or datetime.now(timezone.utc)
+    return f"leaderboard:{window}:{when.strftime(fmt)}"
+
+
 def generate_game_id() -> str:
     """
     Generate random 4-digits number
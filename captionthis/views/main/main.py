@@ -29,7 +29,9 @@ def join_room():
     if join_form.validate():
         game_id = join_form.game_id.data
 
-        game = ControllerAPI.game(game_id)
+        # Only a hint, joining checks the game again on the primary
+        staleness = current_app.config["LOBBY_MAX_STALENESS"]
+        game = ControllerAPI.game(game_id, staleness)
         if game:
             status = game['g_status']
             if status == "0":
@@ -71,7 +73,7 @@ def join_room():
 
 @main_bp.route("/joinRandom", methods=["POST"])
 def join_random_room():
-    open_games = ControllerAPI.games()
+    open_games = ControllerAPI.games(current_app.config["LOBBY_MAX_STALENESS"])
     # try:
     #     data = GameAPI.request_open_games()
     # except (Timeout, ConnectionError):
@@ -112,3 +114,19 @@ def create_room():
         return response_formatter(dict(id=game_id))
 
     return response_formatter(create_form.errors, 400)
+
+
+@main_bp.route("/leaderboard/<window>")
+def leaderboard(window):
+    start = max(request.args.get("start", 0, type=int), 0)
+    count = min(max(request.args.get("count", 10, type=int), 1), 100)
+    try:
+        ranks = ControllerAPI.leaderboard(window, start, count)
+    except KeyError:
+        return error_formatter(f"Unknown leaderboard {window}", 404)
+    return response_formatter(
+        [
+            dict(rank=start + i + 1, name=name, points=points)
+            for i, (name, points) in enumerate(ranks)
+        ]
+    )
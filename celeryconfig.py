@@ -1,13 +1,21 @@
-from celery.schedules import crontab
-
 
 accept_content = ["json", "msgpack"]
 task_serializer = "json"
 task_ignore_result = True
 
+# The broker's pool is sized by create_app() from REDIS_MAX_CONNECTIONS
+
 beat_schedule = {
-    "filterer-celery": {
-        "task": "captionthis.tasks.filterer",
-        "schedule": crontab(minute="10"),
-    }
+    "sweep-rooms-celery": {
+        "task": "captionthis.tasks.sweep_rooms",
+        "schedule": 60.0,
+    },
+    "sweep-presence-celery": {
+        "task": "captionthis.tasks.sweep_presence",
+        "schedule": 30.0,
+    },
+    "recover-rooms-celery": {
+        "task": "captionthis.tasks.recover_rooms",
+        "schedule": 30.0,
+    },
 }
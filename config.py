@@ -7,14 +7,73 @@ class Config(object):
     DEBUG = False
     TESTING = False
     SECRET_KEY = os.environ.get("SECRET_KEY", "51f52814-0071-11e6-a247-000ec6c2372c")
-    SOCKETIO_MESSAGE_QUEUE = os.environ.get(
-        "SOCKETIO_MESSAGE_QUEUE", os.environ.get("CELERY_BROKER_URL", "redis://")
-    )
+    # Redis endpoint of every role: game state, Socket.IO's pub/sub and Celery's
+    # broker. Give each its own server so that a burst of emits or tasks can't
+    # stall the game's writes, the message queue falls back to the broker.
     REDIS_URL = os.environ.get("REDIS_URL", "redis://redis")
+    # Keep the game's state in Redis, or in this process with "memory" for
+    # single-node deployments, whose timers then fire locally. "memory" needs
+    # requirements-memory.txt and is slower than a local Redis server.
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "redis")
+    # Replica of the state store the lobby reads from, none reads the primary
+    REDIS_REPLICA_URL = os.environ.get("REDIS_REPLICA_URL")
+    REPLICA_LAG_CHECK_INTERVAL = 1  # in seconds
+    # How stale the lobby's reads (/join, /joinRandom) may be
+    LOBBY_MAX_STALENESS = 2  # in seconds
+    # Games whose status and info are kept in memory, 0 disables the cache
+    NEAR_CACHE_SIZE = int(os.environ.get("NEAR_CACHE_SIZE", "0"))
+    NEAR_CACHE_TTL = 30  # in seconds
+    CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://")
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", CELERY_BROKER_URL)
+    # Connections per process in the pool of each role
+    REDIS_MAX_CONNECTIONS = {"state": 50, "replica": 50, "pubsub": 10, "broker": 10}
+    # A full pool waits this long for a connection to be given back
+    REDIS_POOL_TIMEOUT = 5  # in seconds
+    # Idle connections are pinged before being reused after this long
+    REDIS_HEALTH_CHECK_INTERVAL = 30  # in seconds
+    REDIS_CHECK_TIMEOUT = 1  # in seconds
     DEFAULT_VOTE_DURATION = 120
     IMAGES_DIRECTORY = os.environ.get("IMAGES_DIRECTORY", "")
     TIME_DELAY = 2  # in seconds
     VOTE_WAIT_TIME = 2  # in seconds
+    # Run every event of a room serially on the owner of the room's lease
+    GAME_ACTORS = os.environ.get("GAME_ACTORS", "0") == "1"
+    # Fire the rooms' timers, grace periods, buffered departures and periodic
+    # sweeps in the web server instead of Celery, single node
+    LOCAL_TIMERS = os.environ.get("LOCAL_TIMERS", "0") == "1"
+    ACTOR_LEASE_TTL = 5000  # in milliseconds
+    # Keep the slot of a disconnected player, 0 kicks right away
+    RECONNECT_GRACE_PERIOD = 0  # in seconds
+    # Apply the departures of a room at once, 0 applies each right away
+    DISCONNECT_COALESCE_WINDOW = 0  # in seconds
+    # Evict players who stopped sending heartbeats, 0 relies on disconnects only
+    PRESENCE_TIMEOUT = 0  # in seconds
+    PRESENCE_SWEEP_BATCH = 500
+    # Every key of a room expires once the room stays idle for this long, 0
+    # keeps them until the room is removed
+    ROOM_TTL = 3600  # in seconds
+    # Rooms of each shard of the games index the sweeper looks at per run
+    ROOM_SWEEP_BATCH = 500
+    # Rooms torn down at once by watch_expiries, or whatever expired meanwhile
+    ROOM_TEARDOWN_BATCH = 100
+    ROOM_TEARDOWN_WINDOW = 1  # in seconds
+    # Transitions kept in the stream of every game, 0 keeps none
+    EVENT_STREAM_MAXLEN = 100
+    # Rooms whose pending timer or close is this late are recovered, at most a
+    # batch per shard of the deadlines index each run
+    RECOVERY_GRACE = 10  # in seconds
+    RECOVERY_BATCH = 500
+    # Every pool process of the Celery workers serves its metrics on this port
+    # plus its index, 0 serves none
+    WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+    # Readiness is checked in the background this often, 0 always reports ready
+    READINESS_CHECK_INTERVAL = 5  # in seconds
+    # Not ready past this load: greenthreads parked on the hub, how late it runs
+    # them. 0 ignores it
+    READINESS_MAX_GREENLETS = 10000
+    READINESS_MAX_LOOP_LAG = 500  # in milliseconds
+    # Let spectators vote on the captions alongside the players
+    AUDIENCE_VOTING = False
 
 
 class DevelopmentConfig(Config):
@@ -24,6 +83,9 @@ class DevelopmentConfig(Config):
 
 class ProductionConfig(Config):
     TIME_DELAY = 5
+    RECONNECT_GRACE_PERIOD = 15
+    DISCONNECT_COALESCE_WINDOW = 0.5
+    PRESENCE_TIMEOUT = 45
 
 
 class TestingConfig(Config):
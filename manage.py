@@ -84,5 +84,82 @@ def test():
     pass
 
 
+@manager.command
+def bench_rules(transitions=1000000):
+    """Measure how many transitions per second the rules engine applies"""
+    from captionthis import bench
+
+    rate = bench.rules(int(transitions))
+    print(f"{rate:,.0f} transitions/s")
+
+
+@manager.command
+def bench_audience(watchers=1000):
+    """Load a room with spectators, needs a Redis server"""
+    from captionthis import bench
+
+    for name, value in bench.audience(int(watchers)).items():
+        print(f"{name}: {value:,.2f}")
+
+
+@manager.command
+def watch_expiries():
+    """Tear rooms down as soon as they expire, run a single one"""
+    from captionthis.teardown import ExpiryListener
+
+    listener = ExpiryListener()
+    listener.init_app(app)
+    with app.app_context():
+        listener.run()
+
+
+@manager.command
+def replay_game(gid):
+    """Print every transition of a game still in its stream"""
+    from captionthis import journal
+
+    with app.app_context():
+        for entry in journal.history(gid):
+            print(f"{entry.id} {type(entry.event).__name__}{tuple(entry.event)}")
+            print(f"  state: {journal.encode_state(entry.state)}")
+            print(f"  effects: {' '.join(name for name, _ in entry.effects)}")
+
+
+@manager.command
+def memory_report(sample=1000):
+    """Account for the memory used per room, needs a Redis server"""
+    from captionthis import bench
+
+    for name, value in bench.memory(int(sample)).items():
+        print(f"{name}: {value:,.2f}")
+
+
+@manager.command
+def bench_churn(rate=100, seconds=60, ttl=10):
+    """Create and abandon rooms, memory must stay bounded, needs a Redis server"""
+    from captionthis import bench
+
+    for name, value in bench.churn(int(rate), int(seconds), int(ttl)).items():
+        print(f"{name}: {value:,.2f}")
+
+
+@manager.command
+def migrate_layout():
+    """Move every game under its hash-tagged keys, safe while games are played"""
+    from captionthis.api.controllerAPI import ControllerAPI
+
+    with app.app_context():
+        print(f"{ControllerAPI.migrate_games()} games migrated")
+
+
+@manager.command
+def bench_layout(rooms=10000, players=5):
+    """Compare the memory used per game by the keys layouts, needs a Redis server"""
+    from captionthis import bench
+
+    for name, value in bench.layout(int(rooms), int(players)).items():
+        print(f"{name}: {value:,.2f}")
+
+
 if __name__ == "__main__":
     manager.run()